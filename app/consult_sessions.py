@@ -0,0 +1,59 @@
+import json
+import secrets
+import threading
+from core.cache import make_cache
+from core.config import (
+    RESPONSE_CACHE_BACKEND, CONSULT_SESSION_TTL, CONSULT_SESSION_SIZE, CONSULT_SESSION_PATH,
+    CONSULT_CONTEXT_TOKENS,
+)
+from core.tokens import truncate_to_tokens
+
+
+class ConsultSessionStore:
+    """
+    AI 顾问会话
+    - 搜索结果上下文在创建会话时存一次 (按 token 预算截断)，之后每轮只传 session_id
+    - 会话内容: {id, user_id, context, summary (早期对话的摘要), turns (最近的原文消息)}
+    - 多 worker 时存在 SQLite 文件里共享；同一进程内同一会话的并发提问按会话加锁串行
+    """
+
+    LOCK_STRIPES = 64
+
+    def __init__(self):
+        self._sessions = make_cache(
+            "sqlite" if RESPONSE_CACHE_BACKEND == "sqlite" else "memory",
+            maxsize=CONSULT_SESSION_SIZE, ttl=CONSULT_SESSION_TTL, path=CONSULT_SESSION_PATH
+        )
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+    def lock(self, session_id: str) -> threading.Lock:
+        return self._locks[hash(session_id) % self.LOCK_STRIPES]
+
+    def create(self, user_id: int, context: str, history: list = None) -> dict:
+        session = {
+            "id": secrets.token_urlsafe(12),
+            "user_id": user_id,
+            "context": truncate_to_tokens(context or "", CONSULT_CONTEXT_TOKENS),
+            "summary": "",
+            "turns": [
+                {"role": str(h.get("role", "user")), "content": str(h.get("content", ""))}
+                for h in (history or []) if h.get("content")
+            ],
+        }
+        print(f"💬 [Consult] 新建会话 {session['id']} (user {user_id})")
+        return session
+
+    def get(self, session_id: str, user_id: int):
+        """:return: 会话；不存在、已过期或不属于该用户时返回 None"""
+        raw = self._sessions.get(f"consult:{session_id}")
+        if raw is None:
+            return None
+        session = json.loads(raw)
+        return session if session.get("user_id") == user_id else None
+
+    def save(self, session: dict):
+        # 每次保存都会刷新过期时间，活跃的会话不会中途失效
+        self._sessions.set(f"consult:{session['id']}", json.dumps(session, ensure_ascii=False))
+
+
+consult_sessions = ConsultSessionStore()
@@ -0,0 +1,72 @@
+from sqlalchemy.exc import IntegrityError
+from core.cache import TTLCache
+from core.config import RECIPE_DETAIL_CACHE_SIZE, IMAGE_CARD_SIZE
+from core.database import SessionLocal
+from core.image_store import image_url
+from core.metrics import span, record_cache
+from . import sql_models
+
+
+class CoverStore:
+    """
+    菜谱 id -> 本地封面 (图片 sha256)
+    - 搜索结果一次 IN 查询批量取整页封面，已有封面的菜谱不再调用生图服务
+    - 封面一旦生成就不会变，进程内缓存不设 TTL，只按容量淘汰
+    """
+
+    def __init__(self, maxsize: int = RECIPE_DETAIL_CACHE_SIZE):
+        self._digests = TTLCache(maxsize=maxsize, ttl=None)
+
+    def get_many(self, recipe_ids: list) -> dict:
+        """:return: {菜谱 id (str): digest}，没有封面的 id 不出现在结果里"""
+        wanted = [str(rid) for rid in dict.fromkeys(recipe_ids) if rid]
+        if not wanted:
+            return {}
+        found, missing = {}, []
+        for rid in wanted:
+            digest = self._digests.get(rid)
+            if digest is not None:
+                found[rid] = digest
+            else:
+                missing.append(rid)
+        record_cache("cover", not missing)
+        if missing:
+            db = SessionLocal()
+            try:
+                with span("db_cover_lookup"):
+                    rows = db.query(sql_models.RecipeCover.recipe_id, sql_models.RecipeCover.digest).filter(
+                        sql_models.RecipeCover.recipe_id.in_(missing)
+                    ).all()
+            finally:
+                db.close()
+            for rid, digest in rows:
+                self._digests.set(rid, digest)
+                found[rid] = digest
+        return found
+
+    def get(self, recipe_id: str):
+        return self.get_many([recipe_id]).get(str(recipe_id))
+
+    def put(self, recipe_id: str, digest: str, source_url: str = None):
+        """记录封面 (并发生成同一菜谱时先写入的为准)"""
+        recipe_id = str(recipe_id)
+        db = SessionLocal()
+        try:
+            db.add(sql_models.RecipeCover(recipe_id=recipe_id, digest=digest, source_url=source_url))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            existing = db.get(sql_models.RecipeCover, recipe_id)
+            digest = existing.digest if existing else digest
+        finally:
+            db.close()
+        self._digests.set(recipe_id, digest)
+        return digest
+
+
+def cover_urls(digest: str) -> tuple:
+    """:return: (原图地址, 卡片缩略图地址)"""
+    return image_url(digest), image_url(digest, IMAGE_CARD_SIZE)
+
+
+cover_store = CoverStore()
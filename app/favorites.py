@@ -0,0 +1,104 @@
+import base64
+from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from . import sql_models
+
+# ================= 收藏 (Favorites) =================
+# 列表使用 keyset 分页：按 (saved_at, id) 倒序，游标里记录上一页最后一条的 (saved_at, id)，
+# 翻页只需要在复合索引 ix_user_favorites_user_saved 上定位一次，和翻到第几页无关。
+
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(saved_at: datetime, fav_id: int) -> str:
+    raw = f"{saved_at.isoformat()}|{fav_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    """:return: (saved_at, id)；游标非法时抛 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        saved_at, fav_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(saved_at), int(fav_id)
+    except Exception:
+        raise ValueError(f"invalid cursor: {cursor}")
+
+
+def list_favorites(db: Session, user_id: int, limit: int = 20, cursor: str = None):
+    """
+    :return: (收藏记录列表, 下一页游标或 None)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = db.query(sql_models.UserFavorite).filter(sql_models.UserFavorite.user_id == user_id)
+
+    if cursor:
+        saved_at, fav_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            sql_models.UserFavorite.saved_at < saved_at,
+            and_(sql_models.UserFavorite.saved_at == saved_at, sql_models.UserFavorite.id < fav_id),
+        ))
+
+    # 多取一条判断是否还有下一页
+    rows = (
+        query.order_by(sql_models.UserFavorite.saved_at.desc(), sql_models.UserFavorite.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].saved_at, rows[-1].id)
+    return rows, next_cursor
+
+
+def add_favorites(db: Session, user_id: int, items: list, names: dict = None, commit: bool = True) -> list:
+    """
+    批量收藏：一条 INSERT ... ON CONFLICT DO NOTHING 写入，已收藏的 (包括并发请求刚写入的) 直接跳过
+    :param items: [FavoriteAdd]
+    :param names: {recipe_id: 菜名}，调用方已查好的菜名，用于补全未传 recipe_name 的条目
+    :param commit: False 时只写入不提交 (由调用方的事务统一提交)
+    :return: 实际新增的 recipe_id 列表
+    """
+    names = names or {}
+    wanted = {}
+    for item in items:
+        wanted.setdefault(item.recipe_id, item.recipe_name or names.get(item.recipe_id))
+    if not wanted:
+        return []
+
+    # 双击、多个标签页同时收藏时由唯一索引 ux_user_favorites_user_recipe 去重，RETURNING 只返回真正插入的行
+    now = datetime.utcnow()
+    stmt = (
+        sqlite_insert(sql_models.UserFavorite)
+        .values([
+            {"user_id": user_id, "recipe_id": rid, "recipe_name": name, "saved_at": now}
+            for rid, name in wanted.items()
+        ])
+        .on_conflict_do_nothing(index_elements=["user_id", "recipe_id"])
+        .returning(sql_models.UserFavorite.recipe_id)
+    )
+    new_ids = [rid for (rid,) in db.execute(stmt)]
+    if commit:
+        db.commit()
+    return new_ids
+
+
+def remove_favorites(db: Session, user_id: int, recipe_ids: list, commit: bool = True) -> list:
+    """
+    批量取消收藏 (一条 DELETE)
+    :return: 实际删除的 recipe_id 列表
+    """
+    if not recipe_ids:
+        return []
+    query = db.query(sql_models.UserFavorite).filter(
+        sql_models.UserFavorite.user_id == user_id,
+        sql_models.UserFavorite.recipe_id.in_(list(set(recipe_ids))),
+    )
+    removed = [rid for (rid,) in query.with_entities(sql_models.UserFavorite.recipe_id)]
+    query.delete(synchronize_session=False)
+    if commit:
+        db.commit()
+    return removed
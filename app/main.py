@@ -1,26 +1,43 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+import threading
+import time
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
+from fastapi.responses import JSONResponse
 
 # 引入我们定义好的模型和服务
 from .models import QueryRequest, RecipeResponse, RecipeListResponse, ConsultRequest
-from .services import recipe_service
+from .services import recipe_service, to_summary
+from core.config import WARMUP_ON_STARTUP, RECIPE_DETAIL_MAX_AGE
+from core.retriever import warm_up_until_ready, warmup_status, prepare_exclusion, get_docs_by_ids
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 后台线程预热，不阻塞端口监听：存活检查 (/) 立即可用，就绪检查 (/ready) 等预热完成
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warm_up_until_ready, name="aichef-warmup", daemon=True).start()
+    yield
 
 # 初始化 APP
 app = FastAPI(
     title="AIChef RAG API",
     description="智能菜谱检索接口 - 返回包含步骤图的结构化数据",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # --- 数据库初始化 ---
 from . import sql_models
-from core.database import engine, SessionLocal, get_db
+from core.database import engine, SessionLocal, get_db, get_async_db, write_transaction
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import Depends
 
 # 自动创建表结构 (如果不存在)
 sql_models.Base.metadata.create_all(bind=engine)
+# 已存在的表补建新增的列和索引
+sql_models.ensure_columns(engine)
+sql_models.ensure_indexes(engine)
 
 # 初始化默认用户 (方案 A)
 def init_default_user():
@@ -41,34 +58,20 @@ init_default_user()
 
 # --- 用户身份依赖 (User Dependency) ---
 from fastapi import Header
+from .user_cache import user_cache, CachedUser, UserCreationError
+from .taste import taste_store
 
 def get_current_user(
-    x_username: str = Header("default", alias="X-Username"), 
-    db: Session = Depends(get_db)
-):
+    x_username: str = Header("default", alias="X-Username")
+) -> CachedUser:
     """
-    根据请求头 X-Username 获取当前用户对象。
-    如果用户不存在，则自动创建。
+    根据请求头 X-Username 获取当前用户 (带缓存的快照)。
+    如果用户不存在，则自动创建。缓存命中时不访问数据库。
     """
-    # 1. 尝试查找
-    user = db.query(sql_models.User).filter(sql_models.User.username == x_username).first()
-    
-    # 2. 如果不存在，自动注册
-    if not user:
-        print(f"🆕 Creating new user: {x_username}")
-        try:
-            user = sql_models.User(username=x_username, preferences={})
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        except Exception as e:
-            # 防止并发创建冲突
-            db.rollback()
-            user = db.query(sql_models.User).filter(sql_models.User.username == x_username).first()
-            if not user:
-                raise HTTPException(status_code=500, detail="Failed to create user")
-                
-    return user
+    try:
+        return user_cache.get_or_create(x_username)
+    except UserCreationError:
+        raise HTTPException(status_code=500, detail="Failed to create user")
 
 # --- 跨域配置 (CORS) ---
 # 允许前端 (Vue/React/小程序) 访问接口
@@ -80,15 +83,96 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- 指标 (Metrics) ---
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+from core.metrics import REQUEST_SECONDS, render_latest
+
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    """按路由模板记录接口耗时 (例如 /api/favorites，而不是带参数的原始路径)"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=status)
+
+# --- 准入控制 (Admission Control) ---
+# shed 模式下 LLM / 生图名额和排队都满时，服务层抛出 Overloaded，这里快速返回 503
+from core.admission import Overloaded
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "服务繁忙，请稍后再试"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus 指标 (文本格式)：各阶段耗时、接口耗时、外部接口调用 / 重试、缓存命中率"""
+    return PlainTextResponse(render_latest(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- 按需性能剖析 (Profiling) ---
+# 未设置 AICHEF_PROFILE_TOKEN / AICHEF_PROFILE_SAMPLE_RATE 时中间件和接口都不注册
+from core.profiling import PROFILING_ENABLED, profiled
+if PROFILING_ENABLED:
+    from fastapi.responses import FileResponse
+    from core import profiling
+
+    @app.middleware("http")
+    async def select_profiled_requests(request: Request, call_next):
+        holder, token = profiling.begin_request(request.headers.get("X-Profile"))
+        try:
+            response = await call_next(request)
+        finally:
+            profiling.end_request(token)
+        if holder is not None and holder["id"]:
+            response.headers["X-Profile-Id"] = holder["id"]
+            # sampling = pyinstrument 采样；tracing = 未安装 pyinstrument 时的 cProfile (非采样，开销大)
+            response.headers["X-Profile-Kind"] = profiling.PROFILE_KIND
+        return response
+
+    @app.get("/api/admin/profiles/{profile_id}")
+    def get_profile(profile_id: str, x_profile: str = Header(None, alias="X-Profile")):
+        """取回某次请求的剖析结果 (需要管理员 token)"""
+        if not profiling.is_admin(x_profile):
+            raise HTTPException(status_code=403, detail="需要管理员权限")
+        path, kind = profiling.find_profile(profile_id)
+        if path is None:
+            raise HTTPException(status_code=404, detail="剖析结果不存在")
+        if kind == "html":
+            return FileResponse(path, media_type="text/html")
+        return PlainTextResponse(profiling.render_cprofile(path))
+
 @app.get("/")
 def health_check():
-    """健康检查接口"""
+    """健康检查接口 (存活检查：进程在运行即可)"""
     return {"status": "ok", "message": "AIChef API is running!"}
 
+@app.get("/ready")
+def readiness_check():
+    """就绪检查接口：模型和向量库预热完成前返回 503"""
+    # 关闭预热时保持原来的懒加载行为，视为随时就绪
+    status = warmup_status() if WARMUP_ON_STARTUP else "ready"
+    if status != "ready":
+        return JSONResponse(status_code=503, content={"status": status})
+    return {"status": "ready"}
+
+# 普通 def：在线程池里执行，阻塞的检索 / LLM 调用不会卡住事件循环，
+# 相同的并发搜索才能在 single-flight 层合并
 @app.post("/api/search", response_model=RecipeListResponse)
-async def search_recipe(
+@profiled("search")
+def search_recipe(
     request: QueryRequest, 
-    current_user: sql_models.User = Depends(get_current_user) # 注入当前用户
+    response: Response,
+    current_user: CachedUser = Depends(get_current_user) # 注入当前用户
 ):
     """
     🔍 核心搜索接口 - 支持返回列表
@@ -96,16 +180,38 @@ async def search_recipe(
     if not request.query.strip():
         raise HTTPException(status_code=400, detail="搜索词不能为空")
 
+    # 翻页：直接从第一页保存的快照里取下一段，不重新检索
+    if request.cursor:
+        try:
+            page = recipe_service.get_recipe_page(
+                request.cursor, request.limit, user_id=current_user.id, preferences=current_user.preferences or {}
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="分页游标无效或已过期，请重新搜索")
+        return to_summary(page) if request.summary_only else page
+
     # 获取当前用户的偏好
     user_prefs = current_user.preferences or {}
     print(f"👤 [Search] User: {current_user.username}, Prefs: {user_prefs}")
 
+    meta = {}
     result = recipe_service.get_recipe_list_response(
         request.query, 
         request.limit, 
         request.refinement,
-        preferences=user_prefs
+        preferences=user_prefs,
+        taste=taste_store.get(current_user.id),
+        meta=meta,
+        user_id=current_user.id
     )
+    # 结果缓存状态: HIT / MISS / COALESCED / BYPASS
+    response.headers["X-Cache"] = meta.get("cache", "BYPASS")
+    # 召回扩大倍数 (实际检索条数 / limit)，便于调整自适应召回参数
+    if "overfetch_ratio" in meta:
+        response.headers["X-Overfetch-Ratio"] = f"{meta['overfetch_ratio']:.2f}"
+    # degrade 模式下因名额已满而跳过的外部服务 (该结果缺少 AI 综述 / 封面，不会被缓存)
+    if meta.get("degraded"):
+        response.headers["X-Degraded"] = ",".join(meta["degraded"])
     
     # 404 处理
     if not result or not result.candidates:
@@ -114,43 +220,244 @@ async def search_recipe(
             detail=f"抱歉，暂未收录关于“{request.query}”的菜谱，请尝试其他关键词。"
         )
     
+    return to_summary(result) if request.summary_only else result
+
+from .models import BatchSearchRequest, BatchSearchResponse
+from core.config import BATCH_SEARCH_MAX_QUERIES
+
+@app.post("/api/search/batch", response_model=BatchSearchResponse)
+@profiled("search_batch")
+def search_recipes_batch(
+    request: BatchSearchRequest,
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """
+    📅 批量搜索 (例如一周的晚餐)：用户、偏好和口味只解析一次，所有搜索词一次批量向量化、一起检索。
+    include_covers / include_summary 为 false 时跳过现场生图和每个搜索词的 AI 综述。
+    results 与 queries 一一对应，没有结果的搜索词对应 candidates 为空的列表。
+    """
+    queries = [q.strip() for q in request.queries]
+    if not queries or not all(queries):
+        raise HTTPException(status_code=400, detail="搜索词不能为空")
+    if len(queries) > BATCH_SEARCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"一次最多搜索 {BATCH_SEARCH_MAX_QUERIES} 个搜索词")
+
+    user_prefs = current_user.preferences or {}
+    print(f"👤 [Search] User: {current_user.username}, 批量 {len(queries)} 个搜索词")
+    results = recipe_service.get_recipe_list_responses(
+        queries,
+        request.limit,
+        preferences=user_prefs,
+        taste=taste_store.get(current_user.id),
+        covers=request.include_covers,
+        summary=request.include_summary,
+        user_id=current_user.id,
+    )
+    results = [r if r is not None else RecipeListResponse(candidates=[]) for r in results]
+    if request.summary_only:
+        results = [to_summary(r) for r in results]
+    return BatchSearchResponse(results=results)
+
+from .models import IngredientSearchRequest, IngredientSearchResponse
+
+@app.post("/api/search/ingredients", response_model=IngredientSearchResponse)
+def search_by_ingredients(
+    request: IngredientSearchRequest,
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """
+    🥚 按食材搜索："家里有鸡蛋、番茄、葱，能做什么？"
+    按还缺几种食材升序、用到的食材数降序排列 (食材位图索引，不走向量检索)
+    """
+    ingredients = [i for i in request.ingredients if i and i.strip()]
+    if not ingredients:
+        raise HTTPException(status_code=400, detail="请至少提供一种食材")
+
+    result = recipe_service.search_by_ingredients(
+        ingredients, request.limit, request.max_missing, preferences=current_user.preferences or {}
+    )
+    if result is None:
+        raise HTTPException(status_code=503, detail="食材索引尚未生成，请先运行 python -m core.ingredient_index build")
     return result
 
-@app.post("/api/consult")
-async def consult_chef_api(request: ConsultRequest):
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 使用弱比较：忽略 W/ 前缀，支持逗号分隔的多个值和 *"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+@app.get("/api/recipe/{recipe_id}", response_model=RecipeResponse)
+def get_recipe_detail(
+    recipe_id: str,
+    if_none_match: str = Header(None, alias="If-None-Match")
+):
+    """
+    菜谱详情 (含全部步骤)。带强 ETag 和 Cache-Control，
+    重复访问由浏览器 / CDN 缓存直接返回，或者 If-None-Match 命中时返回 304。
+    """
+    entry = recipe_service.get_recipe_detail(recipe_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="菜谱不存在")
+    body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={RECIPE_DETAIL_MAX_AGE}"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+from fastapi.responses import FileResponse
+from core import image_store
+
+def _image_response(digest: str, size: int = None, if_none_match: str = None):
+    """本地封面：文件名即内容哈希，内容永不改变，可以长期缓存"""
+    path, media_type = image_store.find(digest, size)
+    if path is None:
+        raise HTTPException(status_code=404, detail="图片不存在")
+    etag = f'"{digest}-{size}"' if size else f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@app.get("/api/images/{digest}")
+def get_image(digest: str, if_none_match: str = Header(None, alias="If-None-Match")):
+    return _image_response(digest, if_none_match=if_none_match)
+
+@app.get("/api/images/{digest}/{size}")
+def get_image_thumbnail(digest: str, size: int, if_none_match: str = Header(None, alias="If-None-Match")):
+    """缩略图；该尺寸未生成 (例如服务器未安装 Pillow) 时返回原图"""
+    return _image_response(digest, size, if_none_match)
+
+from .models import ConsultResponse
+from .consult_sessions import consult_sessions
+
+# 普通 def：LLM 调用和会话锁都是阻塞的，放在线程池里执行
+@app.post("/api/consult", response_model=ConsultResponse)
+@profiled("consult")
+def consult_chef_api(
+    request: ConsultRequest,
+    current_user: CachedUser = Depends(get_current_user)
+):
     """
     AI 厨师交互接口
+    第一轮传 context (可带 history)，返回 session_id；之后每轮只传 session_id + query，
+    上下文和对话历史保存在服务端，每轮发给 LLM 的 prompt 有固定的 token 上限
     """
     if not request.query.strip():
         raise HTTPException(status_code=400, detail="问题不能为空")
 
-    reply = recipe_service.consult_chef(request.query, request.context, request.history)
-    return {"reply": reply}
+    if request.session_id:
+        session_id = request.session_id
+    else:
+        session = consult_sessions.create(current_user.id, request.context, request.history)
+        session_id = session["id"]
+        consult_sessions.save(session)
+
+    with consult_sessions.lock(session_id):
+        # 在锁内读取，拿到同一会话上一轮保存后的历史
+        session = consult_sessions.get(session_id, current_user.id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="会话不存在或已过期，请重新开始对话")
+        reply = recipe_service.consult_in_session(session, request.query)
+        consult_sessions.save(session)
+    return {"reply": reply, "session_id": session_id}
 
 from .models import UserProfile
 # --- 用户相关接口 ---
 @app.get("/api/user/profile")
-def get_user_profile(user: sql_models.User = Depends(get_current_user)):
+def get_user_profile(user: CachedUser = Depends(get_current_user)):
     """获取当前用户的配置"""
     return {"username": user.username, "preferences": user.preferences}
 
 @app.post("/api/user/profile")
-def update_user_profile(
+async def update_user_profile(
     profile: UserProfile, 
-    user: sql_models.User = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    user: CachedUser = Depends(get_current_user), 
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """更新用户偏好设置"""
+    """更新用户偏好设置 (异步会话：等待数据库写锁时不占用线程池)"""
+    db_user = await db.get(sql_models.User, user.id)
+    if db_user is None:
+        user_cache.invalidate(user.username)
+        raise HTTPException(status_code=404, detail="用户不存在")
     
     # Update preferences
     if profile.preferences is not None:
-         user.preferences = profile.preferences
+         db_user.preferences = profile.preferences
     
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    await db.refresh(db_user)
+    # 写穿缓存，后续搜索立即使用新偏好
+    user = user_cache.put(db_user)
+    # 预先编译忌口排除集 (共享索引模式下还要扫描整个菜谱库生成掩码)，放到后台线程，不拖慢保存
+    threading.Thread(target=prepare_exclusion, args=(user.preferences,), daemon=True).start()
     return {"message": "Profile updated", "preferences": user.preferences}
 
+# --- 收藏相关接口 ---
+from .models import FavoriteBatchRequest, FavoriteBatchResponse, FavoriteItem, FavoriteListResponse
+from . import favorites
+
+@app.get("/api/favorites", response_model=FavoriteListResponse)
+def list_favorites(
+    limit: int = 20,
+    cursor: str = None,
+    user: CachedUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    收藏列表 (keyset 分页)
+    首次请求不带 cursor，之后把上一页返回的 next_cursor 原样传回即可
+    """
+    try:
+        rows, next_cursor = favorites.list_favorites(db, user.id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+    # 一次批量查询补全整页菜谱详情
+    details = recipe_service.get_recipes_by_ids([row.recipe_id for row in rows])
+    items = [
+        FavoriteItem(
+            recipe_id=row.recipe_id,
+            recipe_name=row.recipe_name,
+            saved_at=row.saved_at,
+            recipe=details.get(row.recipe_id)
+        )
+        for row in rows
+    ]
+    return FavoriteListResponse(items=items, next_cursor=next_cursor)
+
+@app.post("/api/favorites/batch", response_model=FavoriteBatchResponse)
+def batch_update_favorites(
+    request: FavoriteBatchRequest,
+    user: CachedUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """批量收藏 / 取消收藏"""
+    # 只收藏菜谱库里存在的菜谱 (一次批量查询)，同时补全没传菜名的条目
+    known = get_docs_by_ids([item.recipe_id for item in request.add])
+    if request.add and not known and warmup_status() != "ready":
+        # 向量库还没加载好时无法校验，不能把所有菜谱都当成不存在
+        raise HTTPException(status_code=503, detail="菜谱库尚未就绪，请稍后重试")
+    to_add = [item for item in request.add if item.recipe_id in known]
+    unknown = list(dict.fromkeys(item.recipe_id for item in request.add if item.recipe_id not in known))
+    names = {rid: doc.get('name') for rid, doc in known.items()}
+
+    # 收藏变化和口味向量的增量更新在同一个写事务里提交，并发修改同一用户的收藏时不会丢失更新
+    vectors = taste_store.prefetch([item.recipe_id for item in to_add] + list(request.remove))
+    with write_transaction(db):
+        added = favorites.add_favorites(db, user.id, to_add, names, commit=False)
+        removed = favorites.remove_favorites(db, user.id, request.remove, commit=False)
+        # 增量更新口味向量 (只处理这次真正变化的收藏)
+        needs_rebuild = taste_store.apply(db, user.id, added, removed, vectors=vectors)
+    if needs_rebuild:
+        # 计数对不上时在写锁外按全部收藏重新计算
+        taste_store.rebuild(user.id)
+    if added or removed:
+        taste_store.invalidate(user.id)
+    return FavoriteBatchResponse(added=len(added), removed=len(removed), unknown=unknown)
+
 # 仅用于直接调试 main.py 时使用
 # 实际建议在根目录用 run.py 启动
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,12 +1,22 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
+from datetime import datetime
 
 # --- 请求模型 ---
 class QueryRequest(BaseModel):
     query: str
     limit: int = 5
     refinement: Optional[str] = None # 用户在聊天框补充的改进意见
+    cursor: Optional[str] = None # 翻页游标，传入上一页返回的 next_cursor
+    summary_only: bool = False # 只返回列表卡片需要的字段 (steps 置空)，详情走 GET /api/recipe/{id}
     
+class BatchSearchRequest(BaseModel):
+    queries: List[str] # e.g. 一周晚餐: ["红烧肉", "清蒸鱼", ...]
+    limit: int = 5
+    include_covers: bool = True # False 时只带已有的本地封面，不现场生图
+    include_summary: bool = True # False 时不为每个搜索词生成 AI 综述
+    summary_only: bool = False # 同 QueryRequest.summary_only
+
 class UserProfile(BaseModel):
     preferences: Optional[dict] = None # e.g. {"allergies": [], "dislikes": []}
 
@@ -25,15 +35,67 @@ class RecipeResponse(BaseModel):
     cover_image: Optional[str]
     steps: List[RecipeStep]
     message: str
+    cover_thumbnail: Optional[str] = None # 本地缩略图地址 (列表卡片用)，封面未镜像到本地时为 None
 
 class RecipeListResponse(BaseModel):
     candidates: List[RecipeResponse]
     ai_message: Optional[str] = None
+    next_cursor: Optional[str] = None # 为 None 表示没有下一页
+
+# 与 BatchSearchRequest.queries 一一对应；没有结果的搜索词对应 candidates 为空的列表
+class BatchSearchResponse(BaseModel):
+    results: List[RecipeListResponse]
+
+# --- 按食材搜索 ("家里有这些食材能做什么") ---
+class IngredientSearchRequest(BaseModel):
+    ingredients: List[str] # e.g. ["鸡蛋", "番茄", "葱"]
+    limit: int = Field(default=10, ge=1, le=100)
+    max_missing: Optional[int] = Field(default=None, ge=0) # 最多还缺几种食材，不传表示不限
+
+class IngredientMatch(BaseModel):
+    recipe_id: str
+    recipe_name: str
+    tags: List[str]
+    cover_image: Optional[str] = None # 已有本地封面时返回，按食材搜索不现场生图
+    cover_thumbnail: Optional[str] = None
+    matched: List[str] # 用到了哪些用户的食材
+    missing: List[str] # 还缺哪些食材
+    coverage: float # 菜谱食材中用户已有的比例
+
+class IngredientSearchResponse(BaseModel):
+    candidates: List[IngredientMatch]
+    unknown: List[str] = [] # 菜谱库里没有出现过的食材 (可能是写法不同)
 
 class ConsultRequest(BaseModel):
     query: str
-    context: str
-    history: List[dict] # [{"role": "user", "content": "..."}]
+    session_id: Optional[str] = None # 上一轮返回的会话 id；传了就不必再传 context / history
+    context: str = "" # 搜索结果上下文，只在开始新会话时需要
+    history: List[dict] = [] # [{"role": "user", "content": "..."}]，开始新会话时可带入已有对话
 
 class ConsultResponse(BaseModel):
-    reply: str
\ No newline at end of file
+    reply: str
+    session_id: Optional[str] = None
+
+# --- 收藏 (Favorites) ---
+class FavoriteAdd(BaseModel):
+    recipe_id: str
+    recipe_name: Optional[str] = None # 冗余存储，方便展示；不传则从菜谱库补全
+
+class FavoriteBatchRequest(BaseModel):
+    add: List[FavoriteAdd] = Field(default=[], max_length=100)
+    remove: List[str] = Field(default=[], max_length=100) # 要取消收藏的 recipe_id
+
+class FavoriteBatchResponse(BaseModel):
+    added: int
+    removed: int
+    unknown: List[str] = [] # 菜谱库里不存在、没有收藏的 recipe_id
+
+class FavoriteItem(BaseModel):
+    recipe_id: str
+    recipe_name: Optional[str]
+    saved_at: datetime
+    recipe: Optional[RecipeResponse] = None # 菜谱详情 (批量补全，找不到时为 None)
+
+class FavoriteListResponse(BaseModel):
+    items: List[FavoriteItem]
+    next_cursor: Optional[str] = None # 为 None 表示没有下一页
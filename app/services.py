@@ -1,66 +1,182 @@
+import base64
+import hashlib
 import json
 import difflib
-import json
-import difflib
+import secrets
 import time
+import unicodedata
 from typing import Optional
-from .models import RecipeStep, RecipeResponse, RecipeListResponse
-from core.retriever import retrieve_docs
+from .models import RecipeStep, RecipeResponse, RecipeListResponse, IngredientMatch, IngredientSearchResponse
+from core.retriever import retrieve_docs, retrieve_docs_batch, get_docs_by_ids
+from core.exclusion import get_exclusion
+from core.personalize import rerank, taste_key
+from core.reranker import doc_ingredients
+from core.query_rules import rewrite_locally
+from core.cache import make_cache, stable_hash, TTLCache
+from core.singleflight import flights
+from core.image_store import mirror
+from core.admission import admission
+from core.metrics import span, timed, record_cache, CACHE_REQUESTS, OVERFETCH_RATIO, PROVIDER_CALLS
+from core.config import (
+    RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_PATH,
+    SEARCH_SNAPSHOT_TTL, SEARCH_SNAPSHOT_SIZE, SEARCH_SNAPSHOT_PATH,
+    QUERY_REWRITE_CACHE_BACKEND, QUERY_REWRITE_CACHE_TTL, QUERY_REWRITE_CACHE_SIZE, QUERY_REWRITE_CACHE_PATH,
+    OVERFETCH_INITIAL_FACTOR, OVERFETCH_GROWTH, OVERFETCH_MAX_K,
+    RECIPE_DETAIL_CACHE_SIZE, RECIPE_DETAIL_MAX_AGE,
+    CONSULT_CONTEXT_TOKENS, CONSULT_HISTORY_TOKENS, CONSULT_SUMMARY_TOKENS, CONSULT_KEEP_MESSAGES,
+)
 # ✅ 引入新的优选函数
-from core.generator import smart_select_and_comment, generate_rag_answer, generate_food_image, refine_prompt_with_llm 
-from langchain_openai import ChatOpenAI
-from core.config import LLM_API_KEY, LLM_BASE_URL, LLM_MODEL_NAME
+from core.generator import smart_select_and_comment, generate_rag_answer, generate_food_image, refine_prompt_with_llm, get_llm, summarize_conversation, note_rate_limit
+from core.tokens import estimate_tokens, truncate_to_tokens
+from .covers import cover_store, cover_urls
+
+def parse_doc_fields(doc: dict):
+    """
+    数据清洗：Chroma 里 tags / instructions 存的是 JSON 字符串，这里还原回列表
+    :return: (tags, 格式化后的步骤列表)
+    """
+    raw_instructions = doc.get('instructions', [])
+    if isinstance(raw_instructions, str):
+        try: raw_instructions = json.loads(raw_instructions)
+        except: raw_instructions = []
+
+    raw_tags = doc.get('tags', [])
+    if isinstance(raw_tags, str):
+        try: raw_tags = json.loads(raw_tags)
+        except: raw_tags = []
+
+    formatted_steps = []
+    for idx, step in enumerate(raw_instructions or []):
+        img_link = step.get('image_url') or step.get('imgLink')
+        if not img_link or img_link == "null": img_link = None
+        
+        formatted_steps.append(
+            RecipeStep(
+                step_index=idx + 1,
+                description=step.get('description', ''),
+                image_url=img_link
+            )
+        )
+    return raw_tags or [], formatted_steps
+
+
+def to_recipe_response(doc: dict, message: str = "", cover_image: str = None, cover_thumbnail: str = None) -> RecipeResponse:
+    raw_tags, formatted_steps = parse_doc_fields(doc)
+    return RecipeResponse(
+        recipe_id=str(doc.get('id', 'unknown')),
+        recipe_name=doc.get('name', '未命名'),
+        tags=raw_tags,
+        cover_image=cover_image,
+        cover_thumbnail=cover_thumbnail,
+        steps=formatted_steps,
+        message=message
+    )
+
+
+def to_summary(result: RecipeListResponse) -> RecipeListResponse:
+    """精简列表：去掉每个候选的步骤 (列表页只展示名称、标签和封面)"""
+    return result.model_copy(update={
+        "candidates": [c.model_copy(update={"steps": []}) for c in result.candidates]
+    })
+
+
+def normalize_query(text: str) -> str:
+    """缓存 key 用：全角转半角、去首尾空白、合并连续空白、小写"""
+    if not text:
+        return ""
+    return " ".join(unicodedata.normalize("NFKC", text).split()).lower()
+
+
+def encode_page_cursor(token: str, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{token}|{offset}".encode("utf-8")).decode("ascii")
+
+
+def decode_page_cursor(cursor: str):
+    """:return: (快照 token, 偏移量)；游标非法时抛 ValueError"""
+    try:
+        token, offset = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rsplit("|", 1)
+        offset = int(offset)
+    except Exception:
+        raise ValueError(f"invalid cursor: {cursor}")
+    if offset < 0:
+        raise ValueError(f"invalid cursor: {cursor}")
+    return token, offset
+
 
 class RecipeService:
     def __init__(self):
-        # 初始化 LLM 客户端
-        self.llm = None
-        if LLM_API_KEY:
-            self.llm = ChatOpenAI(model=LLM_MODEL_NAME, api_key=LLM_API_KEY, base_url=LLM_BASE_URL, temperature=0.7)
+        # 搜索结果缓存 (memory / sqlite / off)，值为 RecipeListResponse 的 JSON
+        self._response_cache = make_cache(
+            RESPONSE_CACHE_BACKEND, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, path=RESPONSE_CACHE_PATH
+        )
+        # 菜谱详情：已序列化的 JSON 与强 ETag (其他 worker 生成封面后靠 TTL 收敛)
+        self._details = TTLCache(maxsize=RECIPE_DETAIL_CACHE_SIZE, ttl=RECIPE_DETAIL_MAX_AGE)
+        # 翻页快照：结果缓存关闭时仍使用进程内缓存，多 worker 时与结果缓存一样放在 SQLite 文件里共享
+        self._snapshots = make_cache(
+            "sqlite" if RESPONSE_CACHE_BACKEND == "sqlite" else "memory",
+            maxsize=SEARCH_SNAPSHOT_SIZE, ttl=SEARCH_SNAPSHOT_TTL, path=SEARCH_SNAPSHOT_PATH
+        )
+        # 搜索词改写缓存：(搜索词, 改进意见) -> LLM 改写结果
+        self._rewrites = make_cache(
+            QUERY_REWRITE_CACHE_BACKEND, maxsize=QUERY_REWRITE_CACHE_SIZE, ttl=QUERY_REWRITE_CACHE_TTL, path=QUERY_REWRITE_CACHE_PATH
+        )
 
-    def get_recipe_response(self, query: str) -> Optional[RecipeResponse]:
+    @property
+    def llm(self):
+        # 与 generator 共用同一个 LLM 客户端，首次使用时才加载 langchain_openai
+        return get_llm()
+
+    def get_recipes_by_ids(self, recipe_ids: list) -> dict:
+        """
+        批量获取菜谱详情 (一次批量查询，不是每个 id 查一次向量库)
+        :return: {recipe_id: RecipeResponse}
+        """
+        docs = get_docs_by_ids(recipe_ids)
+        covers = cover_store.get_many(list(docs))
+        results = {}
+        for rid, doc in docs.items():
+            cover_image, cover_thumbnail = cover_urls(covers[rid]) if rid in covers else (None, None)
+            results[rid] = to_recipe_response(doc, cover_image=cover_image, cover_thumbnail=cover_thumbnail)
+        return results
+
+    def get_recipe_detail(self, recipe_id: str):
+        """
+        菜谱详情 (从预解码的文档库读取，序列化结果按 id 缓存)
+        :return: (JSON bytes, 强 ETag)；菜谱不存在时返回 None
+        """
+        entry = self._details.get(recipe_id)
+        if entry is None:
+            doc = get_docs_by_ids([recipe_id]).get(str(recipe_id))
+            if doc is None:
+                return None
+            digest = cover_store.get(recipe_id)
+            cover_image, cover_thumbnail = cover_urls(digest) if digest else (None, None)
+            body = to_recipe_response(doc, cover_image=cover_image, cover_thumbnail=cover_thumbnail).model_dump_json().encode("utf-8")
+            entry = (body, '"' + hashlib.sha1(body).hexdigest() + '"')
+            self._details.set(recipe_id, entry)
+        return entry
+
+    def get_recipe_response(self, query: str, preferences: dict = None) -> Optional[RecipeResponse]:
         print(f"🔍 [Service] 用户搜索: {query}")
         
-        # 1. 【扩大召回】从数据库拿 Top 3，而不是 Top 1
-        # 这样即使向量检索把最佳结果排在了第 2 或 第 3，AI 也能把它捞回来
-        candidates = retrieve_docs(query, top_k=6)
+        # 1. 【扩大召回】从数据库拿 Top 6，而不是 Top 1
+        # 这样即使向量检索把最佳结果排在了第 2 或 第 3，本地优选也能把它捞回来
+        exclusion = get_exclusion(preferences) if preferences else None
+        candidates = retrieve_docs(query, top_k=6, exclusion=exclusion)
+        if not candidates:
+            return None
         
-        # 2. 【AI 优选】让大模型来挑，并生成推荐语
+        # 2. 【本地优选】按食材 / 标签 / 相似度 / 忌口打分选出最佳，LLM 只写推荐语
         # 返回值: (选中的索引, 推荐语)
-        selected_index, ai_message = smart_select_and_comment(query, candidates)
-        
-        # 确保索引不越界 (防止 AI 瞎返回 "index: 99")
-        if selected_index < 0 or selected_index >= len(candidates):
-            selected_index = 0
+        selected_index, ai_message = smart_select_and_comment(query, candidates, exclusion=exclusion)
             
         # 3. 锁定最终的最佳菜谱
         best_match = candidates[selected_index]
-        print(f"🎯 [Service] AI 选中了第 {selected_index} 项: {best_match['name']}")
+        print(f"🎯 [Service] 选中了第 {selected_index} 项: {best_match['name']}")
 
 
         # === 数据清洗与解析 ===
-        raw_instructions = best_match.get('instructions', [])
-        if isinstance(raw_instructions, str):
-            try: raw_instructions = json.loads(raw_instructions)
-            except: raw_instructions = []
-
-        raw_tags = best_match.get('tags', [])
-        if isinstance(raw_tags, str):
-            try: raw_tags = json.loads(raw_tags)
-            except: raw_tags = []
-
-        formatted_steps = []
-        for idx, step in enumerate(raw_instructions):
-            img_link = step.get('image_url') or step.get('imgLink')
-            if not img_link or img_link == "null": img_link = None
-            
-            formatted_steps.append(
-                RecipeStep(
-                    step_index=idx + 1,
-                    description=step.get('description', ''),
-                    image_url=img_link
-                )
-            )
+        raw_tags, _ = parse_doc_fields(best_match)
 
         # === 核心修改：强制现场生成一张，因为数据库里的图不可用 ===
         # cover_image = best_match.get('image') # 忽略旧图
@@ -68,34 +184,84 @@ class RecipeService:
         # 构造Prompt: 菜名 + 标签
         # gen_prompt = f"{best_match.get('name', '')}, {','.join(raw_tags)}"
          
-        # LLM 优化
-        refined_prompt = refine_prompt_with_llm(best_match.get('name', ''), raw_tags)
-        generated_url = generate_food_image(refined_prompt, is_refined=True)
-        
-        if generated_url:
-            cover_image = generated_url
+        # 已有本地封面时直接复用，否则 LLM 优化 + 生图 (同一道菜的并发生图只执行一次)
+        # 生图失败时 cover_image 为 None
+        digest = cover_store.get(best_match.get('id'))
+        if digest:
+            cover_image, cover_thumbnail = cover_urls(digest)
         else:
-            # 兜底：如果生图失败，暂时还是返回 None (或者原来的图，看需求)
-            cover_image = None
-                 # TODO: 这里应该异步把 cover_image 存回数据库，避免每次都生成
-                 # 为了演示方便，暂时只返回给前端显示
-
-        return RecipeResponse(
-            recipe_id=str(best_match.get('id', 'unknown')),
-            recipe_name=best_match.get('name', '未命名'),
-            tags=raw_tags,
-            cover_image=cover_image,
-            steps=formatted_steps,
-            message=ai_message # 这里是 AI 针对选中菜谱写的推荐语
-        )
+            (cover_image, cover_thumbnail), _ = self._generate_cover(best_match.get('id'), best_match.get('name', ''), raw_tags)
 
+        # message 是 AI 针对选中菜谱写的推荐语
+        return to_recipe_response(best_match, message=ai_message, cover_image=cover_image, cover_thumbnail=cover_thumbnail)
+
+    def _generate_cover(self, recipe_id, recipe_name: str, tags: list):
+        """
+        为菜谱生成封面：LLM 优化 Prompt (防幻觉) + 调用生图 (带重试)。
+        按菜谱 id 合并并发请求，多个用户同时搜到同一道菜时只生成一次。
+        生成后下载到本地镜像并记录下来，之后的搜索直接复用，不再调用生图服务。
+        :return: ((原图 URL, 缩略图 URL), 是否复用了其他请求的结果)；
+                 生图失败时为 (None, None)，镜像失败时退回生图服务的 URL、没有缩略图
+        """
+        def run():
+            # 生图名额已满时不必先花一次 LLM 调用优化 Prompt
+            if not admission.probe("image"):
+                return None, None
+            print(f"🧠 [List] Refining prompt for: {recipe_name}...")
+            refined_prompt, _ = flights.do(
+                f"refine:{stable_hash([recipe_name, tags])}", refine_prompt_with_llm, recipe_name, tags
+            )
+            print(f"🎨 [List] Generating image (Serial)...")
+            url = generate_food_image(refined_prompt, is_refined=True)
+            if not url:
+                return None, None
+            with span("image_mirror"):
+                digest = mirror(url)
+            if not digest:
+                return url, None
+            if recipe_id:
+                digest = cover_store.put(recipe_id, digest, url)
+                # 已缓存的详情里还没有封面
+                self._details.pop(str(recipe_id))
+            return cover_urls(digest)
+
+        url, shared = flights.do(f"cover:{recipe_id or recipe_name}", run)
+        if shared:
+            CACHE_REQUESTS.inc(cache="cover", result="coalesced")
+        return url, shared
+
+    @timed("query_optimization")
     def _optimize_query(self, query: str, refinement: str) -> str:
         """
         利用 LLM 根据用户反馈优化搜索词
+        常见的意见 ("不要辣" "清淡一点") 按规则表本地改写；LLM 的改写结果按 (搜索词, 意见) 缓存
         """
-        if not self.llm or not refinement:
+        if not refinement:
             return query
-            
+
+        local = rewrite_locally(query, refinement)
+        if local:
+            CACHE_REQUESTS.inc(cache="query_rewrite", result="rule")
+            print(f"🔄 [Service] 搜索词规则改写: '{query}' + '{refinement}' -> '{local}'")
+            return local
+
+        if not self.llm:
+            return query
+
+        key = "rewrite:" + stable_hash([normalize_query(query), normalize_query(refinement)])
+        cached = self._rewrites.get(key) if self._rewrites is not None else None
+        record_cache("query_rewrite", cached is not None)
+        if cached is not None:
+            return cached
+
+        # 同样的改写并发到达时只调用一次 LLM
+        new_query, _ = flights.do(key, self._rewrite_with_llm, query, refinement)
+        if new_query is not None and self._rewrites is not None:
+            self._rewrites.set(key, new_query)
+        return new_query if new_query is not None else query
+
+    def _rewrite_with_llm(self, query: str, refinement: str):
+        """:return: 改写后的搜索词；调用失败时返回 None (失败结果不缓存)"""
         system_prompt = """
         你是一个搜索关键词优化助手。用户正在搜索菜谱，并给出了一些补充调整意见。
         请根据用户的初始搜索词和补充意见，重写一个更精准的搜索关键词。
@@ -108,22 +274,88 @@ class RecipeService:
         
         user_prompt = f"初始搜索词：{query}\n用户补充意见：{refinement}\n\n请重写搜索词："
         
-        try:
-             from langchain_core.messages import SystemMessage, HumanMessage
-             response = self.llm.invoke([
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-             ])
-             new_query = response.content.strip()
-             print(f"🔄 [Service] 搜索词优化: '{query}' + '{refinement}' -> '{new_query}'")
-             return new_query
-        except Exception as e:
-            print(f"⚠️ Query optimization failed: {e}")
-            return query
+        with admission.admit("llm") as admitted:
+            if not admitted:
+                return None
+            try:
+                 from langchain_core.messages import SystemMessage, HumanMessage
+                 response = self.llm.invoke([
+                    SystemMessage(content=system_prompt),
+                    HumanMessage(content=user_prompt)
+                 ])
+                 PROVIDER_CALLS.inc(provider="llm", outcome="ok")
+                 new_query = response.content.strip()
+                 print(f"🔄 [Service] 搜索词优化: '{query}' + '{refinement}' -> '{new_query}'")
+                 return new_query or None
+            except Exception as e:
+                PROVIDER_CALLS.inc(provider="llm", outcome="error")
+                note_rate_limit("llm", e)
+                print(f"⚠️ Query optimization failed: {e}")
+                return None
 
-    def get_recipe_list_response(self, query: str, limit: int = 5, refinement: str = None, preferences: dict = None) -> Optional[RecipeListResponse]:
+    @staticmethod
+    def _list_cache_key(query: str, limit: int, refinement: str, preferences: dict, taste) -> str:
+        return "search:" + stable_hash({
+            "query": normalize_query(query),
+            "limit": limit,
+            "refinement": normalize_query(refinement),
+            "preferences": stable_hash(preferences or {}),
+            "taste": taste_key(taste),
+        })
+
+    def get_recipe_list_response(self, query: str, limit: int = 5, refinement: str = None, preferences: dict = None, taste=None, meta: dict = None, user_id: int = None) -> Optional[RecipeListResponse]:
+        """
+        获取多个菜谱推荐列表 (先查结果缓存，未命中再走完整流程)
+        :param taste: 用户口味向量 (收藏菜谱向量的均值)，None 时不做个性化
+        :param user_id: 翻页游标的所有者，只有该用户能用返回的 next_cursor 翻页
+        :param meta: 可选的字典，写入缓存状态 meta["cache"] = "HIT" / "MISS" / "COALESCED" / "BYPASS"
+                     、召回扩大倍数 meta["overfetch_ratio"] 和被降级的外部服务 meta["degraded"]，供接口层设置响应头
+        """
+        meta = meta if meta is not None else {}
+        key = self._list_cache_key(query, limit, refinement, preferences, taste)
+        cached = self._response_cache.get(key) if self._response_cache is not None else None
+        if self._response_cache is not None:
+            record_cache("search_response", cached is not None)
+        if cached is not None:
+            print(f"⚡ [Service] 结果缓存命中: {query}")
+            meta["cache"] = "HIT"
+            return self._claim_cursor(RecipeListResponse.model_validate_json(cached), user_id)
+
+        # 同一 key 的并发请求只执行一次完整流程，其余请求共享结果 (连同 leader 的 meta)
+        (result, leader_meta), shared = flights.do(
+            key, self._build_with_meta, query, limit, refinement, preferences, taste
+        )
+        meta.update(leader_meta)
+        if shared:
+            CACHE_REQUESTS.inc(cache="search_response", result="coalesced")
+            meta["cache"] = "COALESCED"
+            return self._claim_cursor(result.model_copy(deep=True), user_id) if result is not None else None
+        if self._response_cache is None:
+            meta["cache"] = "BYPASS"
+            return self._claim_cursor(result, user_id)
+
+        meta["cache"] = "MISS"
+        # 没有结果 (404) 不缓存，收录新菜谱后可以立即搜到；降级的结果 (缺封面 / 综述) 也不缓存
+        if result is not None and result.candidates and not leader_meta.get("degraded"):
+            self._response_cache.set(key, result.model_dump_json())
+        return self._claim_cursor(result, user_id)
+
+    def _build_with_meta(self, query: str, limit: int, refinement: str, preferences: dict, taste):
+        """
+        single-flight 执行的完整流程：meta 跟结果一起返回，
+        合并进来的请求也能拿到 leader 的召回扩大倍数和降级信息
+        :return: (结果, meta)
+        """
+        meta = {}
+        with admission.watch() as degraded:
+            result = self._build_recipe_list_response(query, limit, refinement, preferences, taste, meta)
+        if degraded:
+            meta["degraded"] = sorted(degraded)
+        return result, meta
+
+    def _build_recipe_list_response(self, query: str, limit: int = 5, refinement: str = None, preferences: dict = None, taste=None, meta: dict = None) -> Optional[RecipeListResponse]:
         """
-        获取多个菜谱推荐列表 (支持去重 + 上下文改进 + 用户偏好过滤)
+        获取多个菜谱推荐列表 (支持去重 + 上下文改进 + 用户偏好过滤 + 个性化排序)
         """
         # 1. 如果有改进意见，先优化搜索词
         search_query = query
@@ -132,21 +364,142 @@ class RecipeService:
             
         print(f"🔍 [Service] 执行搜索: {search_query}, 目标数量: {limit}, 原始Query: {query}, 偏好: {preferences}")
         
-        # 2. 扩大召回 (为了去重，且保证数量够，我们取 3 倍)
+        # 2. 自适应扩大召回 + 3. 去重 (对全部候选去重，第一页之后的结果存入快照，翻页时直接取)
         # 此时传入 user preferences 进行底层过滤
-        candidates = retrieve_docs(search_query, top_k=limit * 3, preferences=preferences)
-        if not candidates:
+        ranked = self._retrieve_ranked(search_query, limit, preferences, taste, meta)
+        if not ranked:
             # 如果优化后的词搜不到，尝试回退到原始词
             if search_query != query:
                 print("⚠️ 优化后的词无结果，回退到原始搜索词...")
-                candidates = retrieve_docs(query, top_k=limit * 3)
+                ranked = self._retrieve_ranked(query, limit, None, taste, meta)
                 
-            if not candidates:
+            if not ranked:
                 return None
-            
-        # 3. 去重与格式化
-        formatted_list = []
-        seen_names = [] # 存 (name, id) 用于比较
+
+        return self._assemble_list_response(query, ranked, limit, refinement)
+
+    def _assemble_list_response(self, query: str, ranked: list, limit: int, refinement: str = None, covers: bool = True, summary: bool = True) -> RecipeListResponse:
+        """
+        把排好序的候选组装成列表响应
+        :param covers: False 时只带已有的本地封面，不现场生图
+        :param summary: False 时不调用 LLM 生成综述 (ai_message 为 None)
+        """
+        formatted_list = [self._to_list_item(doc, refinement) for doc in ranked[:limit]]
+
+        # 4. 串行生成图片 + LLM 防幻觉优化
+        if covers:
+            self._fill_covers(formatted_list)
+        else:
+            self._attach_stored_covers(formatted_list)
+
+        # 5. 生成综述
+        # 注意：这里传给 summarizer 的是原始 query (或者组合 query)，让 AI 知道用户意图
+        list_summary = None
+        if summary:
+            user_intent = query
+            if refinement:
+                user_intent = f"{query} ({refinement})"
+
+            list_summary = generate_rag_answer(user_intent, [
+                {'name': c.recipe_name, 'tags': c.tags} for c in formatted_list
+            ])
+
+        next_cursor = None
+        if len(ranked) > limit:
+            next_cursor = self._save_snapshot(ranked, limit, refinement, list_summary)
+
+        return RecipeListResponse(
+            candidates=formatted_list,
+            ai_message=list_summary,
+            next_cursor=next_cursor
+        )
+
+    def get_recipe_list_responses(self, queries: list, limit: int = 5, preferences: dict = None, taste=None, covers: bool = True, summary: bool = True, user_id: int = None) -> list:
+        """
+        批量搜索 (例如一周的晚餐)：同一用户的多个搜索词一起处理
+        - 忌口排除集只编译一次；所有搜索词一次批量向量化，第一轮检索一起完成
+        - 不够 limit 条的搜索词再各自扩大召回
+        - covers / summary 为 False 时跳过现场生图 / AI 综述，这样的结果不写入结果缓存
+        :param user_id: 翻页游标的所有者
+        :return: 与 queries 同序的 RecipeListResponse；没有结果的搜索词为 None
+        """
+        full = covers and summary
+        use_cache = full and self._response_cache is not None
+        results = {}
+
+        # 同一个搜索词 (规范化后相同) 只处理一次
+        unique = {}
+        for q in queries:
+            unique.setdefault(normalize_query(q), q)
+
+        pending = []
+        for norm, q in unique.items():
+            if use_cache:
+                cached = self._response_cache.get(self._list_cache_key(q, limit, None, preferences, taste))
+                record_cache("search_response", cached is not None)
+                if cached is not None:
+                    results[norm] = RecipeListResponse.model_validate_json(cached)
+                    continue
+            pending.append(q)
+
+        print(f"🔍 [Service] 批量搜索: {len(queries)} 个搜索词, 去重后 {len(unique)} 个, 缓存命中 {len(unique) - len(pending)} 个")
+        if pending:
+            exclusion = get_exclusion(preferences) if preferences else None
+            top_k = min(max(limit * OVERFETCH_INITIAL_FACTOR, limit), OVERFETCH_MAX_K)
+            stats_list = [{} for _ in pending]
+            batch = retrieve_docs_batch(pending, top_k=top_k, exclusion=exclusion, stats_list=stats_list)
+            for q, candidates, stats in zip(pending, batch, stats_list):
+                ranked = self._retrieve_ranked(q, limit, preferences, taste, first_round=(candidates, stats))
+                with admission.watch() as degraded:
+                    result = self._assemble_list_response(q, ranked, limit, covers=covers, summary=summary) if ranked else None
+                if use_cache and result is not None and not degraded:
+                    self._response_cache.set(self._list_cache_key(q, limit, None, preferences, taste), result.model_dump_json())
+                results[normalize_query(q)] = result
+
+        return [
+            self._claim_cursor(results[key].model_copy(deep=True), user_id) if results[key] is not None else None
+            for key in map(normalize_query, queries)
+        ]
+
+    def _retrieve_ranked(self, search_query: str, limit: int, preferences: dict, taste, meta: dict = None, first_round: tuple = None) -> list:
+        """
+        自适应召回：先取 limit * 初始倍数，阈值 / 忌口过滤和去重后不够 limit 条时按倍数扩大 top_k，
+        直到够数、候选耗尽或达到上限。查询向量有缓存，多轮检索只向量化一次。
+        :param first_round: 批量搜索时已经一起检索好的第一轮结果 (candidates, stats)
+        :return: 按口味重排并去重后的候选列表
+        """
+        top_k = min(max(limit * OVERFETCH_INITIAL_FACTOR, limit), OVERFETCH_MAX_K)
+        rounds = 0
+        while True:
+            rounds += 1
+            if rounds == 1 and first_round is not None:
+                candidates, stats = first_round
+            else:
+                stats = {}
+                candidates = retrieve_docs(search_query, top_k=top_k, preferences=preferences, stats=stats)
+            # 按用户口味重新排序 (一次矩阵乘法)，再去重
+            with span("personalization"):
+                candidates = rerank(candidates, taste)
+            with span("dedup"):
+                ranked = self._dedup_by_name(candidates)
+            if len(ranked) >= limit or stats.get("exhausted") or top_k >= OVERFETCH_MAX_K:
+                break
+            top_k = min(top_k * max(OVERFETCH_GROWTH, 2), OVERFETCH_MAX_K)
+
+        # 扩大倍数 = 实际检索条数 / 需要的条数，用于调整初始倍数和上限
+        ratio = stats.get("fetched", 0) / max(limit, 1)
+        OVERFETCH_RATIO.observe(ratio)
+        print(f"📈 [Service] 召回 {rounds} 轮, top_k={top_k}, 检索 {stats.get('fetched', 0)} 条 -> 可用 {len(ranked)} 条 (扩大倍数 {ratio:.1f})")
+        if meta is not None:
+            meta["overfetch_ratio"] = ratio
+            meta["retrieval_rounds"] = rounds
+        return ranked
+
+    @staticmethod
+    def _dedup_by_name(candidates: list) -> list:
+        """按菜名去重，保持原有排序"""
+        deduped = []
+        seen_names = []
 
         def is_similar(name1, name2):
             # 简单去空格小写比较
@@ -158,104 +511,223 @@ class RecipeService:
             return difflib.SequenceMatcher(None, n1, n2).ratio() > 0.8
 
         for doc in candidates:
-            # 如果已经够数了，停止处理
-            if len(formatted_list) >= limit:
-                break
-                
             recipe_name = doc.get('name', '未命名')
-            
-            # 检查重复
-            is_dup = False
-            for existing_name in seen_names:
-                if is_similar(recipe_name, existing_name):
-                    is_dup = True
-                    break
-            
-            if is_dup:
+            if any(is_similar(recipe_name, existing) for existing in seen_names):
                 continue
-                
             seen_names.append(recipe_name)
-            
-            # --- 数据清洗 (保持原有逻辑) ---
-            raw_instructions = doc.get('instructions', [])
-            if isinstance(raw_instructions, str):
-                try: raw_instructions = json.loads(raw_instructions)
-                except: raw_instructions = []
-
-            raw_tags = doc.get('tags', [])
-            if isinstance(raw_tags, str):
-                try: raw_tags = json.loads(raw_tags)
-                except: raw_tags = []
-
-            # 格式化步骤
-            formatted_steps = []
-            for idx, step in enumerate(raw_instructions):
-                img_link = step.get('image_url') or step.get('imgLink')
-                if not img_link or img_link == "null": img_link = None
-                
-                formatted_steps.append(
-                    RecipeStep(
-                        step_index=idx + 1,
-                        description=step.get('description', ''),
-                        image_url=img_link
-                    )
-                )
-            
-            # 此处稍微调整得更有 AI 味一点
-            ai_comment = f"匹配度 {int(doc.get('score', 0) * 100)}%"
-            if refinement and "辣" in refinement and "辣" not in str(raw_tags):
-                 ai_comment += " | 已为您筛选不辣的做法"
-
-            formatted_list.append(
-                RecipeResponse(
-                    recipe_id=str(doc.get('id', 'unknown')),
-                    recipe_name=recipe_name,
-                    tags=raw_tags,
-                    cover_image=None, # 强制置空，忽略数据库坏链，确保下方并发逻辑会为每个菜谱生图
-                    steps=formatted_steps,
-                    message=ai_comment 
-                )
-            )
-
-        # === 4. 并行生成图片 (Parallel Image Generation) ===
-        # === 4. 串行生成图片 + LLM 防幻觉优化 (Serial + Anti-Hallucination) ===
-        # 针对免费模型：必须串行以防限流
-        # 针对幻觉问题：先用 DeepSeek 写 Prompt
+            deduped.append(doc)
+        return deduped
+
+    @staticmethod
+    def _to_list_item(doc: dict, refinement: str = None) -> RecipeResponse:
+        # --- 数据清洗 (保持原有逻辑) ---
+        item = to_recipe_response(
+            doc,
+            cover_image=None # 强制置空，忽略数据库坏链，确保下方并发逻辑会为每个菜谱生图
+        )
         
-        for item in formatted_list:
-            if not item.cover_image:
-                # 1. LLM 优化 Prompt (防幻觉)
-                print(f"🧠 [List] Refining prompt for: {item.recipe_name}...")
-                refined_prompt = refine_prompt_with_llm(item.recipe_name, item.tags)
-                
-                # 2. 调用生图 (带重试)
-                print(f"🎨 [List] Generating image (Serial)...")
-                new_url = generate_food_image(refined_prompt, is_refined=True)
-                
-                if new_url:
-                    item.cover_image = new_url
-                
-                # 3. 冷却防止限流
-                time.sleep(1.5)
+        # 此处稍微调整得更有 AI 味一点
+        ai_comment = f"匹配度 {int(doc.get('score', 0) * 100)}%"
+        if refinement and "辣" in refinement and "辣" not in str(item.tags):
+             ai_comment += " | 已为您筛选不辣的做法"
+        item.message = ai_comment
+        return item
+
+    @staticmethod
+    def _attach_stored_covers(items: list):
+        """已有本地封面的菜谱 (一次批量查询) 直接带上封面"""
+        stored = cover_store.get_many([item.recipe_id for item in items if not item.cover_image])
+        for item in items:
+            digest = stored.get(item.recipe_id)
+            if digest:
+                item.cover_image, item.cover_thumbnail = cover_urls(digest)
+
+    def _fill_covers(self, items: list):
+        """
+        串行生成封面 (Serial + Anti-Hallucination)
+        针对免费模型：必须串行以防限流；针对幻觉问题：先用 LLM 写 Prompt
+        已有本地封面的菜谱直接复用，不再生图
+        """
+        self._attach_stored_covers(items)
+        with admission.watch() as degraded:
+            for item in items:
+                if item.cover_image:
+                    continue
+                # 生图名额已满 (降级)：剩下的菜谱这次都不生图
+                if "image" in degraded:
+                    break
+                # 1. LLM 优化 Prompt (防幻觉) + 2. 调用生图 (带重试)
+                (new_url, thumbnail), shared = self._generate_cover(item.recipe_id, item.recipe_name, item.tags)
 
-        # 4. 生成综述
-        # 注意：这里传给 summarizer 的是原始 query (或者组合 query)，让 AI 知道用户意图
-        user_intent = query
-        if refinement:
-            user_intent = f"{query} ({refinement})"
-            
-        list_summary = generate_rag_answer(user_intent, [
-            {'name': c.recipe_name, 'tags': c.tags} for c in formatted_list
-        ])
+                if new_url:
+                    item.cover_image, item.cover_thumbnail = new_url, thumbnail
+
+                # 3. 冷却防止限流 (复用其他请求的结果或被降级时没有调用接口，不需要冷却)
+                if not shared and "image" not in degraded:
+                    time.sleep(1.5)
+
+    # --- 结果分页 (Cursor Pagination) ---
+    # 第一页把排好序、过滤、去重后的候选 id 存成快照，游标 = 快照 token + 偏移量。
+    # 翻页时只按 id 批量取文档，只为新出现的菜谱生成封面，不再重新检索。
+    # 结果缓存和 single-flight 会让多个用户拿到同一份第一页，所以构建时保存的快照没有所有者、不能直接翻页；
+    # 返回给用户前再复制一份带 user_id 的快照换成该用户自己的游标 (_claim_cursor)，翻页时校验所有者。
+
+    def _save_snapshot(self, ranked: list, offset: int, refinement: str, summary: str) -> str:
+        token = secrets.token_urlsafe(12)
+        self._snapshots.set(f"snapshot:{token}", json.dumps({
+            "ids": [[str(doc.get('id', '')), doc.get('score', 0)] for doc in ranked],
+            "refinement": refinement,
+            "ai_message": summary,
+        }, ensure_ascii=False))
+        return encode_page_cursor(token, offset)
+
+    def _claim_cursor(self, result: Optional[RecipeListResponse], user_id: int) -> Optional[RecipeListResponse]:
+        """把响应里的游标换成属于 user_id 的游标 (复制一份带所有者的快照)；快照已过期时去掉游标"""
+        if result is None or not result.next_cursor:
+            return result
+        token, offset = decode_page_cursor(result.next_cursor)
+        raw = self._snapshots.get(f"snapshot:{token}")
+        snapshot = json.loads(raw) if raw is not None else None
+        if snapshot is None or user_id is None:
+            result.next_cursor = None
+            return result
+        if snapshot.get("user_id") != user_id:
+            snapshot["user_id"] = user_id
+            token = secrets.token_urlsafe(12)
+            self._snapshots.set(f"snapshot:{token}", json.dumps(snapshot, ensure_ascii=False))
+        result.next_cursor = encode_page_cursor(token, offset)
+        return result
+
+    def get_recipe_page(self, cursor: str, limit: int = 5, user_id: int = None, preferences: dict = None) -> RecipeListResponse:
+        """
+        按游标返回下一页
+        :param user_id: 当前用户，必须是快照的所有者
+        :param preferences: 当前用户的偏好，翻页时按最新的忌口重新过滤 (第一页之后用户可能改了偏好)
+        :raises ValueError: 游标非法、快照已过期或不属于当前用户
+        """
+        token, offset = decode_page_cursor(cursor)
+        raw = self._snapshots.get(f"snapshot:{token}")
+        if raw is None:
+            raise ValueError(f"search snapshot expired: {token}")
+        snapshot = json.loads(raw)
+        if user_id is None or snapshot.get("user_id") != user_id:
+            raise ValueError(f"search snapshot belongs to another user: {token}")
+
+        exclusion = get_exclusion(preferences) if preferences else None
+        page = snapshot["ids"][offset:offset + limit]
+        docs = get_docs_by_ids([rid for rid, _ in page])
+        items = []
+        for rid, score in page:
+            doc = docs.get(rid)
+            if doc is None or (exclusion is not None and exclusion.excluded_by(doc)):
+                continue
+            doc["score"] = score
+            items.append(self._to_list_item(doc, snapshot.get("refinement")))
+        self._fill_covers(items)
 
+        next_offset = offset + limit
+        next_cursor = encode_page_cursor(token, next_offset) if next_offset < len(snapshot["ids"]) else None
+        print(f"📄 [Service] 翻页: 快照 {token}, 偏移 {offset}, 返回 {len(items)} 条")
         return RecipeListResponse(
-            candidates=formatted_list,
-            ai_message=list_summary
+            candidates=items,
+            ai_message=snapshot.get("ai_message"),
+            next_cursor=next_cursor
         )
 
-    def consult_chef(self, query: str, context: str, history: list) -> str:
+    # --- 按食材搜索 ---
+    # 不走向量检索，直接在食材位图索引上按位运算排序，只为入选的菜谱取文档。
+
+    def search_by_ingredients(self, ingredients: list, limit: int = 10, max_missing: int = None, preferences: dict = None) -> Optional[IngredientSearchResponse]:
+        """
+        :return: 按 "缺得少、命中多" 排序的菜谱；食材索引未生成时返回 None
+        """
+        from core.ingredient_index import get_ingredient_index, normalize_ingredients
+        index = get_ingredient_index()
+        if index is None:
+            return None
+
+        exclusion = get_exclusion(preferences) if preferences else None
+        with span("ingredient_search"):
+            # 食材层面的忌口在位图上直接排除；菜名 / 标签 / 正文里的忌口在取到文档后再过滤，多取一些备用
+            ranked, unknown = index.search(
+                ingredients, limit=limit * 3 if exclusion else limit, max_missing=max_missing,
+                exclude=index.exclusion_bitmap(exclusion),
+            )
+        docs = get_docs_by_ids([rid for rid, _, _ in ranked])
+        covers = cover_store.get_many([rid for rid, _, _ in ranked])
+
+        have = set(normalize_ingredients(ingredients))
+        items = []
+        for rid, hits, missing in ranked:
+            doc = docs.get(rid)
+            if doc is None or (exclusion is not None and exclusion.excluded_by(doc)):
+                continue
+            raw_tags, _ = parse_doc_fields(doc)
+            names = normalize_ingredients(doc_ingredients(doc))
+            cover_image, cover_thumbnail = cover_urls(covers[rid]) if rid in covers else (None, None)
+            items.append(IngredientMatch(
+                recipe_id=rid,
+                recipe_name=doc.get('name', '未命名'),
+                tags=raw_tags,
+                cover_image=cover_image,
+                cover_thumbnail=cover_thumbnail,
+                matched=[n for n in names if n in have],
+                missing=[n for n in names if n not in have],
+                coverage=hits / (hits + missing) if hits + missing else 0.0,
+            ))
+            if len(items) >= limit:
+                break
+        print(f"🥚 [Service] 按食材搜索 {list(have)}: 返回 {len(items)} 条, 未收录 {unknown}")
+        return IngredientSearchResponse(candidates=items, unknown=unknown)
+
+    def consult_in_session(self, session: dict, query: str) -> str:
+        """
+        会话内的一轮问答：prompt 只包含会话里存好的上下文、早期对话摘要和预算内的最近消息，
+        回答后把本轮追加进历史，历史超出预算时把较早的消息折叠进摘要
+        """
+        with admission.watch() as degraded:
+            reply = self.consult_chef(query, session["context"], session["turns"], summary=session.get("summary", ""))
+        if degraded:
+            # 没有真正问到 LLM：这一轮不记入历史，用户稍后重问即可
+            return reply
+        session["turns"].extend([
+            {"role": "user", "content": query},
+            {"role": "assistant", "content": reply},
+        ])
+        self._compact_history(session)
+        return reply
+
+    @staticmethod
+    def _compact_history(session: dict):
+        turns = session["turns"]
+        used = sum(estimate_tokens(t["content"]) for t in turns)
+        if used <= CONSULT_HISTORY_TOKENS or len(turns) <= CONSULT_KEEP_MESSAGES:
+            return
+        keep = max(CONSULT_KEEP_MESSAGES, 0)
+        old, recent = (turns[:-keep], turns[-keep:]) if keep else (turns, [])
+        session["summary"] = summarize_conversation(session.get("summary", ""), old, CONSULT_SUMMARY_TOKENS)
+        session["turns"] = recent
+        print(f"🗜️ [Consult] 会话 {session['id']}: {len(old)} 条早期消息已折叠进摘要")
+
+    @staticmethod
+    def _history_within_budget(history: list, budget: int) -> str:
+        """从最新的消息往前取，直到用完 token 预算 (单条过长时截断)"""
+        lines = []
+        for h in reversed(history or []):
+            line = f"{h.get('role', 'user')}: {h.get('content', '')}"
+            cost = estimate_tokens(line)
+            if cost > budget:
+                if not lines:
+                    lines.append(truncate_to_tokens(line, budget))
+                break
+            lines.append(line)
+            budget -= cost
+        return "\n".join(reversed(lines))
+
+    def consult_chef(self, query: str, context: str, history: list, summary: str = "") -> str:
         """
         AI 顾问交互接口
+        上下文 / 历史 / 摘要各有 token 预算，prompt 大小不随对话轮数增长
         """
         # 构建 prompt
         system_prompt = """
@@ -267,13 +739,16 @@ class RecipeService:
         3. 字数控制在 100 字左右。
         """
         
-        # 简单拼接历史
-        history_str = "\n".join([f"{h['role']}: {h['content']}" for h in history[-4:]])
+        history_str = self._history_within_budget(history, CONSULT_HISTORY_TOKENS)
+        summary_str = f"""
+        【更早的对话摘要】：
+        {truncate_to_tokens(summary, CONSULT_SUMMARY_TOKENS)}
+""" if summary else ""
 
         user_prompt = f"""
         【当前菜谱列表上下文】：
-        {context}
-
+        {truncate_to_tokens(context or "", CONSULT_CONTEXT_TOKENS)}
+{summary_str}
         【对话历史】：
         {history_str}
 
@@ -286,16 +761,23 @@ class RecipeService:
         if not self.llm:
              return "👨‍🍳 抱歉，AI 厨师目前无法连接大脑 (API Key Missing)。"
 
-        try:
-            from langchain_core.messages import SystemMessage, HumanMessage
-            response = self.llm.invoke([
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ])
-            return response.content.strip()
-        except Exception as e:
-            print(f"Chat Error: {e}")
-            return "👨‍🍳 抱歉，厨房太忙了，请稍后再试。"
+        with admission.admit("llm") as admitted:
+            if not admitted:
+                return "👨‍🍳 抱歉，厨房太忙了，请稍后再试。"
+            try:
+                from langchain_core.messages import SystemMessage, HumanMessage
+                with span("consult"):
+                    response = self.llm.invoke([
+                        SystemMessage(content=system_prompt),
+                        HumanMessage(content=user_prompt)
+                    ])
+                PROVIDER_CALLS.inc(provider="llm", outcome="ok")
+                return response.content.strip()
+            except Exception as e:
+                PROVIDER_CALLS.inc(provider="llm", outcome="error")
+                note_rate_limit("llm", e)
+                print(f"Chat Error: {e}")
+                return "👨‍🍳 抱歉，厨房太忙了，请稍后再试。"
 
 
 recipe_service = RecipeService()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, JSON, ForeignKey, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from core.database import Base
@@ -19,6 +19,12 @@ class User(Base):
 
 class UserFavorite(Base):
     __tablename__ = "user_favorites"
+    __table_args__ = (
+        # 收藏列表按 (user_id, saved_at, id) 做 keyset 分页，复合索引让翻页只扫描一页的数据
+        Index("ix_user_favorites_user_saved", "user_id", "saved_at", "id"),
+        # 同一用户不能重复收藏同一菜谱
+        Index("ux_user_favorites_user_recipe", "user_id", "recipe_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -27,3 +33,71 @@ class UserFavorite(Base):
     saved_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="favorites")
+
+class UserTaste(Base):
+    """
+    用户口味向量 = 收藏菜谱向量之和 / 收藏数。
+    只存 "和" 与 "个数"，收藏 / 取消收藏时做增量加减，不需要重新扫描全部收藏。
+    count + skipped 应等于该用户的收藏数，对不上时才按全部收藏重新计算一次。
+    """
+    __tablename__ = "user_tastes"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    vector_sum = Column(LargeBinary)       # float32 向量之和 (numpy tobytes)
+    count = Column(Integer, default=0)     # 参与求和的收藏数
+    skipped = Column(Integer, default=0)   # 没有向量 (菜谱已不在向量库里) 而没参与求和的收藏数
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class RecipeCover(Base):
+    """
+    菜谱封面的本地镜像 (生图服务的 URL 会过期，生成一次后下载到本地复用)。
+    digest 是图片内容的 sha256，对应 core/image_store 里的文件。
+    """
+    __tablename__ = "recipe_covers"
+
+    recipe_id = Column(String, primary_key=True)   # 对应 ChromaDB 中的 ID
+    digest = Column(String, nullable=False)
+    source_url = Column(String)                    # 生图服务返回的原始 URL (仅供排查)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+def ensure_columns(engine):
+    """create_all 不会给已存在的表加列，这里补上后来新增的列"""
+    from sqlalchemy import inspect, text
+    existing = {c["name"] for c in inspect(engine).get_columns(UserTaste.__tablename__)}
+    if "skipped" not in existing:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE user_tastes ADD COLUMN skipped INTEGER DEFAULT 0"))
+
+
+def _dedupe_favorites(engine):
+    """唯一索引建立前清理旧数据里的重复收藏 (同一用户同一菜谱只保留最早的一条)"""
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        deleted = conn.execute(text(
+            "DELETE FROM user_favorites WHERE id NOT IN "
+            "(SELECT MIN(id) FROM user_favorites GROUP BY user_id, recipe_id)"
+        )).rowcount
+    if deleted:
+        print(f"🧹 已清理 {deleted} 条重复收藏")
+
+
+def ensure_indexes(engine):
+    """
+    create_all 只会建新表，已存在的表不会补建索引，这里单独补上。
+    收藏写入依赖唯一索引 ux_user_favorites_user_recipe (ON CONFLICT DO NOTHING)，
+    建唯一索引前先清理重复收藏；仍然建不成功时直接抛异常，不带着缺索引的表启动。
+    """
+    from sqlalchemy import inspect
+    existing = {ix["name"] for ix in inspect(engine).get_indexes(UserFavorite.__tablename__)}
+    for table in (UserFavorite.__table__,):
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                _dedupe_favorites(engine)
+            try:
+                index.create(bind=engine)
+            except Exception as e:
+                raise RuntimeError(f"Failed to create index {index.name}: {e}") from e
@@ -0,0 +1,147 @@
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from core.cache import TTLCache
+from core.config import TASTE_CACHE_TTL, USER_CACHE_SIZE
+from core.personalize import taste_from_sum
+from core.retriever import get_embeddings_by_ids
+from core.database import SessionLocal, write_transaction
+from core.metrics import span, record_cache
+from . import sql_models
+
+# 未缓存 / 没有口味向量时用的占位，区分 "查过了但没有" 与 "还没查过"
+_NO_TASTE = object()
+
+
+class TasteStore:
+    """
+    用户口味向量 (收藏菜谱向量的均值)
+    - 收藏变化时在同一个写事务里对向量和做增量加减，提交后让进程内缓存失效
+    - 搜索时缓存命中不访问数据库
+    """
+
+    def __init__(self, ttl: float = TASTE_CACHE_TTL, maxsize: int = USER_CACHE_SIZE):
+        self._tastes = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, user_id: int):
+        """:return: 归一化的口味向量，没有收藏时返回 None"""
+        taste = self._tastes.get(user_id)
+        record_cache("taste", taste is not None)
+        if taste is None:
+            db = SessionLocal()
+            try:
+                with span("db_taste_lookup"):
+                    row = db.get(sql_models.UserTaste, user_id)
+                taste = self._from_row(row)
+            finally:
+                db.close()
+            self._tastes.set(user_id, taste if taste is not None else _NO_TASTE)
+        return None if taste is _NO_TASTE else taste
+
+    @staticmethod
+    def _from_row(row):
+        import numpy as np
+        if row is None or not row.vector_sum:
+            return None
+        return taste_from_sum(np.frombuffer(row.vector_sum, dtype=np.float32), row.count or 0)
+
+    @staticmethod
+    def prefetch(recipe_ids: list) -> dict:
+        """在写事务开始前取好菜谱向量，事务里不再做向量库查询"""
+        return get_embeddings_by_ids(list(recipe_ids)) if recipe_ids else {}
+
+    def apply(self, db: Session, user_id: int, added: list, removed: list, vectors: dict = None) -> bool:
+        """
+        在收藏变化的同一个写事务里调用 (core.database.write_transaction)，
+        把新增 / 删除的菜谱向量加到 / 减出向量和；由调用方提交，提交后再调用 invalidate。
+        没有向量的收藏记在 skipped 里，正常情况下 count + skipped == 收藏数，每次更新只做增量计算。
+        :param vectors: prefetch 取好的向量，缺少时在这里查询
+        :return: 是否需要 rebuild (第一次建口味记录、本功能上线前的收藏等导致计数对不上)
+        """
+        if not added and not removed:
+            return False
+        import numpy as np
+        # 口味记录不存在时先建一条 (并发的第一次收藏不会撞上主键冲突)
+        db.execute(
+            sqlite_insert(sql_models.UserTaste)
+            .values(user_id=user_id, count=0, skipped=0)
+            .on_conflict_do_nothing(index_elements=["user_id"])
+        )
+        row = db.get(sql_models.UserTaste, user_id, populate_existing=True)
+        vector_sum = np.frombuffer(row.vector_sum, dtype=np.float32).copy() if row.vector_sum else None
+        count, skipped = row.count or 0, row.skipped or 0
+
+        changed = [str(rid) for rid in list(added) + list(removed)]
+        vectors = vectors if vectors is not None else {}
+        missing = [rid for rid in changed if rid not in vectors]
+        if missing:
+            vectors = {**vectors, **get_embeddings_by_ids(missing)}
+        for rid in added:
+            vec = vectors.get(str(rid))
+            if vec is None:
+                skipped += 1
+            else:
+                vector_sum = vec.copy() if vector_sum is None else vector_sum + vec
+                count += 1
+        for rid in removed:
+            vec = vectors.get(str(rid))
+            if vec is None:
+                skipped = max(skipped - 1, 0)
+            elif vector_sum is not None and count > 0:
+                vector_sum -= vec
+                count -= 1
+
+        self._write_row(row, vector_sum, count, skipped)
+        db.flush()
+        favorite_count = db.query(func.count(sql_models.UserFavorite.id)).filter(
+            sql_models.UserFavorite.user_id == user_id
+        ).scalar()
+        return count + skipped != favorite_count
+
+    def rebuild(self, user_id: int):
+        """
+        按当前全部收藏重新计算向量和 (计数对不上时调用)。
+        向量查询在写锁之外完成；写入前收藏又被其他请求改过时放弃，由那次请求的 apply 再判断。
+        """
+        import numpy as np
+        db = SessionLocal()
+        try:
+            current = self._favorite_ids(db, user_id)
+            db.rollback()
+            vectors = get_embeddings_by_ids(sorted(current))
+            with write_transaction(db):
+                if self._favorite_ids(db, user_id) != current:
+                    return
+                row = db.get(sql_models.UserTaste, user_id, populate_existing=True)
+                if row is None:
+                    row = sql_models.UserTaste(user_id=user_id)
+                    db.add(row)
+                found = [vectors[rid] for rid in current if rid in vectors]
+                vector_sum = np.sum(found, axis=0, dtype=np.float32) if found else None
+                self._write_row(row, vector_sum, len(found), len(current) - len(found))
+        finally:
+            db.close()
+        self.invalidate(user_id)
+
+    @staticmethod
+    def _favorite_ids(db: Session, user_id: int) -> set:
+        return {
+            str(rid) for (rid,) in
+            db.query(sql_models.UserFavorite.recipe_id).filter(sql_models.UserFavorite.user_id == user_id)
+        }
+
+    @staticmethod
+    def _write_row(row, vector_sum, count: int, skipped: int):
+        import numpy as np
+        # 全部取消收藏后清零，避免浮点误差残留
+        if count <= 0 or vector_sum is None:
+            vector_sum, count = None, 0
+        row.vector_sum = vector_sum.astype(np.float32).tobytes() if vector_sum is not None else None
+        row.count = count
+        row.skipped = skipped
+
+    def invalidate(self, user_id: int):
+        self._tastes.pop(user_id)
+
+
+taste_store = TasteStore()
@@ -0,0 +1,110 @@
+import threading
+from dataclasses import dataclass, field
+from sqlalchemy.exc import IntegrityError
+from core.cache import TTLCache
+from core.config import USER_CACHE_TTL, USER_CACHE_NEGATIVE_TTL, USER_CACHE_SIZE
+from core.database import SessionLocal
+from core.metrics import span, record_cache
+from . import sql_models
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    """用户快照 (与数据库会话解绑，可以安全地跨请求缓存)"""
+    id: int
+    username: str
+    preferences: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_orm(cls, user: sql_models.User) -> "CachedUser":
+        return cls(id=user.id, username=user.username, preferences=dict(user.preferences or {}))
+
+
+class UserCreationError(Exception):
+    """自动创建用户失败 (并发冲突后仍查不到)"""
+
+
+class UserCache:
+    """
+    用户 / 偏好缓存
+    - 命中时搜索热路径完全不访问数据库
+    - 未命中时按用户名加锁，同一进程内同一用户只查 / 建一次
+    - 自动创建失败的用户名做短时间负缓存，避免失败风暴持续打数据库
+    - 更新偏好时写穿 (write-through)，多 worker 之间靠 TTL 收敛 (多 worker 时 TTL 默认 2 秒)
+    """
+
+    # 按用户名哈希分段加锁，锁的数量固定，不随用户数增长
+    LOCK_STRIPES = 64
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, negative_ttl: float = USER_CACHE_NEGATIVE_TTL, maxsize: int = USER_CACHE_SIZE):
+        self._users = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._failures = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+        self._locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+
+    def _lock_for(self, username: str) -> threading.Lock:
+        return self._locks[hash(username) % self.LOCK_STRIPES]
+
+    def get_or_create(self, username: str) -> CachedUser:
+        user = self._users.get(username)
+        record_cache("user", user is not None)
+        if user is not None:
+            return user
+        if username in self._failures:
+            raise UserCreationError(username)
+
+        with self._lock_for(username):
+            # 双重检查：等锁期间可能已被其他线程加载
+            user = self._users.get(username)
+            if user is not None:
+                return user
+
+            db = SessionLocal()
+            try:
+                with span("db_user_lookup"):
+                    db_user = self._load_or_create(db, username)
+            finally:
+                db.close()
+
+            if db_user is None:
+                self._failures.set(username, True)
+                raise UserCreationError(username)
+
+            user = CachedUser.from_orm(db_user)
+            self._users.set(username, user)
+            return user
+
+    @staticmethod
+    def _load_or_create(db, username: str):
+        # 1. 尝试查找
+        db_user = db.query(sql_models.User).filter(sql_models.User.username == username).first()
+        if db_user:
+            return db_user
+
+        # 2. 如果不存在，自动注册
+        print(f"🆕 Creating new user: {username}")
+        try:
+            db_user = sql_models.User(username=username, preferences={})
+            db.add(db_user)
+            db.commit()
+            db.refresh(db_user)
+            return db_user
+        except IntegrityError:
+            # 防止并发创建冲突 (其他 worker 抢先建好了)
+            db.rollback()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Failed to create user {username}: {e}")
+        return db.query(sql_models.User).filter(sql_models.User.username == username).first()
+
+    def put(self, db_user: sql_models.User) -> CachedUser:
+        """写穿：数据库提交成功后用最新数据覆盖缓存"""
+        user = CachedUser.from_orm(db_user)
+        self._users.set(user.username, user)
+        self._failures.pop(user.username)
+        return user
+
+    def invalidate(self, username: str):
+        self._users.pop(username)
+
+
+user_cache = UserCache()
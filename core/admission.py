@@ -0,0 +1,180 @@
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from core.config import (
+    ADMISSION_MODE, ADMISSION_QUEUE_TIMEOUT, ADMISSION_RETRY_AFTER,
+    LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, IMAGE_MAX_CONCURRENCY, IMAGE_MAX_QUEUE,
+)
+from core.metrics import ADMISSION_DECISIONS
+
+# ================= 准入控制 (Admission Control) =================
+# 每个外部服务 (llm / image) 有固定的并发名额和有上界的等待队列：
+#   - 有空闲名额时直接执行；没有时排队，最多等待 ADMISSION_QUEUE_TIMEOUT 秒
+#   - 队列已满、等待超时，或服务商刚返回过 429 (冷却中) 时拒绝：
+#       shed    : 抛出 Overloaded，接口层返回 503 + Retry-After
+#       degrade : admit 返回 False，调用方退回不调用 LLM / 不生图的结果
+#       off     : 不做限制 (原来的行为)
+# 这样高峰期被接纳的请求延迟保持稳定，多出来的请求要么快速失败要么降级，而不是一起变慢。
+# 多 worker 时每个进程各自计数，总并发 = 名额 x worker 数。
+
+
+class Overloaded(Exception):
+    """外部服务名额已满 (shed 模式)，接口层返回 503"""
+
+    def __init__(self, provider: str, retry_after: int):
+        super().__init__(f"{provider} overloaded, retry after {retry_after}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class ProviderGate:
+    def __init__(self, name: str, concurrency: int, queue_depth: int):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_depth = max(0, queue_depth)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._cooldown_until = 0.0
+
+    def try_acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if time.monotonic() < self._cooldown_until:
+                return False
+            if self._active < self.concurrency:
+                self._active += 1
+                return True
+            if self._waiting >= self.queue_depth:
+                return False
+            self._waiting += 1
+            try:
+                while self._active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self._active += 1
+                return True
+            finally:
+                self._waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def saturated(self) -> bool:
+        """此刻再来一个请求会被拒绝 (不占用名额)"""
+        with self._cond:
+            return (
+                time.monotonic() < self._cooldown_until
+                or (self._active >= self.concurrency and self._waiting >= self.queue_depth)
+            )
+
+    def cool_down(self, seconds: float):
+        """服务商返回 429 后，在 Retry-After 时间内直接拒绝新的调用，不再去撞限流"""
+        with self._cond:
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + seconds)
+        print(f"🧊 [Admission] {self.name} 被限流，{seconds:.0f} 秒内暂停调用")
+
+    def retry_after(self) -> int:
+        with self._cond:
+            remaining = self._cooldown_until - time.monotonic()
+        return max(ADMISSION_RETRY_AFTER, int(remaining + 0.999))
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"active": self._active, "waiting": self._waiting, "concurrency": self.concurrency, "queue": self.queue_depth}
+
+
+class AdmissionController:
+    def __init__(self, mode: str = ADMISSION_MODE):
+        self.mode = mode
+        self.gates = {
+            "llm": ProviderGate("llm", LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE),
+            "image": ProviderGate("image", IMAGE_MAX_CONCURRENCY, IMAGE_MAX_QUEUE),
+        }
+        self._local = threading.local()
+
+    @contextmanager
+    def admit(self, provider: str):
+        """
+        with admission.admit("llm") as admitted:
+            if not admitted:
+                return 降级结果
+            ... 调用外部服务
+        shed 模式下拒绝时直接抛出 Overloaded
+        """
+        gate = self.gates[provider]
+        if self.mode == "off":
+            yield True
+            return
+        if not gate.try_acquire(ADMISSION_QUEUE_TIMEOUT):
+            yield self._reject(gate)
+            return
+        ADMISSION_DECISIONS.inc(provider=provider, decision="admitted")
+        try:
+            yield True
+        finally:
+            gate.release()
+
+    def probe(self, provider: str) -> bool:
+        """
+        不占用名额，只按当前排队情况做一次准入判断 (拒绝时的处理与 admit 相同)。
+        用于多步调用之前提前放弃，例如生图名额已满时就不再先花一次 LLM 调用优化 Prompt。
+        """
+        gate = self.gates[provider]
+        if self.mode == "off" or not gate.saturated():
+            return True
+        return self._reject(gate)
+
+    def _reject(self, gate: ProviderGate) -> bool:
+        if self.mode == "shed":
+            ADMISSION_DECISIONS.inc(provider=gate.name, decision="shed")
+            raise Overloaded(gate.name, gate.retry_after())
+        ADMISSION_DECISIONS.inc(provider=gate.name, decision="degraded")
+        degraded = getattr(self._local, "degraded", None)
+        if degraded is not None:
+            degraded.add(gate.name)
+        return False
+
+    @contextmanager
+    def watch(self):
+        """
+        记录本线程在 with 块内被降级的服务：
+            with admission.watch() as degraded:
+                ...
+            if degraded: 结果不完整 (不写入结果缓存)
+        可以嵌套，内层的降级也会记到外层
+        """
+        outer = getattr(self._local, "degraded", None)
+        degraded = self._local.degraded = set()
+        try:
+            yield degraded
+        finally:
+            self._local.degraded = outer
+            if outer is not None:
+                outer.update(degraded)
+
+    def stats(self) -> dict:
+        return {name: gate.stats() for name, gate in self.gates.items()}
+
+
+def parse_retry_after(value, default: float = ADMISSION_RETRY_AFTER) -> float:
+    """Retry-After 响应头：秒数或 HTTP 日期；缺失或无法解析时返回 default"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+# 进程内共享实例
+admission = AdmissionController()
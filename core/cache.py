@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# ================= 进程内缓存 =================
+# 线程安全的 LRU + TTL 缓存，FastAPI 的同步接口跑在线程池里，所以所有操作都加锁。
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU + TTL 缓存
+    :param maxsize: 最多缓存的条目数，超出时淘汰最久未使用的
+    :param ttl: 默认过期时间 (秒)，None 表示不过期
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """
+    基于本地 SQLite 文件的 LRU + TTL 缓存，接口与 TTLCache 相同，
+    多个 uvicorn worker 指向同一个文件即可共享缓存。值必须是字符串 (调用方自行序列化)。
+    :param path: 数据库文件路径
+    :param maxsize: 最多缓存的条目数，写入时按最近访问时间淘汰超出的部分
+    :param ttl: 默认过期时间 (秒)，None 表示不过期
+    """
+
+    def __init__(self, path: str, maxsize: int = 1024, ttl: float = None):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed_at)")
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        # 过期判断和 LRU 用墙上时间，多个进程之间才可比较
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return default
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return default
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key, value: str, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            # 淘汰已过期的和超出容量的最久未访问条目
+            self._conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+    def pop(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        return default if row is None else row[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+def make_cache(backend: str, maxsize: int = 1024, ttl: float = None, path: str = None):
+    """
+    按配置创建缓存后端
+    :param backend: "memory" (进程内 TTLCache) / "sqlite" (本地文件，多 worker 共享) / "off"
+    :return: 缓存实例，"off" 时返回 None
+    """
+    if backend == "off":
+        return None
+    if backend == "sqlite":
+        return SQLiteCache(path, maxsize=maxsize, ttl=ttl)
+    return TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+def stable_hash(obj) -> str:
+    """对 JSON 可序列化对象计算稳定的哈希 (key 顺序无关)，用于拼缓存 key"""
+    payload = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
@@ -18,6 +18,134 @@ EMBEDDING_MODEL_NAME = "BAAI/bge-small-zh-v1.5"
 # 强制使用国内镜像
 os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
 
+# Embedding 推理后端
+# torch : sentence-transformers (默认，可用 GPU)
+# onnx  : ONNX Runtime CPU 推理 (首次使用自动导出到 ONNX_MODEL_DIR)
+EMBEDDING_BACKEND = os.getenv("AICHEF_EMBEDDING_BACKEND", "torch").strip().lower()
+ONNX_MODEL_DIR = os.path.join(ROOT_DIR, "data", "onnx", EMBEDDING_MODEL_NAME.split("/")[-1])
+# 是否使用动态 int8 量化的 ONNX 模型
+ONNX_QUANTIZE = os.getenv("AICHEF_ONNX_QUANTIZE", "0") == "1"
+# 服务 worker 进程数 (run.py --workers 会写入该环境变量，子进程据此调整配置)
+SERVE_WORKERS = max(1, int(os.getenv("AICHEF_WORKERS", "1")))
+# ONNX Runtime 算子内线程数 (0 = 自动，按 worker 数均分 CPU 核且不超过 4)
+ONNX_NUM_THREADS = int(os.getenv("AICHEF_ONNX_THREADS", "0")) or max(1, min(4, (os.cpu_count() or 1) // SERVE_WORKERS))
+
+# 向量检索模式
+# chroma : 直接使用 Chroma 的 float32 检索 (默认)
+# int8 / float16 : 使用入库时生成的量化索引粗排，再用 float32 精排 (省内存)
+VECTOR_STORE_MODE = os.getenv("AICHEF_VECTOR_STORE_MODE", "chroma").strip().lower()
+QUANT_INDEX_DIR = os.path.join(ROOT_DIR, "data", "quantized_index")
+# 食材位图索引 (入库时生成，POST /api/search/ingredients 使用)
+INGREDIENT_INDEX_DIR = os.path.join(ROOT_DIR, "data", "ingredient_index")
+# 食材索引加载失败后，索引文件有变化时立即重试，否则至少间隔这么多秒再重试
+INGREDIENT_INDEX_RETRY_INTERVAL = float(os.getenv("AICHEF_INGREDIENT_INDEX_RETRY_INTERVAL", "30"))
+# 精排候选数 = top_k * QUANT_RESCORE_FACTOR
+QUANT_RESCORE_FACTOR = int(os.getenv("AICHEF_QUANT_RESCORE_FACTOR", "4"))
+# 共享索引模式：向量和文档全部只读 mmap，多个 worker 共享页缓存，不再打开 Chroma
+# 多 worker 启动时默认开启；未指定量化模式时使用 int8
+SHARED_INDEX = os.getenv("AICHEF_SHARED_INDEX", "1" if SERVE_WORKERS > 1 else "0") == "1"
+if SHARED_INDEX and VECTOR_STORE_MODE == "chroma":
+    VECTOR_STORE_MODE = "int8"
+
+# 启动预热：服务启动后立即在后台加载模型和向量库并跑一次检索，
+# 完成前 /ready 返回 503，负载均衡不会把流量打到冷启动的 worker 上
+WARMUP_ON_STARTUP = os.getenv("AICHEF_WARMUP", "1") == "1"
+WARMUP_QUERY = os.getenv("AICHEF_WARMUP_QUERY", "番茄炒蛋")
+# 预热失败后按指数退避重试：第一次等待 WARMUP_RETRY_DELAY 秒，之后翻倍，最长 WARMUP_RETRY_MAX_DELAY 秒
+WARMUP_RETRY_DELAY = float(os.getenv("AICHEF_WARMUP_RETRY_DELAY", "5"))
+WARMUP_RETRY_MAX_DELAY = float(os.getenv("AICHEF_WARMUP_RETRY_MAX_DELAY", "300"))
+
+# 用户数据库 (SQLite) 并发配置
+DB_JOURNAL_MODE = os.getenv("AICHEF_DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("AICHEF_DB_SYNCHRONOUS", "NORMAL")
+DB_BUSY_TIMEOUT_MS = int(os.getenv("AICHEF_DB_BUSY_TIMEOUT_MS", "5000"))
+DB_POOL_SIZE = int(os.getenv("AICHEF_DB_POOL_SIZE", "8"))
+DB_MAX_OVERFLOW = int(os.getenv("AICHEF_DB_MAX_OVERFLOW", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("AICHEF_DB_POOL_TIMEOUT", "30"))
+
+# 用户 / 偏好缓存 (get_current_user)
+# 修改偏好只会写穿处理该请求的 worker；多 worker 时其他 worker 靠 TTL 重新读库，
+# 忌口 (过敏) 过滤不能长时间用旧偏好，所以多 worker 默认只缓存 2 秒
+USER_CACHE_TTL = float(os.getenv("AICHEF_USER_CACHE_TTL", "300" if SERVE_WORKERS == 1 else "2"))
+# 自动创建用户失败后的负缓存时间
+USER_CACHE_NEGATIVE_TTL = float(os.getenv("AICHEF_USER_CACHE_NEGATIVE_TTL", "5"))
+USER_CACHE_SIZE = int(os.getenv("AICHEF_USER_CACHE_SIZE", "10000"))
+# 编译好的忌口排除集 (按偏好内容去重，偏好相同的用户共用一份)
+EXCLUSION_CACHE_SIZE = int(os.getenv("AICHEF_EXCLUSION_CACHE_SIZE", "2048"))
+
+# 搜索结果缓存 (同样的查询 + 条数 + 改进意见 + 偏好，在 TTL 内直接返回上次的完整结果)
+# 后端: memory (进程内) / sqlite (本地文件，多 worker 共享) / off；多 worker 时默认 sqlite
+RESPONSE_CACHE_BACKEND = os.getenv("AICHEF_RESPONSE_CACHE", "sqlite" if SERVE_WORKERS > 1 else "memory").strip().lower()
+RESPONSE_CACHE_TTL = float(os.getenv("AICHEF_RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("AICHEF_RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_PATH = os.path.join(ROOT_DIR, "data", "response_cache.db")
+# 搜索翻页快照 (第一页排好序的候选 id 列表)，有效期应长于结果缓存，缓存里的 next_cursor 才不会失效
+SEARCH_SNAPSHOT_TTL = float(os.getenv("AICHEF_SEARCH_SNAPSHOT_TTL", "1800"))
+SEARCH_SNAPSHOT_SIZE = int(os.getenv("AICHEF_SEARCH_SNAPSHOT_SIZE", "5000"))
+SEARCH_SNAPSHOT_PATH = os.path.join(ROOT_DIR, "data", "search_snapshots.db")
+# 搜索词改写缓存 ((搜索词, 改进意见) -> LLM 改写结果)，默认存在本地 SQLite 文件里，重启后仍然有效
+QUERY_REWRITE_CACHE_BACKEND = os.getenv("AICHEF_QUERY_REWRITE_CACHE", "sqlite").strip().lower()
+QUERY_REWRITE_CACHE_TTL = float(os.getenv("AICHEF_QUERY_REWRITE_CACHE_TTL", str(7 * 24 * 3600)))
+QUERY_REWRITE_CACHE_SIZE = int(os.getenv("AICHEF_QUERY_REWRITE_CACHE_SIZE", "20000"))
+QUERY_REWRITE_CACHE_PATH = os.path.join(ROOT_DIR, "data", "query_rewrites.db")
+# AI 顾问会话：搜索结果上下文只在第一轮传一次，之后每轮只传 session_id；
+# 多 worker 时与结果缓存一样放在 SQLite 文件里共享
+CONSULT_SESSION_TTL = float(os.getenv("AICHEF_CONSULT_SESSION_TTL", "3600"))
+CONSULT_SESSION_SIZE = int(os.getenv("AICHEF_CONSULT_SESSION_SIZE", "5000"))
+CONSULT_SESSION_PATH = os.path.join(ROOT_DIR, "data", "consult_sessions.db")
+# 每轮 prompt 的 token 预算：菜谱上下文 / 对话历史 / 早期对话的摘要
+CONSULT_CONTEXT_TOKENS = int(os.getenv("AICHEF_CONSULT_CONTEXT_TOKENS", "1500"))
+CONSULT_HISTORY_TOKENS = int(os.getenv("AICHEF_CONSULT_HISTORY_TOKENS", "1000"))
+CONSULT_SUMMARY_TOKENS = int(os.getenv("AICHEF_CONSULT_SUMMARY_TOKENS", "300"))
+# 历史超出预算时，最近这么多条消息保持原文，更早的折叠进摘要
+CONSULT_KEEP_MESSAGES = int(os.getenv("AICHEF_CONSULT_KEEP_MESSAGES", "4"))
+
+# 自适应扩大召回：初始 top_k = limit * 初始倍数，过滤 + 去重后不够 limit 条时按增长倍数扩大，
+# 直到够数、候选耗尽或达到 top_k 上限 (初始 top_k 也不超过上限)
+OVERFETCH_INITIAL_FACTOR = int(os.getenv("AICHEF_OVERFETCH_INITIAL", "3"))
+OVERFETCH_GROWTH = int(os.getenv("AICHEF_OVERFETCH_GROWTH", "2"))
+OVERFETCH_MAX_K = int(os.getenv("AICHEF_OVERFETCH_MAX_K", "120"))
+
+# 批量搜索 (POST /api/search/batch)：一次请求最多的搜索词数量
+BATCH_SEARCH_MAX_QUERIES = int(os.getenv("AICHEF_BATCH_SEARCH_MAX_QUERIES", "32"))
+
+# 菜谱详情接口 (GET /api/recipe/{id})：浏览器 / CDN 缓存时间与进程内已序列化详情的条数
+RECIPE_DETAIL_MAX_AGE = int(os.getenv("AICHEF_RECIPE_DETAIL_MAX_AGE", "3600"))
+RECIPE_DETAIL_CACHE_SIZE = int(os.getenv("AICHEF_RECIPE_DETAIL_CACHE_SIZE", "2048"))
+
+# 封面本地镜像：生成的封面下载到本地 (按内容 sha256 存放)，并预生成缩略图 (需要 Pillow)
+IMAGE_STORE_DIR = os.getenv("AICHEF_IMAGE_STORE_DIR") or os.path.join(ROOT_DIR, "data", "images")
+IMAGE_THUMB_SIZES = tuple(int(s) for s in os.getenv("AICHEF_IMAGE_THUMB_SIZES", "256,512").split(",") if s.strip())
+# 结果卡片使用的缩略图尺寸
+IMAGE_CARD_SIZE = int(os.getenv("AICHEF_IMAGE_CARD_SIZE", "256"))
+IMAGE_FETCH_TIMEOUT = float(os.getenv("AICHEF_IMAGE_FETCH_TIMEOUT", "15"))
+
+# 按需性能剖析：请求头 X-Profile 带上该 token，或按采样率随机抽中的请求会被剖析；两者都未设置时完全关闭
+PROFILE_ADMIN_TOKEN = os.getenv("AICHEF_PROFILE_TOKEN") or None
+PROFILE_SAMPLE_RATE = float(os.getenv("AICHEF_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.path.join(ROOT_DIR, "data", "profiles")
+
+# 个性化排序：口味向量 (收藏菜谱向量的均值) 在最终得分中的权重，0 表示关闭
+PERSONALIZATION_WEIGHT = float(os.getenv("AICHEF_PERSONALIZATION_WEIGHT", "0.3"))
+# 口味向量的进程内缓存时间 (多 worker 之间靠 TTL 收敛)
+TASTE_CACHE_TTL = float(os.getenv("AICHEF_TASTE_CACHE_TTL", "300"))
+
+# 本地优选 (core/reranker)：按食材重合、标签、向量相似度和忌口打分选出最佳菜谱，不再让 LLM 挑选
+# 快速模式下推荐语也由模板生成，完全不调用 LLM
+RERANK_FAST_MODE = os.getenv("AICHEF_RERANK_FAST", "0") == "1"
+
+# 外部服务准入控制 (core/admission)：每个 worker 内 LLM / 生图各自的并发名额和等待队列长度
+# 名额和队列都满时: shed = 返回 503 + Retry-After；degrade = 不调用 LLM / 不生图，返回降级结果；off = 不限制
+ADMISSION_MODE = os.getenv("AICHEF_ADMISSION_MODE", "degrade").strip().lower()
+LLM_MAX_CONCURRENCY = int(os.getenv("AICHEF_LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("AICHEF_LLM_MAX_QUEUE", "16"))
+IMAGE_MAX_CONCURRENCY = int(os.getenv("AICHEF_IMAGE_MAX_CONCURRENCY", "2"))
+IMAGE_MAX_QUEUE = int(os.getenv("AICHEF_IMAGE_MAX_QUEUE", "4"))
+# 排队最多等待的秒数，超时按队列已满处理
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("AICHEF_ADMISSION_QUEUE_TIMEOUT", "10"))
+# 503 响应的 Retry-After 下限 (秒)；服务商 429 给出的 Retry-After 更长时以它为准
+ADMISSION_RETRY_AFTER = int(os.getenv("AICHEF_ADMISSION_RETRY_AFTER", "5"))
+
 # 3. 大模型配置 (支持 SiliconFlow 或 Google Gemini)
 # 优先读取 SiliconFlow，如果没有则尝试读取 Gemini
 LLM_API_KEY = os.getenv("SILICONFLOW_API_KEY")
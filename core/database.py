@@ -1,17 +1,69 @@
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 import os
-from core.config import ROOT_DIR
+from core.config import (
+    ROOT_DIR, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_BUSY_TIMEOUT_MS, DB_JOURNAL_MODE, DB_SYNCHRONOUS,
+)
 
 # 数据库文件路径
 DB_PATH = os.path.join(ROOT_DIR, "data", "users.db")
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
 
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    每个新连接建立时设置并发相关的 PRAGMA：
+    - journal_mode=WAL : 读写互不阻塞，只有写和写之间排队
+    - busy_timeout     : 遇到锁时等待而不是立刻报 "database is locked"
+    - synchronous      : WAL 下 NORMAL 已足够安全 (断电最多丢最后一个事务)，写入快很多
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    cursor.close()
+
+
+def create_sqlite_engine(db_path: str = DB_PATH):
+    """
+    创建生产配置的 SQLite 引擎 (WAL + busy timeout + 显式大小的连接池)
+    check_same_thread=False 是 SQLite 必须的，允许多线程访问
+    """
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        connect_args={"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT_MS / 1000},
+        poolclass=QueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+    )
+    event.listen(engine, "connect", _apply_sqlite_pragmas)
+    return engine
+
+
+def create_async_sqlite_engine(db_path: str = DB_PATH):
+    """
+    创建异步引擎 (aiosqlite 驱动，greenlet 由 sqlalchemy[asyncio] 安装)
+    PRAGMA 设置与同步引擎一致
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{db_path}",
+        connect_args={"timeout": DB_BUSY_TIMEOUT_MS / 1000},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    return engine
+
+
 # 创建引擎
-# check_same_thread=False 是 SQLite 必须的，允许多线程访问
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = create_sqlite_engine()
 
 # 创建 SessionLocal 类
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -26,3 +78,42 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+@contextmanager
+def write_transaction(db):
+    """
+    写事务：一开始就拿 SQLite 写锁 (BEGIN IMMEDIATE)，"先读后写" 的几步在事务里串行执行，
+    不会被其他线程 / worker 的同类写入插在中间 (锁被占用时按 busy_timeout 等待)。
+    正常结束时提交，出错时回滚。
+    """
+    db.execute(text("BEGIN IMMEDIATE"))
+    try:
+        yield db
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
+
+# --- 异步会话 (可选) ---
+# 第一次使用 get_async_db 时才创建异步引擎
+_async_session_factory = None
+
+def get_async_session_factory():
+    global _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+        _async_session_factory = async_sessionmaker(
+            bind=create_async_sqlite_engine(), class_=AsyncSession,
+            autoflush=False, expire_on_commit=False,
+        )
+    return _async_session_factory
+
+async def get_async_db():
+    """
+    异步版本的 get_db，用于 async def 接口，数据库 IO 不再阻塞事件循环：
+        async def handler(db: AsyncSession = Depends(get_async_db)): ...
+    """
+    async with get_async_session_factory()() as db:
+        yield db
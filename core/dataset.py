@@ -0,0 +1,230 @@
+import json
+import os
+
+# ================= 紧凑数据集格式 =================
+# 预处理产物 (recipeData_with_tags / recipe_rag_ready / rag_ready_final) 原本是
+# indent=4 的整块 JSON，只能整体加载。这里统一支持三种格式，按文件后缀区分：
+#   .json       旧格式 (整块 JSON，列表或字典)，只读兼容
+#   .jsonl      每行一条紧凑 JSON，支持流式读取 + 按 id 随机访问 (旁路 .idx 偏移索引)
+#   .jsonl.zst  zstd 压缩的 JSONL，体积最小，支持流式读取 (需要安装 zstandard)
+# 默认输出格式可通过环境变量 AICHEF_DATASET_FORMAT 修改 (jsonl / jsonl.zst / json)
+DEFAULT_FORMAT = os.getenv("AICHEF_DATASET_FORMAT", "jsonl").lstrip(".")
+
+SUFFIXES = (".jsonl.zst", ".jsonl", ".json")
+INDEX_SUFFIX = ".idx"
+
+
+def _dumps(record) -> str:
+    # 紧凑序列化：不缩进、无多余空格、保留中文
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("读写 .jsonl.zst 需要安装 zstandard: pip install zstandard")
+    return zstandard
+
+
+def dataset_format(path: str) -> str:
+    """根据后缀判断文件格式"""
+    for suffix in SUFFIXES:
+        if path.endswith(suffix):
+            return suffix.lstrip(".")
+    raise ValueError(f"不支持的数据集格式: {path}")
+
+
+def strip_suffix(path: str) -> str:
+    for suffix in SUFFIXES:
+        if path.endswith(suffix):
+            return path[: -len(suffix)]
+    return path
+
+
+def output_path(path: str, fmt: str = None) -> str:
+    """把任意后缀的路径换成目标格式的路径，例如 data/a.json -> data/a.jsonl"""
+    return f"{strip_suffix(path)}.{(fmt or DEFAULT_FORMAT).lstrip('.')}"
+
+
+def resolve_path(path: str):
+    """
+    查找实际存在的数据文件。
+    传入 data/recipe_rag_ready.json 时，会依次尝试 .jsonl.zst / .jsonl / .json，
+    这样旧的整块 JSON 和新的紧凑格式可以共存，脚本无需关心上一步输出了哪种。
+    """
+    base = strip_suffix(path)
+    for suffix in SUFFIXES:
+        candidate = base + suffix
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def iter_records(path: str):
+    """
+    流式读取数据集，逐条 yield。
+    - JSONL / JSONL.zst：逐行解码，内存占用只有一条记录
+    - 旧 JSON：只能整体加载；字典结构会 yield 其 value (key 信息见 iter_items)
+    """
+    for _, record in iter_items(path):
+        yield record
+
+
+def iter_items(path: str):
+    """
+    流式读取 (key, record)。
+    旧 JSON 字典的 key 保持原样 (例如 "recipe_10001")；
+    列表和 JSONL 没有外层 key，返回 None。
+    """
+    fmt = dataset_format(path)
+
+    if fmt == "json":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            yield from data.items()
+        else:
+            for record in data:
+                yield None, record
+        return
+
+    if fmt == "jsonl.zst":
+        import io
+        zstandard = _zstd()
+        with open(path, "rb") as raw:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw)
+            for line in io.TextIOWrapper(reader, encoding="utf-8"):
+                if line.strip():
+                    yield None, json.loads(line)
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield None, json.loads(line)
+
+
+def load_records(path: str) -> list:
+    """一次性读取为列表 (小文件或确实需要全量时使用)"""
+    return list(iter_records(path))
+
+
+def write_records(path: str, records, key=None) -> int:
+    """
+    写出数据集，格式由 path 后缀决定。
+    :param records: 可迭代的记录 (dict)，可以是生成器，写 JSONL 时不会整体驻留内存
+    :param key: 记录 -> id 的函数；写 .jsonl 时会同时生成 .idx 偏移索引，供 RecordStore 随机访问
+    :return: 写出的记录条数
+    """
+    fmt = dataset_format(path)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if fmt == "json":
+        # 旧格式也去掉缩进，至少不再被空白撑大
+        with open(path, "w", encoding="utf-8") as f:
+            data = list(records)
+            f.write(_dumps(data))
+        return len(data)
+
+    count = 0
+    if fmt == "jsonl.zst":
+        zstandard = _zstd()
+        with open(path, "wb") as raw:
+            with zstandard.ZstdCompressor(level=10).stream_writer(raw) as writer:
+                for record in records:
+                    writer.write((_dumps(record) + "\n").encode("utf-8"))
+                    count += 1
+        return count
+
+    offsets = {}
+    with open(path, "wb") as f:
+        for record in records:
+            if key is not None:
+                offsets[str(key(record))] = f.tell()
+            f.write((_dumps(record) + "\n").encode("utf-8"))
+            count += 1
+
+    if key is not None:
+        with open(path + INDEX_SUFFIX, "w", encoding="utf-8") as f:
+            f.write(_dumps(offsets))
+    return count
+
+
+class RecordStore:
+    """
+    按 id 随机访问数据集。
+    - .jsonl：读取旁路 .idx 偏移索引 (不存在就扫描一遍并补写)，get() 只 seek + 读一行
+    - 其他格式：无法 seek，退化为一次性流式加载到内存字典
+      (.jsonl.zst 适合归档和流式读取；需要随机访问时请输出 .jsonl)
+    """
+
+    def __init__(self, path: str, key):
+        self.path = path
+        self.key = key
+        self._offsets = None
+        self._records = None
+        self._file = None
+
+        if dataset_format(path) == "jsonl":
+            self._offsets = self._load_offsets()
+            self._file = open(path, "rb")
+        else:
+            self._records = {}
+            for outer_key, record in iter_items(path):
+                self._records[str(key(record))] = record
+                # 旧 JSON 字典的外层 key (例如 "recipe_10001") 也可以直接查
+                if outer_key is not None:
+                    self._records.setdefault(str(outer_key), record)
+
+    def _load_offsets(self) -> dict:
+        index_path = self.path + INDEX_SUFFIX
+        if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(self.path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        # 索引缺失或过期：扫描一遍重建
+        offsets = {}
+        with open(self.path, "rb") as f:
+            offset = f.tell()
+            line = f.readline()
+            while line:
+                if line.strip():
+                    offsets[str(self.key(json.loads(line)))] = offset
+                offset = f.tell()
+                line = f.readline()
+        with open(index_path, "w", encoding="utf-8") as f:
+            f.write(_dumps(offsets))
+        return offsets
+
+    def __contains__(self, record_id) -> bool:
+        source = self._offsets if self._offsets is not None else self._records
+        return str(record_id) in source
+
+    def __len__(self) -> int:
+        source = self._offsets if self._offsets is not None else self._records
+        return len(source)
+
+    def get(self, record_id, default=None):
+        record_id = str(record_id)
+        if self._records is not None:
+            return self._records.get(record_id, default)
+
+        offset = self._offsets.get(record_id)
+        if offset is None:
+            return default
+        self._file.seek(offset)
+        return json.loads(self._file.readline())
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
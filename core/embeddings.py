@@ -0,0 +1,177 @@
+import os
+import sys
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from core.config import (
+    EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND,
+    ONNX_MODEL_DIR, ONNX_QUANTIZE, ONNX_NUM_THREADS,
+)
+
+# ================= Embedding 后端 =================
+# torch : sentence-transformers (HuggingFaceEmbeddings)，自动选择 MPS / CUDA / CPU
+# onnx  : 首次使用时把 bge 模型导出为 ONNX (可选动态 int8 量化)，之后用 ONNX Runtime 推理
+#         服务器没有 GPU 时比 PyTorch CPU 推理快得多，且不需要在每个进程里加载 torch
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model.int8.onnx"
+MAX_LENGTH = 512
+BATCH_SIZE = 32
+
+
+def detect_device() -> str:
+    """自动检测 torch 可用的加速设备"""
+    import torch
+    if torch.backends.mps.is_available():
+        return "mps"
+    if torch.cuda.is_available():
+        return "cuda"
+    return "cpu"
+
+
+def export_onnx_model(model_dir: str = ONNX_MODEL_DIR, quantize: bool = ONNX_QUANTIZE) -> str:
+    """
+    导出 bge 模型到 ONNX (只需执行一次)，并保存分词器。
+    :param quantize: 额外生成动态 int8 量化版本 (权重 int8，激活运行时量化)
+    :return: 实际使用的模型文件路径
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(model_dir, exist_ok=True)
+    model_path = os.path.join(model_dir, MODEL_FILE)
+
+    if not os.path.exists(model_path):
+        print(f"🔄 [Embeddings] 正在导出 ONNX 模型: {EMBEDDING_MODEL_NAME} -> {model_path}")
+        tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+        model = AutoModel.from_pretrained(EMBEDDING_MODEL_NAME).eval()
+
+        sample = tokenizer(["番茄炒蛋"], return_tensors="pt")
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+                model_path,
+                input_names=["input_ids", "attention_mask", "token_type_ids"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "token_type_ids": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"},
+                },
+                opset_version=14,
+            )
+        tokenizer.save_pretrained(model_dir)
+        print("✅ [Embeddings] ONNX 导出完成")
+
+    if not quantize:
+        return model_path
+
+    quantized_path = os.path.join(model_dir, QUANTIZED_MODEL_FILE)
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        print(f"🔄 [Embeddings] 正在生成动态 int8 量化模型: {quantized_path}")
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        print("✅ [Embeddings] 量化完成")
+    return quantized_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    ONNX Runtime 版本的 bge 向量化 (CLS 池化 + L2 归一化，与 HuggingFaceEmbeddings 输出一致)
+    """
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, quantize: bool = ONNX_QUANTIZE, num_threads: int = ONNX_NUM_THREADS):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_file = QUANTIZED_MODEL_FILE if quantize else MODEL_FILE
+        model_path = os.path.join(model_dir, model_file)
+        if not os.path.exists(model_path):
+            model_path = export_onnx_model(model_dir, quantize=quantize)
+
+        options = ort.SessionOptions()
+        # 单条查询延迟主要取决于算子内并行；算子间并行对 BERT 这种串行图没有收益
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        print(f"✅ [Embeddings] ONNX Runtime 已加载: {model_file} (threads={num_threads})")
+
+    def _encode(self, texts: list) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), BATCH_SIZE):
+            batch = texts[start:start + BATCH_SIZE]
+            encoded = self.tokenizer(batch, padding=True, truncation=True, max_length=MAX_LENGTH, return_tensors="np")
+            feeds = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            cls = hidden[:, 0]
+            norms = np.linalg.norm(cls, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            outputs.append(cls / norms)
+        return np.vstack(outputs).astype(np.float32) if outputs else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_documents(self, texts: list) -> list:
+        return self._encode(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> list:
+        return self._encode([text])[0].tolist()
+
+
+def get_embeddings(backend: str = EMBEDDING_BACKEND) -> Embeddings:
+    """按配置创建 Embedding 实例 (检索和入库共用，保证向量空间一致)"""
+    if backend == "onnx":
+        return OnnxEmbeddings()
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+    device = detect_device()
+    print(f"🔄 [Embeddings] 使用 PyTorch 推理 (device: {device})")
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs={'device': device},
+        encode_kwargs={'normalize_embeddings': True}
+    )
+
+
+def verify_rankings(queries=None, k: int = 10):
+    """
+    对比 torch 与 onnx 后端：查询向量的余弦相似度，以及在向量库上 top-k 排名的重合度。
+    用法: python -m core.embeddings verify [查询...]
+    """
+    from core.retriever import VectorDBManager
+    from core.quantized_index import DEFAULT_REPORT_QUERIES
+
+    queries = queries or DEFAULT_REPORT_QUERIES
+    reference = np.asarray(get_embeddings("torch").embed_documents(queries), dtype=np.float32)
+    candidate = np.asarray(get_embeddings("onnx").embed_documents(queries), dtype=np.float32)
+    cosines = (reference * candidate).sum(axis=1)
+
+    db = VectorDBManager.get_chroma_store()
+    overlaps, exact_order = [], 0
+    if db is not None:
+        for ref_vec, cand_vec in zip(reference, candidate):
+            ref_ids = [d.id for d, _ in db.similarity_search_by_vector_with_relevance_scores(ref_vec.tolist(), k=k)]
+            cand_ids = [d.id for d, _ in db.similarity_search_by_vector_with_relevance_scores(cand_vec.tolist(), k=k)]
+            overlaps.append(len(set(ref_ids) & set(cand_ids)) / max(len(ref_ids), 1))
+            exact_order += int(ref_ids == cand_ids)
+
+    print(f"📊 [Embeddings] onnx vs torch, {len(queries)} 条查询 (quantize={ONNX_QUANTIZE})")
+    print(f"   - 查询向量余弦相似度: mean={cosines.mean():.5f}, min={cosines.min():.5f}")
+    if overlaps:
+        print(f"   - top-{k} 重合率: mean={np.mean(overlaps):.3f}, min={np.min(overlaps):.2f}, 排序完全一致 {exact_order}/{len(queries)}")
+    return {"cosine_min": float(cosines.min()), "overlap_mean": float(np.mean(overlaps)) if overlaps else None}
+
+
+if __name__ == "__main__":
+    # 用法:
+    #   python -m core.embeddings export   导出 ONNX 模型 (按 AICHEF_ONNX_QUANTIZE 决定是否量化)
+    #   python -m core.embeddings verify   验证与 torch 后端的排名一致性
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    if command == "verify":
+        verify_rankings(sys.argv[2:] or None)
+    else:
+        print(export_onnx_model())
@@ -0,0 +1,97 @@
+import re
+import threading
+from core.cache import TTLCache, stable_hash
+from core.config import EXCLUSION_CACHE_SIZE
+from core.metrics import record_cache
+
+# ================= 用户忌口排除集 =================
+# 用户偏好几乎不变，但每次搜索都要把 dislikes + allergies 重新拼一遍、逐词扫描候选。
+# 这里把忌口编译成 ExclusionSet 并缓存 (按偏好内容哈希，偏好相同的用户共用一份)：
+#   - 一个预编译的正则，一次扫描判断所有忌口词
+#   - 按菜谱 id 记住判定结果，同一道菜不再重复扫描
+#   - 共享索引模式下预先算好整个菜谱库的排除掩码，检索时直接在打分阶段屏蔽
+# 在 /api/user/profile 保存偏好时编译，搜索时只是一次缓存命中。
+
+
+class ExclusionSet:
+    def __init__(self, words):
+        self.words = tuple(sorted({w.strip().lower() for w in words if w and w.strip()}))
+        self.key = stable_hash(self.words)
+        # 长词优先，命中时报告更具体的忌口词
+        ordered = sorted(self.words, key=len, reverse=True)
+        self.pattern = re.compile("|".join(map(re.escape, ordered))) if ordered else None
+        self._verdicts = {}
+        # 共享索引的行级掩码 (True = 需要排除)，由 build_mask 异步生成
+        self.mask = None
+        self._mask_lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.words)
+
+    def match(self, text: str):
+        """返回命中的忌口词，没有命中返回 None"""
+        if self.pattern is None:
+            return None
+        found = self.pattern.search(text.lower())
+        return found.group() if found else None
+
+    def excluded_by(self, doc: dict):
+        """
+        检查菜品名称、标签和内容是否包含忌口词 (结果按菜谱 id 记忆)
+        没有 id 的文档 (_format_doc 会填成 '') 每次都重新检查，不能共用同一条记忆
+        :return: 命中的忌口词或 None
+        """
+        recipe_id = doc.get('id')
+        if recipe_id and recipe_id in self._verdicts:
+            return self._verdicts[recipe_id]
+        verdict = self.match(doc.get('name', '') + str(doc.get('tags', '')) + doc.get('content', ''))
+        if recipe_id:
+            self._verdicts[recipe_id] = verdict
+        return verdict
+
+    def build_mask(self, docs):
+        """
+        对共享索引的 mmap 文档库整体扫描一次，生成行级排除掩码
+        :param docs: core.quantized_index.DocStore
+        """
+        import numpy as np
+        with self._mask_lock:
+            if self.mask is not None or not self:
+                return self.mask
+            mask = np.zeros(len(docs), dtype=bool)
+            for row in range(len(docs)):
+                doc = docs.get(row)
+                meta = doc["metadata"]
+                text = meta.get('name', '') + str(meta.get('tags', '')) + doc["page_content"]
+                mask[row] = self.match(text) is not None
+            self.mask = mask
+            print(f"🛑 [Exclusion] 忌口掩码已生成: {self.words} 排除 {int(mask.sum())}/{len(mask)} 道菜")
+            return mask
+
+
+_cache = TTLCache(maxsize=EXCLUSION_CACHE_SIZE)
+
+
+def avoid_words(preferences: dict) -> list:
+    """将不喜欢和过敏源合并"""
+    if not preferences:
+        return []
+    return list(preferences.get("dislikes") or []) + list(preferences.get("allergies") or [])
+
+
+def get_exclusion(preferences: dict):
+    """
+    获取 (必要时编译) 偏好对应的排除集；没有忌口时返回 None
+    """
+    words = avoid_words(preferences)
+    if not words:
+        return None
+    key = stable_hash(sorted({w.strip().lower() for w in words if w and w.strip()}))
+    exclusion = _cache.get(key)
+    record_cache("exclusion", exclusion is not None)
+    if exclusion is None:
+        exclusion = ExclusionSet(words)
+        if not exclusion:
+            return None
+        _cache.set(key, exclusion)
+    return exclusion
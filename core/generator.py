@@ -1,85 +1,119 @@
-from langchain_openai import ChatOpenAI
-from core.config import LLM_API_KEY, LLM_BASE_URL, LLM_MODEL_NAME, IMAGE_MODEL_NAME
-import re
+from core.config import LLM_API_KEY, LLM_BASE_URL, LLM_MODEL_NAME, IMAGE_MODEL_NAME, RERANK_FAST_MODE
 import ast
 import os
-import requests
 import json
+import threading
 import time # for retry sleep
+from core.metrics import timed, PROVIDER_CALLS, PROVIDER_RETRIES
+from core.admission import admission, parse_retry_after, Overloaded
+from core.reranker import select_best
 
 # 初始化客户端 (使用 LangChain 统一接口)
-llm = None
-
-# 1. 优先检查 SiliconFlow / DeepSeek (OpenAI 兼容接口)
-if LLM_API_KEY:
-    print(f"✅ 使用 SiliconFlow/DeepSeek API (model: {LLM_MODEL_NAME})")
-    llm = ChatOpenAI(
-        model=LLM_MODEL_NAME,
-        api_key=LLM_API_KEY,
-        base_url=LLM_BASE_URL,
-        temperature=0.7
-    )
-else:
+# langchain_openai 导入很重，延迟到第一次真正调用 LLM 时再创建客户端
+_llm = None
+_llm_lock = threading.Lock()
+
+if not LLM_API_KEY:
     print("⚠️ 未配置 SiliconFlow API Key，生成功能将不可用。")
 
+def get_llm():
+    """获取共享的 LLM 客户端 (未配置 API Key 时返回 None)"""
+    global _llm
+    if _llm is None and LLM_API_KEY:
+        with _llm_lock:
+            if _llm is None:
+                # 1. 优先检查 SiliconFlow / DeepSeek (OpenAI 兼容接口)
+                from langchain_openai import ChatOpenAI
+                print(f"✅ 使用 SiliconFlow/DeepSeek API (model: {LLM_MODEL_NAME})")
+                _llm = ChatOpenAI(
+                    model=LLM_MODEL_NAME,
+                    api_key=LLM_API_KEY,
+                    base_url=LLM_BASE_URL,
+                    temperature=0.7
+                )
+    return _llm
+
 class MockResponse:
     def __init__(self, content):
         self.content = content
 
+def note_rate_limit(provider: str, error: Exception):
+    """LLM 调用返回 429 时按 Retry-After 暂停该服务的新调用"""
+    response = getattr(error, "response", None)
+    if getattr(error, "status_code", None) == 429 or getattr(response, "status_code", None) == 429:
+        headers = getattr(response, "headers", None) or {}
+        admission.gates[provider].cool_down(parse_retry_after(headers.get("retry-after")))
+
 def safe_invoke(messages):
     """
-    统一的 LLM 调用封装
+    统一的 LLM 调用封装 (经过准入控制，名额已满时降级为 MockResponse)
     """
+    llm = get_llm()
     if not llm:
         return MockResponse("🤖 (未配置 API Key，请查看下方菜谱)")
 
-    try:
-        # 直接调用配置好的 LLM
-        return llm.invoke(messages)
-    except Exception as e:
-        print(f"❌ [SafeInvoke] LLM 调用失败: {e}")
-        return MockResponse("🤖 (AI 服务暂时不可用，请检查 API Key 或网络)")
+    with admission.admit("llm") as admitted:
+        if not admitted:
+            return MockResponse("🤖 (AI 厨师正忙，请直接查看下方菜谱)")
+        try:
+            # 直接调用配置好的 LLM
+            response = llm.invoke(messages)
+            PROVIDER_CALLS.inc(provider="llm", outcome="ok")
+            return response
+        except Exception as e:
+            PROVIDER_CALLS.inc(provider="llm", outcome="error")
+            note_rate_limit("llm", e)
+            print(f"❌ [SafeInvoke] LLM 调用失败: {e}")
+            return MockResponse("🤖 (AI 服务暂时不可用，请检查 API Key 或网络)")
 
-def smart_select_and_comment(query: str, candidates: list):
+@timed("select")
+def smart_select_and_comment(query: str, candidates: list, exclusion=None, fast: bool = RERANK_FAST_MODE):
     """
     智能优选 Rerank (灵活版)
     不再死板过滤，而是侧重于“推荐 + 建议”
+    选哪一道由本地打分决定 (core/reranker)，LLM 只写推荐语；快速模式下推荐语也用模板
+    :return: (选中的索引, 推荐语)
     """
-    if not llm:
-        return 0, "API Key 未配置，默认推荐："
-    
     if not candidates:
         return 0, "没有候选菜谱。"
 
-    # 1. 构建候选列表
-    candidates_str = ""
-    for i, doc in enumerate(candidates):
-        snippet = doc.get('content', '')[:150].replace('\n', ' ')
-        candidates_str += (
-            f"选项[{i}]: {doc.get('name')}\n"
-            f"   - 标签: {doc.get('tags', [])}\n"
-            f"   - 简介: {snippet}...\n\n"
-        )
+    index, matched = select_best(query, candidates, exclusion)
+    best = candidates[index]
+    print(f"🏅 [Generator] 本地优选: 第 {index} 项 {best.get('name')} (命中食材: {matched})")
+
+    if fast or not get_llm():
+        return index, _template_comment(best, matched)
+    return index, _comment_with_llm(query, best) or _template_comment(best, matched)
+
+
+def _template_comment(doc: dict, matched: list) -> str:
+    if matched:
+        return f"为您推荐【{doc.get('name')}】，用到了您提到的{'、'.join(matched)}。"
+    return f"试试这道【{doc.get('name')}】，应该不错！"
+
+
+@timed("comment")
+def _comment_with_llm(query: str, doc: dict) -> str:
+    """为已经选好的菜谱写一句推荐理由；调用失败时返回空串，由调用方退回模板"""
+    snippet = doc.get('content', '')[:150].replace('\n', ' ')
 
     # =====================================================
     # ✅ 优化后的 Prompt：更像一个懂得变通的大厨
     # =====================================================
     system_prompt = """
-    你是一位聪明、幽默且懂变通的私家大厨。你的任务是从给定的候选菜谱中，为用户推荐**最合适**的一道。
+    你是一位聪明、幽默且懂变通的私家大厨。已经为用户选好了一道菜谱，请写一句推荐理由。
 
     【推荐逻辑】：
-    1. **找最大公约数**：优先选择食材、口味最接近用户需求的菜。
-    2. **借壳上市 (Bridging) - 核心能力**：
-       - 如果推荐的菜谱缺少用户手里的某个食材，**必须**在理由里建议用户“在第几步加进去”。
-       - 例如：用户有“玉米”，但你推荐了《牛肉丸汤》（原谱没玉米），请说：“虽然原谱没写，但我强烈建议您在煮丸子时把玉米粒加进去，增加清甜口感。”
-    3. **幽默处理离谱搭配**：
-       - 如果用户给出了离谱的搭配（例如“西瓜炒牛肉”），请**不要**强行推荐。
-       - 请用**幽默**的语气吐槽，并给出合理的烹饪理由（如“强扭的瓜不甜”）。
-    4. **灵活处理忌口**：
-       - 如果用户说“不要辣”，但候选项全都有辣，**不要拒绝回答！** 请选一个最容易“去辣”的菜，并告诉用户怎么改（如“把辣椒油换成香油”）。
+    1. **借壳上市 (Bridging) - 核心能力**：
+       - 如果菜谱缺少用户手里的某个食材，**必须**在理由里建议用户“在第几步加进去”。
+       - 例如：用户有“玉米”，但菜谱是《牛肉丸汤》（原谱没玉米），请说：“虽然原谱没写，但我强烈建议您在煮丸子时把玉米粒加进去，增加清甜口感。”
+    2. **幽默处理离谱搭配**：
+       - 如果用户给出了离谱的搭配（例如“西瓜炒牛肉”），请用**幽默**的语气吐槽，并给出合理的烹饪理由（如“强扭的瓜不甜”）。
+    3. **灵活处理忌口**：
+       - 如果用户说“不要辣”，但菜谱有辣，请告诉用户怎么改（如“把辣椒油换成香油”）。
 
     【输出格式】：
-    - 请直接返回一行：索引数字 ||| 推荐理由
+    - 直接输出推荐理由，不要输出其他内容。
     - **严禁使用 Emoji**。
     - 理由要简短（50字以内）。
     """
@@ -87,31 +121,29 @@ def smart_select_and_comment(query: str, candidates: list):
     user_prompt = f"""
     用户需求：【{query}】
 
-    候选列表：
-    {candidates_str}
-
-    请做出你的选择：
+    选中的菜谱：{doc.get('name')}
+       - 标签: {doc.get('tags', [])}
+       - 简介: {snippet}...
     """
 
     try:
-        # LangChain 调用
-        messages = [
+        response_msg = safe_invoke([
             ("system", system_prompt),
             ("human", user_prompt),
-        ]
-        
-        response_msg = safe_invoke(messages)
+        ])
+        if isinstance(response_msg, MockResponse):
+            return ""
         content = response_msg.content
-        
+
         # --- 增强解析逻辑 ---
         # 1. 如果是列表 (Multipart)，拼接
         if isinstance(content, list):
              content = " ".join([str(c) for c in content])
-        
+
         # 2. 如果是字典 (或类似结构)，尝试提取 text
         if isinstance(content, dict):
             content = content.get('text', str(content))
-            
+
         # 3. 如果是字符串但看起来像字典 (Stringified Dict)
         content = str(content).strip()
         if content.startswith("{") and "text" in content:
@@ -122,33 +154,23 @@ def smart_select_and_comment(query: str, candidates: list):
             except:
                 pass # 解析失败就保留原样
 
-        content = str(content).strip()
-
-        # print(f"🤖 [Generator] AI 建议: {content}") 
-
-        # --- 解析逻辑 (保持鲁棒性) ---
+        # 兼容旧格式 "索引 ||| 理由"
         if "|||" in content:
-            index_part, reason = content.split("|||", 1)
-            match = re.search(r'\d+', index_part)
-            if match:
-                return int(match.group()), reason.strip()
-        
-        # 兜底：如果 AI 直接说了数字开头
-        match = re.search(r'^\d+', content)
-        if match:
-             return int(match.group()), f"为您推荐【{candidates[int(match.group())]['name']}】"
-
-        # 彻底无法解析
-        return 0, f"试试这道【{candidates[0]['name']}】，应该不错！"
+            content = content.split("|||", 1)[1]
+        return str(content).strip()
 
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"❌ [Generator] 报错: {e}")
-        return 0, "为您推荐以下菜谱："
+        return ""
 
+@timed("prompt_refinement")
 def refine_prompt_with_llm(name: str, tags: list) -> str:
     """
     使用 DeepSeek 将简单的菜谱信息转化为精准、克制的英文生图 Prompt
     """
+    llm = get_llm()
     if not llm:
         return f"{name}, {', '.join(tags)}"
     
@@ -166,23 +188,31 @@ def refine_prompt_with_llm(name: str, tags: list) -> str:
     
     user_prompt = f"Dish Name: {name}\nTags: {', '.join(tags)}\n\nWrite the prompt:"
     
-    try:
-        from langchain_core.messages import SystemMessage, HumanMessage
-        response = llm.invoke([
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt)
-        ])
-        polished_prompt = response.content.strip()
-        print(f"✨ [Generator] Prompt Refined: {polished_prompt}")
-        return polished_prompt
-    except Exception as e:
-        print(f"⚠️ [Generator] Prompt refinement failed: {e}")
-        return f"{name}, {', '.join(tags)}"
+    with admission.admit("llm") as admitted:
+        if not admitted:
+            return f"{name}, {', '.join(tags)}"
+        try:
+            from langchain_core.messages import SystemMessage, HumanMessage
+            response = llm.invoke([
+                SystemMessage(content=system_prompt),
+                HumanMessage(content=user_prompt)
+            ])
+            PROVIDER_CALLS.inc(provider="llm", outcome="ok")
+            polished_prompt = response.content.strip()
+            print(f"✨ [Generator] Prompt Refined: {polished_prompt}")
+            return polished_prompt
+        except Exception as e:
+            PROVIDER_CALLS.inc(provider="llm", outcome="error")
+            note_rate_limit("llm", e)
+            print(f"⚠️ [Generator] Prompt refinement failed: {e}")
+            return f"{name}, {', '.join(tags)}"
 
+@timed("image_generation")
 def generate_food_image(prompt: str, is_refined: bool = False) -> str:
     """
     独立生图函数：调用 SiliconFlow 模型生成高质量美食图片
-    增加重试机制 (Retry)
+    增加重试机制 (Retry)；经过准入控制，名额已满时不生图 (返回 None)。
+    服务商返回 429 时不再重试，按 Retry-After 暂停所有生图调用。
     """
     # 优先使用 SiliconFlow 官方地址
     base_url = "https://api.siliconflow.cn/v1"
@@ -219,9 +249,20 @@ def generate_food_image(prompt: str, is_refined: bool = False) -> str:
         "guidance_scale": 7.5
     }
     
+    with admission.admit("image") as admitted:
+        if not admitted:
+            print("⏭️ [Generator] 生图名额已满，跳过")
+            return None
+        return _post_image_request(url, headers, payload)
+
+def _post_image_request(url: str, headers: dict, payload: dict):
+    import requests
+
     # === 增加重试逻辑 (Max 3 times) ===
     max_retries = 3
     for attempt in range(max_retries):
+        if attempt:
+            PROVIDER_RETRIES.inc(provider="image")
         try:
             print(f"🎨 [Generator] ({attempt+1}/{max_retries}) Generating with {IMAGE_MODEL_NAME}...")
             response = requests.post(url, headers=headers, json=payload, timeout=60)
@@ -231,26 +272,35 @@ def generate_food_image(prompt: str, is_refined: bool = False) -> str:
                 images = data.get("images", [])
                 if images:
                     image_url = images[0].get("url")
+                    PROVIDER_CALLS.inc(provider="image", outcome="ok")
                     print(f"✅ [Generator] Success!")
                     return image_url
-            
-            # 如果失败 (如 429 Too Many Requests)，打印并等待
+            PROVIDER_CALLS.inc(provider="image", outcome=f"http_{response.status_code}")
+
+            # 429 Too Many Requests：越重试越被限流，按 Retry-After 暂停生图，这次直接放弃
+            if response.status_code == 429:
+                admission.gates["image"].cool_down(parse_retry_after(response.headers.get("Retry-After")))
+                return None
+
+            # 其他失败打印并等待
             print(f"⚠️ [Generator] Attempt {attempt+1} failed: {response.status_code} - {response.text}")
             if attempt < max_retries - 1:
                 time.sleep(2) # 失败后冷却 2 秒再试
                 
         except Exception as e:
+            PROVIDER_CALLS.inc(provider="image", outcome="error")
             print(f"❌ [Generator] Exception on attempt {attempt+1}: {e}")
             if attempt < max_retries - 1:
                 time.sleep(2)
         
     return None
 
+@timed("summary")
 def generate_rag_answer(query: str, candidates: list) -> str:
     """
     为搜索结果列表生成一段 "厨师顾问" 风格的综述
     """
-    if not llm:
+    if not get_llm():
         return "🤖 AI 厨师正在休息（未配置 API Key），请直接查看下方菜谱。"
         
     if not candidates:
@@ -318,6 +368,51 @@ def generate_rag_answer(query: str, candidates: list) -> str:
         print(f"✅ AI 响应内容: {content[:50]}...")
         return content
             
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"❌ [Generator] Summary 报错: {e}")
         return f"基于您的食材偏好，我为您甄选了以下几道值得尝试的美味佳肴。"
+
+@timed("history_summary")
+def summarize_conversation(summary: str, turns: list, max_tokens: int) -> str:
+    """
+    把较早的对话折叠进摘要 (AI 顾问会话的历史超出 token 预算时调用)
+    :param summary: 之前的摘要，可为空
+    :param turns: 要折叠的消息 [{"role": ..., "content": ...}]
+    LLM 不可用时退回到按预算截断的原文拼接
+    """
+    from core.tokens import truncate_to_tokens
+
+    dialogue = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+    fallback = truncate_to_tokens(
+        "\n".join(part for part in (summary, dialogue) if part), max_tokens
+    )
+    if not get_llm():
+        return fallback
+
+    system_prompt = f"""
+    你是对话记录员。请把"已有摘要"和"新增对话"合并成一段新的摘要，供主厨顾问继续对话时参考。
+    【要求】：
+    1. 保留用户的口味、忌口、已有食材、想做的菜，以及主厨已经给出的关键建议。
+    2. 去掉寒暄和重复内容，只输出摘要本身。
+    3. 不超过 {max_tokens} 字。
+    """
+    user_prompt = f"""
+    【已有摘要】：
+    {summary or "(无)"}
+
+    【新增对话】：
+    {dialogue}
+    """
+    response = safe_invoke([
+        ("system", system_prompt),
+        ("human", user_prompt),
+    ])
+    if isinstance(response, MockResponse):
+        return fallback
+    content = response.content
+    if isinstance(content, list):
+        content = " ".join([str(c) for c in content])
+    content = str(content).strip()
+    return truncate_to_tokens(content, max_tokens) if content else fallback
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import re
+import tempfile
+from core.config import IMAGE_STORE_DIR, IMAGE_THUMB_SIZES, IMAGE_FETCH_TIMEOUT
+
+# ================= 本地图片镜像 =================
+# 生图服务返回的 URL 会过期，而且原图是 1024x1024，结果卡片只需要很小的图。
+# 这里把每张生成的封面下载一次，按内容 sha256 存到本地 (内容寻址，同一张图只存一份)，
+# 并预先生成几种尺寸的缩略图 (需要 Pillow，未安装时只保存原图)。
+# 文件名只由内容决定、永不修改，接口可以返回一年期的 immutable 缓存头。
+#
+# 目录结构: data/images/<digest[:2]>/<digest>.<ext>
+#           data/images/<digest[:2]>/<digest>_<size>.jpg
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# 按文件头识别格式，不依赖服务端返回的 Content-Type
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+MEDIA_TYPES = {"png": "image/png", "jpg": "image/jpeg", "gif": "image/gif", "webp": "image/webp"}
+
+
+def _detect_ext(data: bytes):
+    for signature, ext in _SIGNATURES:
+        if data.startswith(signature):
+            return ext
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def is_digest(value: str) -> bool:
+    return bool(value) and bool(_DIGEST_RE.match(value))
+
+
+def _dir_for(digest: str) -> str:
+    return os.path.join(IMAGE_STORE_DIR, digest[:2])
+
+
+def _write_atomic(path: str, data: bytes):
+    """先写临时文件再 rename，并发写同一张图时读者不会看到半个文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _make_thumbnails(digest: str, data: bytes):
+    """预生成缩略图 (JPEG)；未安装 Pillow 时跳过"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return
+    import io
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        for size in IMAGE_THUMB_SIZES:
+            path = os.path.join(_dir_for(digest), f"{digest}_{size}.jpg")
+            if os.path.exists(path):
+                continue
+            thumb = image.copy()
+            thumb.thumbnail((size, size))
+            out = io.BytesIO()
+            thumb.save(out, format="JPEG", quality=85, optimize=True, progressive=True)
+            _write_atomic(path, out.getvalue())
+
+
+def store_bytes(data: bytes):
+    """
+    保存一张图片 (已存在则直接复用)
+    :return: 内容 sha256；不是可识别的图片时返回 None
+    """
+    ext = _detect_ext(data)
+    if ext is None:
+        return None
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(_dir_for(digest), f"{digest}.{ext}")
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    try:
+        _make_thumbnails(digest, data)
+    except Exception as e:
+        print(f"⚠️ [ImageStore] 缩略图生成失败 {digest[:12]}: {e}")
+    return digest
+
+
+def mirror(url: str):
+    """
+    下载远程图片到本地镜像
+    :return: 内容 sha256；下载失败时返回 None (调用方可以退回使用原 URL)
+    """
+    import requests
+
+    try:
+        response = requests.get(url, timeout=IMAGE_FETCH_TIMEOUT)
+        response.raise_for_status()
+    except Exception as e:
+        print(f"⚠️ [ImageStore] 下载失败 {url}: {e}")
+        return None
+    digest = store_bytes(response.content)
+    if digest:
+        print(f"🖼️ [ImageStore] 已镜像封面 {digest[:12]} ({len(response.content) // 1024} KB)")
+    return digest
+
+
+def find(digest: str, size: int = None):
+    """
+    :param size: 缩略图尺寸；该尺寸不存在 (例如未安装 Pillow) 时退回原图
+    :return: (文件路径, media type)；找不到时返回 (None, None)
+    """
+    if not is_digest(digest):
+        return None, None
+    folder = _dir_for(digest)
+    if size is not None:
+        path = os.path.join(folder, f"{digest}_{size}.jpg")
+        if os.path.exists(path):
+            return path, MEDIA_TYPES["jpg"]
+    for ext, media_type in MEDIA_TYPES.items():
+        path = os.path.join(folder, f"{digest}.{ext}")
+        if os.path.exists(path):
+            return path, media_type
+    return None, None
+
+
+def image_url(digest: str, size: int = None) -> str:
+    """接口上的稳定地址 (相对路径，前端经同源代理访问)"""
+    return f"/api/images/{digest}/{size}" if size else f"/api/images/{digest}"
@@ -1,18 +1,49 @@
 import json
 import os
 import shutil
-import torch
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
-from core.config import DB_PATH_V3, EMBEDDING_MODEL_NAME, COLLECTION_NAME
+from core.config import DB_PATH_V3, COLLECTION_NAME, EMBEDDING_BACKEND
+from core.embeddings import get_embeddings, detect_device
+from core.dataset import resolve_path, iter_records
+from core.quantized_index import build_quantized_index
+from core.ingredient_index import IngredientIndexBuilder
 
-# 1. 配置路径
+# 1. 配置路径 (自动识别 .json / .jsonl / .jsonl.zst)
 SOURCE_FILE = "data/recipe_rag_ready_fixed.json"
+# 每批写入向量库的文档数 (流式入库，避免一次性把全量文档放进内存)
+BATCH_SIZE = 512
+
+def to_document(item) -> Document:
+    meta = item['metadata'].copy()
+    
+    # -------------------------------------------------------
+    # ✅ 核心修复：把 List/Dict 类型的数据转成 JSON 字符串
+    # -------------------------------------------------------
+    
+    # 1. 处理 tags (List -> String)
+    # 例如: ['菌菇', '海鲜'] -> "['菌菇', '海鲜']"
+    if 'tags' in meta and isinstance(meta['tags'], list):
+        meta['tags'] = json.dumps(meta['tags'], ensure_ascii=False)
+
+    # 食材名列表同样存成 JSON 字符串
+    if 'ingredients' in meta and isinstance(meta['ingredients'], list):
+        meta['ingredients'] = json.dumps(meta['ingredients'], ensure_ascii=False)
+        
+    # 2. 处理 instructions (List of Dicts -> String)
+    # 这一步非常关键！否则 instructions 也会报错
+    if 'instructions' in meta and isinstance(meta['instructions'], list):
+        meta['instructions'] = json.dumps(meta['instructions'], ensure_ascii=False)
+
+    return Document(
+        page_content=item['page_content'],
+        metadata=meta 
+    )
 
 def ingest_data():
     # 检查源文件
-    if not os.path.exists(SOURCE_FILE):
+    source_file = resolve_path(SOURCE_FILE)
+    if not source_file:
         print(f"❌ 错误：找不到源文件 {SOURCE_FILE}")
         return
 
@@ -21,62 +52,51 @@ def ingest_data():
         print(f"🗑️ 发现旧数据库 {DB_PATH_V3}，正在删除以进行重建...")
         shutil.rmtree(DB_PATH_V3)
     
-    print("🚀 开始加载 Embedding 模型 (BAAI)...")
+    print(f"🚀 开始加载 Embedding 模型 (BAAI, backend: {EMBEDDING_BACKEND})...")
     
     # 自动检测设备
-    if torch.backends.mps.is_available():
-        device = "mps"
-        print("⚡️ 检测到 Mac GPU (MPS)，已启用加速模式！")
-    elif torch.cuda.is_available():
-        device = "cuda"
-        print("⚡️ 检测到 NVIDIA GPU (CUDA)，已启用加速模式！")
-    else:
-        device = "cpu"
-        print("🐢 未检测到 GPU，正在使用 CPU 模式...")
+    if EMBEDDING_BACKEND == "torch":
+        device = detect_device()
+        if device == "mps":
+            print("⚡️ 检测到 Mac GPU (MPS)，已启用加速模式！")
+        elif device == "cuda":
+            print("⚡️ 检测到 NVIDIA GPU (CUDA)，已启用加速模式！")
+        else:
+            print("🐢 未检测到 GPU，正在使用 CPU 模式...")
 
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL_NAME,
-        model_kwargs={'device': device},
-        encode_kwargs={'normalize_embeddings': True}
+    embeddings = get_embeddings()
+
+    print(f"📖 正在流式读取数据: {source_file}")
+
+    vector_store = Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embeddings,
+        persist_directory=DB_PATH_V3
     )
 
-    print(f"📖 正在读取数据: {SOURCE_FILE}")
-    with open(SOURCE_FILE, 'r', encoding='utf-8') as f:
-        raw_data = json.load(f)
+    # 转换格式并分批写入
+    total = 0
+    batch = []
+    ingredient_index = IngredientIndexBuilder()
+    for item in iter_records(source_file):
+        batch.append(to_document(item))
+        ingredient_index.add_record(item)
+        if len(batch) >= BATCH_SIZE:
+            vector_store.add_documents(batch)
+            total += len(batch)
+            print(f"📦 已写入 {total} 条数据...")
+            batch = []
 
-    # 转换格式
-    documents = []
-    for item in raw_data:
-        meta = item['metadata'].copy()
-        
-        # -------------------------------------------------------
-        # ✅ 核心修复：把 List/Dict 类型的数据转成 JSON 字符串
-        # -------------------------------------------------------
-        
-        # 1. 处理 tags (List -> String)
-        # 例如: ['菌菇', '海鲜'] -> "['菌菇', '海鲜']"
-        if 'tags' in meta and isinstance(meta['tags'], list):
-            meta['tags'] = json.dumps(meta['tags'], ensure_ascii=False)
-            
-        # 2. 处理 instructions (List of Dicts -> String)
-        # 这一步非常关键！否则 instructions 也会报错
-        if 'instructions' in meta and isinstance(meta['instructions'], list):
-            meta['instructions'] = json.dumps(meta['instructions'], ensure_ascii=False)
+    if batch:
+        vector_store.add_documents(batch)
+        total += len(batch)
 
-        doc = Document(
-            page_content=item['page_content'],
-            metadata=meta 
-        )
-        documents.append(doc)
+    print(f"📦 共将 {total} 条数据写入向量库")
 
-    print(f"📦 正在将 {len(documents)} 条数据写入向量库...")
-    
-    Chroma.from_documents(
-        documents=documents,
-        embedding=embeddings,
-        persist_directory=DB_PATH_V3,
-        collection_name=COLLECTION_NAME
-    )
+    # 同时导出量化索引 (int8 / float16 + float32 精排向量)，供 AICHEF_VECTOR_STORE_MODE 使用
+    build_quantized_index(vector_store)
+    # 食材位图索引 ("家里有这些食材能做什么" 的搜索)
+    ingredient_index.save()
     
     print("✅ 入库完成！复杂数据已序列化存储。")
 
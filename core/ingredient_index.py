@@ -0,0 +1,261 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+import numpy as np
+from core.config import INGREDIENT_INDEX_DIR, INGREDIENT_INDEX_RETRY_INTERVAL, EXCLUSION_CACHE_SIZE
+from core.cache import TTLCache
+
+# ================= 食材位图索引 =================
+# "家里有鸡蛋、番茄、葱，能做什么？" 这类查询用向量相似度既慢又不准。
+# 入库时为每种食材 (归一化后的名字) 生成一张菜谱位图：第 r 位为 1 表示第 r 个菜谱用到了这种食材。
+# 查询时只对用户给出的几张位图做按位运算：
+#   - 用位切片计数器 (bit-sliced counter) 按位累加，得到每个菜谱命中了几种用户食材
+#   - 菜谱自身的食材数 - 命中数 = 还缺几种
+# 按 "缺得少、命中多" 排序，只有最终入选的行才解包成下标，全库规模很大时也是毫秒级。
+#
+# 文件 (data/ingredient_index/):
+#   vocab.json       食材名列表，行号即位图下标
+#   recipe_ids.json  菜谱 id 列表，位号即菜谱下标
+#   bitmaps.npy      uint64 [食材数, ceil(菜谱数 / 64)]，以只读 mmap 打开，多 worker 共享页缓存
+#   counts.npy       uint16 [菜谱数]，每个菜谱的食材种数
+
+VOCAB_FILE = "vocab.json"
+RECIPE_IDS_FILE = "recipe_ids.json"
+BITMAPS_FILE = "bitmaps.npy"
+COUNTS_FILE = "counts.npy"
+
+# 常见的同物异名，统一到一个写法 (入库和查询用同一张表)
+SYNONYMS = {
+    "西红柿": "番茄",
+    "蛋": "鸡蛋",
+    "鸡蛋液": "鸡蛋",
+    "小葱": "葱",
+    "香葱": "葱",
+    "葱花": "葱",
+    "马铃薯": "土豆",
+    "洋芋": "土豆",
+    "芫荽": "香菜",
+}
+
+_AMOUNT = re.compile(r"[(（].*?[)）]")
+
+
+def normalize_ingredient(name: str) -> str:
+    """全角转半角、去掉用量括号和空白、小写，再查同义词表"""
+    if not name:
+        return ""
+    name = unicodedata.normalize("NFKC", str(name))
+    name = _AMOUNT.sub("", name)
+    name = "".join(name.split()).lower()
+    return SYNONYMS.get(name, name)
+
+
+def normalize_ingredients(names) -> list:
+    """归一化并去重 (保持原顺序)"""
+    return list(dict.fromkeys(n for n in map(normalize_ingredient, names or []) if n))
+
+
+class IngredientIndexBuilder:
+    """入库时逐条 add，最后 save 一次写出全部文件"""
+
+    def __init__(self):
+        self.recipe_ids = []
+        self.postings = {}   # 食材 -> 菜谱下标列表
+        self.counts = []
+
+    def add(self, recipe_id, ingredients):
+        row = len(self.recipe_ids)
+        self.recipe_ids.append(str(recipe_id))
+        names = normalize_ingredients(ingredients)
+        for name in names:
+            self.postings.setdefault(name, []).append(row)
+        self.counts.append(len(names))
+
+    def add_record(self, item: dict):
+        """RAG 格式的记录 (page_content + metadata)；旧数据没有 ingredients 字段时从正文解析"""
+        from core.reranker import parse_ingredients
+        meta = item.get('metadata', {})
+        self.add(meta.get('id'), meta.get('ingredients') or parse_ingredients(item.get('page_content', '')))
+
+    def save(self, index_dir: str = INGREDIENT_INDEX_DIR) -> int:
+        if not self.recipe_ids:
+            print("⚠️ [IngredientIndex] 没有菜谱，跳过食材索引构建")
+            return 0
+        os.makedirs(index_dir, exist_ok=True)
+        vocab = sorted(self.postings)
+        n_words = (len(self.recipe_ids) + 63) // 64
+        bitmaps = np.zeros((len(vocab), n_words), dtype=np.uint64)
+        for i, name in enumerate(vocab):
+            # 按位号置位：先在字节数组上置位，再按小端视为 uint64
+            bits = np.zeros(n_words * 64, dtype=bool)
+            bits[self.postings[name]] = True
+            bitmaps[i] = np.packbits(bits, bitorder="little").view("<u8")
+
+        np.save(os.path.join(index_dir, BITMAPS_FILE), bitmaps)
+        np.save(os.path.join(index_dir, COUNTS_FILE), np.minimum(self.counts, np.iinfo(np.uint16).max).astype(np.uint16))
+        with open(os.path.join(index_dir, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        with open(os.path.join(index_dir, RECIPE_IDS_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.recipe_ids, f, ensure_ascii=False)
+        print(f"✅ [IngredientIndex] 食材索引已生成: {len(self.recipe_ids)} 个菜谱, {len(vocab)} 种食材 -> {index_dir}")
+        return len(self.recipe_ids)
+
+
+def _unpack(words: np.ndarray) -> np.ndarray:
+    """uint64 位图 -> bool 数组 (第 r 位对应第 r 个菜谱)"""
+    return np.unpackbits(np.ascontiguousarray(words).view(np.uint8), bitorder="little").astype(bool)
+
+
+class IngredientIndex:
+    def __init__(self, index_dir: str = INGREDIENT_INDEX_DIR):
+        self.bitmaps = np.load(os.path.join(index_dir, BITMAPS_FILE), mmap_mode="r")
+        self.counts = np.load(os.path.join(index_dir, COUNTS_FILE), mmap_mode="r")
+        with open(os.path.join(index_dir, VOCAB_FILE), "r", encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        with open(os.path.join(index_dir, RECIPE_IDS_FILE), "r", encoding="utf-8") as f:
+            self.recipe_ids = json.load(f)
+        self.column = {name: i for i, name in enumerate(self.vocab)}
+        # 忌口排除集 key -> 排除位图 (偏好相同的用户共用一份)
+        self._exclusions = TTLCache(maxsize=EXCLUSION_CACHE_SIZE)
+
+    def __len__(self) -> int:
+        return len(self.recipe_ids)
+
+    def exclusion_bitmap(self, exclusion):
+        """食材名命中忌口词的菜谱位图 (忌口 "香菜" 也会排除 "香菜末")；没有命中时返回 None"""
+        if exclusion is None or not exclusion:
+            return None
+        cached = self._exclusions.get(exclusion.key)
+        if cached is not None:
+            return cached if cached is not False else None
+        rows = [i for i, name in enumerate(self.vocab) if exclusion.match(name)]
+        bitmap = np.bitwise_or.reduce(self.bitmaps[rows], axis=0) if rows else None
+        self._exclusions.set(exclusion.key, bitmap if bitmap is not None else False)
+        return bitmap
+
+    def search(self, ingredients: list, limit: int = 10, max_missing: int = None, exclude: np.ndarray = None):
+        """
+        :param ingredients: 用户手里的食材 (未归一化)
+        :param max_missing: 最多还缺几种食材，None 表示不限
+        :param exclude: 需要排除的菜谱位图 (exclusion_bitmap 的结果)
+        :return: ([(菜谱 id, 命中数, 缺少数), ...] 按缺少数升序、命中数降序, 索引里没有的食材)
+        """
+        names = normalize_ingredients(ingredients)
+        known = [self.column[n] for n in names if n in self.column]
+        unknown = [n for n in names if n not in self.column]
+        if not known:
+            return [], unknown
+
+        # 位切片计数器：planes[j] 的第 r 位 = 菜谱 r 的命中数的第 j 个二进制位
+        planes = []
+        for col in known:
+            carry = np.array(self.bitmaps[col])
+            for j in range(len(planes)):
+                overflow = planes[j] & carry
+                planes[j] ^= carry
+                carry = overflow
+                if not carry.any():
+                    break
+            if carry.any():
+                planes.append(carry)
+
+        hit_any = np.bitwise_or.reduce(planes, axis=0) if len(planes) > 1 else planes[0].copy()
+        if exclude is not None:
+            hit_any &= ~exclude
+        rows = np.flatnonzero(_unpack(hit_any))[:len(self)]
+        if not len(rows):
+            return [], unknown
+
+        hits = np.zeros(len(rows), dtype=np.int32)
+        for j, plane in enumerate(planes):
+            hits += _unpack(plane)[rows].astype(np.int32) << j
+        missing = np.asarray(self.counts[rows], dtype=np.int32) - hits
+
+        if max_missing is not None:
+            keep = missing <= max_missing
+            rows, hits, missing = rows[keep], hits[keep], missing[keep]
+        # lexsort 以最后一个 key 为主序：缺少数升序，其次命中数降序，最后按菜谱下标保持稳定
+        order = np.lexsort((rows, -hits, missing))
+        if limit is not None:
+            order = order[:limit]
+        return [(self.recipe_ids[rows[i]], int(hits[i]), int(missing[i])) for i in order], unknown
+
+
+_index = None
+_index_lock = threading.Lock()
+# 上次加载失败时的 (索引文件签名, 时间)；None 表示还没失败过
+_index_failure = None
+
+
+def _index_signature(index_dir: str = INGREDIENT_INDEX_DIR) -> tuple:
+    """索引文件的修改时间 (不存在的文件记为 None)，用来判断索引是否被重新生成过"""
+    signature = []
+    for name in (BITMAPS_FILE, COUNTS_FILE, VOCAB_FILE, RECIPE_IDS_FILE):
+        try:
+            signature.append(os.stat(os.path.join(index_dir, name)).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _should_retry() -> bool:
+    if _index_failure is None:
+        return True
+    signature, failed_at = _index_failure
+    return signature != _index_signature() or time.monotonic() - failed_at >= INGREDIENT_INDEX_RETRY_INTERVAL
+
+
+def get_ingredient_index():
+    """
+    懒加载的单例；索引文件不存在或加载失败时返回 None。
+    失败后不会一直返回 None：索引文件被重新生成 (修改时间变化) 或超过重试间隔后会再加载一次。
+    """
+    global _index, _index_failure
+    if _index is None and _should_retry():
+        with _index_lock:
+            if _index is None and _should_retry():
+                signature = _index_signature()
+                try:
+                    _index = IngredientIndex()
+                    _index_failure = None
+                    print(f"✅ [IngredientIndex] 食材索引加载完成 ({len(_index)} 个菜谱, {len(_index.vocab)} 种食材)")
+                except Exception as e:
+                    if _index_failure is None or _index_failure[0] != signature:
+                        print(f"⚠️ [IngredientIndex] 食材索引加载失败: {e}")
+                    _index_failure = (signature, time.monotonic())
+    return _index
+
+
+def build_from_records(records, index_dir: str = INGREDIENT_INDEX_DIR) -> int:
+    """从 RAG 格式的记录 (page_content + metadata) 构建索引"""
+    builder = IngredientIndexBuilder()
+    for item in records:
+        builder.add_record(item)
+    return builder.save(index_dir)
+
+
+if __name__ == "__main__":
+    # 用法:
+    #   python -m core.ingredient_index build [数据文件]     不重新入库，直接从 RAG 数据文件构建
+    #   python -m core.ingredient_index search 鸡蛋 番茄 葱
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+    if command == "build":
+        from core.dataset import resolve_path, iter_records
+        # 默认与 core/ingest.py 的 SOURCE_FILE 相同
+        source_file = resolve_path(sys.argv[2] if len(sys.argv) > 2 else "data/recipe_rag_ready_fixed.json")
+        if not source_file:
+            print("❌ 错误：找不到源文件")
+            sys.exit(1)
+        build_from_records(iter_records(source_file))
+    else:
+        import time
+        index = get_ingredient_index()
+        start = time.perf_counter()
+        results, unknown = index.search(sys.argv[2:], limit=10)
+        print(f"用时 {(time.perf_counter() - start) * 1000:.2f} ms, 未收录: {unknown}")
+        for recipe_id, hits, missing in results:
+            print(f"   - {recipe_id}: 命中 {hits}, 缺 {missing}")
@@ -0,0 +1,169 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# ================= 指标 (Metrics) =================
+# 轻量的进程内计数器 / 直方图，不依赖 prometheus_client。
+# 搜索链路的每个阶段用 span("stage") 计时，GET /metrics 以 Prometheus 文本格式输出。
+# 多 worker 时每个进程各自计数，由 Prometheus 按实例抓取后再聚合。
+
+# 阶段耗时的桶边界 (秒)：覆盖从本地向量检索 (毫秒级) 到生图 (数十秒)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # {labels: [各桶计数 (非累计), sum, count]}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][slot] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, ([*entry[0]], entry[1], entry[2])) for key, entry in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "aichef_stage_duration_seconds", "Duration of each search pipeline stage", labels=("stage",)
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "aichef_request_duration_seconds", "Duration of API handlers", labels=("endpoint", "status")
+))
+STAGE_ERRORS = registry.register(Counter(
+    "aichef_stage_errors_total", "Exceptions raised inside a pipeline stage", labels=("stage",)
+))
+PROVIDER_CALLS = registry.register(Counter(
+    "aichef_provider_calls_total", "Calls to external LLM / image providers", labels=("provider", "outcome")
+))
+PROVIDER_RETRIES = registry.register(Counter(
+    "aichef_provider_retries_total", "Retries against external providers", labels=("provider",)
+))
+ADMISSION_DECISIONS = registry.register(Counter(
+    "aichef_admission_decisions_total", "Admission decisions for provider calls (admitted / shed / degraded)", labels=("provider", "decision")
+))
+CACHE_REQUESTS = registry.register(Counter(
+    "aichef_cache_requests_total", "Cache lookups by cache and result (hit / miss)", labels=("cache", "result")
+))
+OVERFETCH_RATIO = registry.register(Histogram(
+    "aichef_retrieval_overfetch_ratio", "Retrieved documents divided by requested limit",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+))
+
+
+@contextmanager
+def span(stage: str):
+    """
+    阶段计时：
+        with span("vector_search"):
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def timed(stage: str):
+    """span 的装饰器版本"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def render_latest() -> str:
+    return registry.render()
@@ -0,0 +1,57 @@
+import hashlib
+from core.config import PERSONALIZATION_WEIGHT
+from core.retriever import get_embeddings_by_ids
+
+# ================= 个性化排序 =================
+# 用户口味向量 = 收藏菜谱向量的均值 (归一化后)。检索结果本身与用户无关，
+# 这里把 "与查询的相似度" 和 "与口味向量的相似度" 加权合并后重新排序：
+#   final = (1 - distance / 2) + weight * cos(candidate, taste)
+# 候选向量按 id 批量取出，整批只做一次矩阵乘法。
+# numpy 在函数内导入，不增加 API 进程的启动时间。
+
+
+def taste_from_sum(vector_sum, count: int):
+    """由向量和与个数得到归一化的口味向量；没有收藏时返回 None"""
+    import numpy as np
+    if vector_sum is None or count <= 0:
+        return None
+    norm = np.linalg.norm(vector_sum)
+    if not norm:
+        return None
+    return (vector_sum / norm).astype(np.float32)
+
+
+def taste_key(taste) -> str:
+    """口味向量的指纹，用于拼缓存 key (没有口味向量时为空串)"""
+    if taste is None:
+        return ""
+    return hashlib.sha1(taste.tobytes()).hexdigest()[:16]
+
+
+def rerank(candidates: list, taste, weight: float = PERSONALIZATION_WEIGHT) -> list:
+    """
+    按口味向量对 retrieve_docs 的结果重新排序 (不改变条目内容)
+    :param candidates: retrieve_docs 返回的文档字典列表，score 为 l2 距离
+    :param taste: 归一化的口味向量，None 时原样返回
+    """
+    if taste is None or not weight or len(candidates) < 2:
+        return candidates
+    import numpy as np
+
+    vectors = get_embeddings_by_ids([doc.get('id') for doc in candidates])
+    if not vectors:
+        return candidates
+
+    dim = len(taste)
+    matrix = np.zeros((len(candidates), dim), dtype=np.float32)
+    for i, doc in enumerate(candidates):
+        vec = vectors.get(str(doc.get('id')))
+        if vec is not None and len(vec) == dim:
+            matrix[i] = vec
+
+    # 距离 -> 相似度 (向量已归一化时 l2² = 2 - 2cos)
+    similarity = 1.0 - np.asarray([doc.get('score', 0.0) for doc in candidates], dtype=np.float32) / 2.0
+    final = similarity + weight * (matrix @ taste)
+    # 稳定排序：得分相同时保持原检索顺序
+    order = np.argsort(-final, kind="stable")
+    return [candidates[i] for i in order]
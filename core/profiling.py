@@ -0,0 +1,169 @@
+import contextvars
+import functools
+import inspect
+import os
+import random
+import secrets
+import time
+from core.config import PROFILE_SAMPLE_RATE, PROFILE_ADMIN_TOKEN, PROFILE_DIR
+
+# ================= 按需性能剖析 (Profiling) =================
+# 线上某个查询特别慢又复现不了时，对单个请求开启采样剖析：
+#   - 请求头 X-Profile 带上管理员 token (AICHEF_PROFILE_TOKEN)，或
+#   - 按 AICHEF_PROFILE_SAMPLE_RATE 随机抽样
+# 被选中的请求在 pyinstrument 采样 profiler 下执行，结果保存在 data/profiles/<id>.html (火焰图)，
+# 响应头 X-Profile-Id 返回 id。两种方式都没开启时，装饰器原样返回处理函数、中间件不注册，没有任何额外开销。
+# 未安装 pyinstrument 时退回 cProfile：它是逐个函数调用的确定性追踪，不是采样，
+# 被剖析的请求会明显变慢，结果保存为 <id>.prof，响应头 X-Profile-Kind 和报告开头都会标明。
+
+PROFILING_ENABLED = PROFILE_SAMPLE_RATE > 0 or bool(PROFILE_ADMIN_TOKEN)
+
+try:
+    import pyinstrument  # noqa: F401
+    SAMPLING_AVAILABLE = True
+except ImportError:
+    SAMPLING_AVAILABLE = False
+
+# 剖析方式: sampling (pyinstrument) / tracing (cProfile 兜底)
+PROFILE_KIND = "sampling" if SAMPLING_AVAILABLE else "tracing"
+
+if PROFILING_ENABLED and not SAMPLING_AVAILABLE:
+    print("⚠️ [Profiling] 未安装 pyinstrument，退回 cProfile 确定性追踪 (非采样，开销大)；pip install pyinstrument")
+
+# 中间件为被选中的请求放一个可变的 dict，处理函数 (可能在线程池里) 把 profile id 写回去
+_current = contextvars.ContextVar("aichef_profile", default=None)
+
+
+def is_admin(header_token: str = None) -> bool:
+    return bool(PROFILE_ADMIN_TOKEN and header_token and secrets.compare_digest(header_token, PROFILE_ADMIN_TOKEN))
+
+
+def should_profile(header_token: str = None) -> bool:
+    if is_admin(header_token):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def begin_request(header_token: str = None):
+    """中间件调用：决定是否剖析本次请求，返回 (holder, token)；不剖析时 holder 为 None"""
+    if not should_profile(header_token):
+        return None, None
+    holder = {"id": None}
+    return holder, _current.set(holder)
+
+
+def end_request(token):
+    if token is not None:
+        _current.reset(token)
+
+
+def _new_profile_id(name: str) -> str:
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{secrets.token_hex(4)}"
+
+
+class _Session:
+    """一次剖析：pyinstrument 采样 (输出 HTML 火焰图)，没有安装时退回 cProfile 确定性追踪"""
+
+    def __init__(self, name: str, is_async: bool = False):
+        self.id = _new_profile_id(name)
+        if SAMPLING_AVAILABLE:
+            from pyinstrument import Profiler
+            self._profiler = Profiler(async_mode="enabled" if is_async else "disabled")
+            self._kind = "pyinstrument"
+        else:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._kind = "cprofile"
+
+    def start(self) -> bool:
+        """同一时刻只能有一个 profiler 生效 (例如两个并发请求同时被抽中)，启动失败时不剖析"""
+        try:
+            if self._kind == "pyinstrument":
+                self._profiler.start()
+            else:
+                self._profiler.enable()
+            return True
+        except (RuntimeError, ValueError) as e:
+            print(f"⚠️ [Profiling] 无法启动 profiler，本次请求不剖析: {e}")
+            return False
+
+    def stop(self) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if self._kind == "pyinstrument":
+            self._profiler.stop()
+            path = os.path.join(PROFILE_DIR, f"{self.id}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            path = os.path.join(PROFILE_DIR, f"{self.id}.prof")
+            self._profiler.dump_stats(path)
+        print(f"🔬 [Profiling] 已保存: {path}")
+        return path
+
+
+def profiled(name: str):
+    """
+    处理函数装饰器：被中间件选中的请求在 profiler 下执行。
+    未开启剖析时直接返回原函数。
+    """
+    def decorator(fn):
+        if not PROFILING_ENABLED:
+            return fn
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                holder = _current.get()
+                if holder is None:
+                    return await fn(*args, **kwargs)
+                session = _Session(name, is_async=True)
+                if not session.start():
+                    return await fn(*args, **kwargs)
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    session.stop()
+                    holder["id"] = session.id
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            holder = _current.get()
+            if holder is None:
+                return fn(*args, **kwargs)
+            session = _Session(name)
+            if not session.start():
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                session.stop()
+                holder["id"] = session.id
+        return wrapper
+    return decorator
+
+
+def find_profile(profile_id: str):
+    """
+    :return: (文件路径, 类型 "html" / "prof")；不存在或 id 非法时返回 (None, None)
+    """
+    # id 只由本模块生成，拒绝任何可能跳出目录的字符
+    if not profile_id or not all(c.isalnum() or c == "-" for c in profile_id):
+        return None, None
+    for ext in ("html", "prof"):
+        path = os.path.join(PROFILE_DIR, f"{profile_id}.{ext}")
+        if os.path.exists(path):
+            return path, ext
+    return None, None
+
+
+def render_cprofile(path: str, limit: int = 60) -> str:
+    """把 cProfile 结果渲染成按累计耗时排序的文本"""
+    import io
+    import pstats
+    out = io.StringIO()
+    out.write("# cProfile 确定性追踪 (非采样)：追踪本身的开销会放大函数调用多的代码的耗时，\n"
+              "# 绝对耗时偏高，只适合比较相对占比。安装 pyinstrument 可得到采样火焰图。\n\n")
+    pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,362 @@
+import json
+import mmap
+import os
+import sys
+import time
+import numpy as np
+from core.config import QUANT_INDEX_DIR, QUANT_RESCORE_FACTOR
+
+# ================= 量化向量索引 =================
+# bge-small-zh 输出 512 维 float32 向量，每个 uvicorn worker 都要在内存里持有一份。
+# 这里在入库时额外导出一份量化索引：
+#   - int8 (逐向量对称标量量化，x ≈ q * scale) 或 float16 常驻内存，用于第一轮粗排
+#   - float32 原始向量以 mmap 方式打开，只在精排时读取候选行，不占常驻内存
+# 检索流程：量化向量粗排取 top (k * rescore_factor) -> float32 精确重打分 -> top k
+#
+# 多 worker 共享模式 (shared=True)：
+#   所有向量文件都以只读 mmap 打开，文档 (已解码的 metadata + 正文) 存在 docs.jsonl 里，
+#   按 doc_offsets.npy 切片读取。多个 uvicorn worker 通过操作系统页缓存共享同一份物理内存，
+#   worker 不再需要打开 Chroma，增加 worker 几乎不增加内存。
+
+IDS_FILE = "ids.json"
+F32_FILE = "vectors_f32.npy"
+INT8_FILE = "vectors_int8.npy"
+SCALES_FILE = "scales.npy"
+F16_FILE = "vectors_f16.npy"
+DOCS_FILE = "docs.jsonl"
+DOC_OFFSETS_FILE = "doc_offsets.npy"
+# 每行对应的菜谱 id (metadata.id)，用于按菜谱 id 批量取文档
+RECIPE_IDS_FILE = "recipe_ids.json"
+
+# Chroma 里以 JSON 字符串存储的 metadata 字段，导出时预先解码
+JSON_METADATA_FIELDS = ("tags", "instructions", "ingredients")
+
+# 粗排时分块计算，避免把整个 int8 矩阵临时转换成 float32
+CHUNK_ROWS = 8192
+
+
+def quantize_int8(vectors: np.ndarray):
+    """逐向量对称量化：返回 (int8 矩阵, float32 scale)"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def _decode_metadata(meta: dict) -> dict:
+    meta = dict(meta or {})
+    for field in JSON_METADATA_FIELDS:
+        value = meta.get(field)
+        if isinstance(value, str):
+            try:
+                meta[field] = json.loads(value)
+            except json.JSONDecodeError:
+                pass
+    return meta
+
+
+def build_quantized_index(vector_store, index_dir: str = QUANT_INDEX_DIR, page_size: int = 5000) -> int:
+    """
+    从 Chroma 集合中导出全部向量和文档，生成量化索引文件。
+    入库 (core/ingest.py) 完成后自动调用，也可以对已有数据库单独执行：
+        python -m core.quantized_index build
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    docs_path = os.path.join(index_dir, DOCS_FILE)
+
+    ids, recipe_ids, chunks, offsets = [], [], [], [0]
+    offset = 0
+    with open(docs_path, "wb") as docs_file:
+        while True:
+            page = vector_store.get(include=["embeddings", "metadatas", "documents"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            ids.extend(page["ids"])
+            chunks.append(np.asarray(page["embeddings"], dtype=np.float32))
+            # 文档与向量同序写出，行号即向量下标
+            for doc_id, meta, content in zip(page["ids"], page["metadatas"], page["documents"]):
+                recipe_ids.append(str((meta or {}).get("id", "")))
+                line = json.dumps(
+                    {"id": doc_id, "page_content": content, "metadata": _decode_metadata(meta)},
+                    ensure_ascii=False, separators=(",", ":"),
+                ).encode("utf-8") + b"\n"
+                docs_file.write(line)
+                offsets.append(offsets[-1] + len(line))
+            offset += len(page["ids"])
+
+    if not ids:
+        print("⚠️ [QuantIndex] 向量库为空，跳过量化索引构建")
+        return 0
+
+    vectors = np.vstack(chunks)
+    # 入库时已 normalize_embeddings=True，这里再归一化一次，保证点积 == 余弦相似度
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+
+    quantized, scales = quantize_int8(vectors)
+    np.save(os.path.join(index_dir, F32_FILE), vectors)
+    np.save(os.path.join(index_dir, INT8_FILE), quantized)
+    np.save(os.path.join(index_dir, SCALES_FILE), scales)
+    np.save(os.path.join(index_dir, F16_FILE), vectors.astype(np.float16))
+    np.save(os.path.join(index_dir, DOC_OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(index_dir, IDS_FILE), "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    with open(os.path.join(index_dir, RECIPE_IDS_FILE), "w", encoding="utf-8") as f:
+        json.dump(recipe_ids, f, ensure_ascii=False)
+
+    print(f"✅ [QuantIndex] 量化索引已生成: {len(ids)} 条, 维度 {vectors.shape[1]} -> {index_dir}")
+    return len(ids)
+
+
+class DocStore:
+    """只读 mmap 文档库：按行号取出已解码的 {id, page_content, metadata}"""
+
+    def __init__(self, index_dir: str = QUANT_INDEX_DIR):
+        self.index_dir = index_dir
+        self.offsets = np.load(os.path.join(index_dir, DOC_OFFSETS_FILE), mmap_mode="r")
+        self._file = open(os.path.join(index_dir, DOCS_FILE), "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._rows_by_recipe_id = None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get(self, row: int) -> dict:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self._mm[start:end])
+
+    def row_of(self, recipe_id):
+        """菜谱 id -> 行号 (映射表首次使用时加载)"""
+        if self._rows_by_recipe_id is None:
+            path = os.path.join(self.index_dir, RECIPE_IDS_FILE)
+            if not os.path.exists(path):
+                self._rows_by_recipe_id = {}
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._rows_by_recipe_id = {rid: row for row, rid in enumerate(json.load(f))}
+        return self._rows_by_recipe_id.get(str(recipe_id))
+
+
+class QuantizedIndex:
+    """
+    量化索引 (只读)。
+    :param mode: "int8" 或 "float16"，决定粗排用哪份向量
+    :param shared: True 时粗排向量也走 mmap (多 worker 共享页缓存)，并加载 mmap 文档库
+    """
+
+    def __init__(self, index_dir: str = QUANT_INDEX_DIR, mode: str = "int8", shared: bool = False):
+        if mode not in ("int8", "float16"):
+            raise ValueError(f"不支持的量化模式: {mode}")
+        self.mode = mode
+        mmap_mode = "r" if shared else None
+
+        with open(os.path.join(index_dir, IDS_FILE), "r", encoding="utf-8") as f:
+            self.ids = json.load(f)
+
+        if mode == "int8":
+            self.vectors = np.load(os.path.join(index_dir, INT8_FILE), mmap_mode=mmap_mode)
+            self.scales = np.load(os.path.join(index_dir, SCALES_FILE), mmap_mode=mmap_mode)
+        else:
+            self.vectors = np.load(os.path.join(index_dir, F16_FILE), mmap_mode=mmap_mode)
+            self.scales = None
+
+        # 共享模式下文档直接从 mmap 文档库读取，不再回 Chroma 查询
+        self.docs = None
+        if shared and os.path.exists(os.path.join(index_dir, DOC_OFFSETS_FILE)):
+            self.docs = DocStore(index_dir)
+
+        # 精排用的 float32 向量走 mmap，只有被选中的行才会真正读入
+        self.exact = np.load(os.path.join(index_dir, F32_FILE), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def approx_scores(self, query: np.ndarray) -> np.ndarray:
+        """量化向量上的近似余弦相似度 (分块计算，临时内存有上界)"""
+        scores = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), CHUNK_ROWS):
+            block = self.vectors[start:start + CHUNK_ROWS].astype(np.float32)
+            scores[start:start + CHUNK_ROWS] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def approx_scores_batch(self, queries: np.ndarray) -> np.ndarray:
+        """
+        多个查询一起粗排：量化矩阵只扫描一遍 (矩阵乘矩阵)，而不是每个查询各扫一遍
+        :param queries: [查询数, 维度]
+        :return: [查询数, 行数]
+        """
+        scores = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        queries_t = np.ascontiguousarray(queries.T)
+        for start in range(0, len(self.ids), CHUNK_ROWS):
+            block = self.vectors[start:start + CHUNK_ROWS].astype(np.float32)
+            scores[:, start:start + CHUNK_ROWS] = (block @ queries_t).T
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search_batch(self, queries, k: int, exclude: np.ndarray = None) -> list:
+        """多个查询的 search (共用一次粗排扫描)，返回与 queries 同序的结果列表"""
+        if not len(self.ids) or k <= 0 or not len(queries):
+            return [[] for _ in queries]
+        queries = np.asarray(queries, dtype=np.float32)
+        all_scores = self.approx_scores_batch(queries)
+        return [self.search(query, k, exclude=exclude, scores=scores) for query, scores in zip(queries, all_scores)]
+
+    def search(self, query: np.ndarray, k: int, rescore_factor: int = QUANT_RESCORE_FACTOR, rescore: bool = True, exclude: np.ndarray = None, scores: np.ndarray = None):
+        """
+        :param query: 已归一化的 float32 查询向量
+        :param exclude: 可选的行级布尔掩码，True 的行在打分阶段直接屏蔽 (例如用户忌口)
+        :param scores: 已经算好的粗排分数 (search_batch 传入，会被原地修改)
+        :return: [(行号, 余弦相似度)]，按相似度降序
+        """
+        if not len(self.ids) or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+
+        if scores is None:
+            scores = self.approx_scores(query)
+        if exclude is not None:
+            scores[exclude] = -np.inf
+        shortlist_size = min(len(scores), k * max(rescore_factor, 1) if rescore else k)
+        shortlist = np.argpartition(-scores, shortlist_size - 1)[:shortlist_size]
+        if exclude is not None:
+            # 可用行数不足 shortlist_size 时，被屏蔽的行也会进入候选，这里去掉
+            shortlist = shortlist[~exclude[shortlist]]
+
+        if rescore:
+            # 精排：只读取候选行的 float32 原始向量
+            rows = np.sort(shortlist)
+            exact = self.exact[rows] @ query
+            order = np.argsort(-exact)[:k]
+            return [(int(rows[i]), float(exact[i])) for i in order]
+
+        order = np.argsort(-scores[shortlist])[:k]
+        return [(int(shortlist[i]), float(scores[shortlist[i]])) for i in order]
+
+
+def similarity_to_distance(similarity: float) -> float:
+    """
+    余弦相似度 -> Chroma 默认 l2 空间的距离 (平方欧氏距离)。
+    向量已归一化时 ||a - b||² = 2 - 2cos，这样 retrieve_docs 的 score_threshold 语义不变。
+    """
+    return 2.0 - 2.0 * similarity
+
+
+def search_with_score(vector_store, index: QuantizedIndex, query: str, k: int, exclude: np.ndarray = None):
+    """
+    与 Chroma.similarity_search_with_score 返回相同结构: [(Document, distance)]
+    向量检索在量化索引上完成；有 mmap 文档库时直接读取，否则按 id 回 Chroma 取命中文档。
+    :param vector_store: Chroma 实例；共享模式下可以传 None
+    :param query: 查询文本，或已经向量化好的查询向量
+    :param exclude: 可选的行级排除掩码，见 QuantizedIndex.search
+    """
+    if isinstance(query, str):
+        query = vector_store.embeddings.embed_query(query)
+    hits = index.search(np.asarray(query, dtype=np.float32), k, exclude=exclude)
+    return _hits_to_documents(vector_store, index, hits)
+
+
+def search_with_score_batch(vector_store, index: QuantizedIndex, queries: list, k: int, exclude: np.ndarray = None) -> list:
+    """search_with_score 的批量版本：queries 为已向量化的查询列表，返回同序的结果列表"""
+    return [_hits_to_documents(vector_store, index, hits) for hits in index.search_batch(queries, k, exclude=exclude)]
+
+
+def _hits_to_documents(vector_store, index: QuantizedIndex, hits: list) -> list:
+    from langchain_core.documents import Document
+
+    if not hits:
+        return []
+
+    if index.docs is not None:
+        results = []
+        for row, similarity in hits:
+            doc = index.docs.get(row)
+            results.append((Document(id=doc["id"], page_content=doc["page_content"], metadata=doc["metadata"]), similarity_to_distance(similarity)))
+        return results
+
+    hit_ids = [index.ids[row] for row, _ in hits]
+    fetched = vector_store.get(ids=hit_ids, include=["metadatas", "documents"])
+    by_id = {
+        doc_id: (meta, content)
+        for doc_id, meta, content in zip(fetched["ids"], fetched["metadatas"], fetched["documents"])
+    }
+
+    results = []
+    for (row, similarity), doc_id in zip(hits, hit_ids):
+        if doc_id not in by_id:
+            continue
+        meta, content = by_id[doc_id]
+        results.append((Document(id=doc_id, page_content=content, metadata=meta or {}), similarity_to_distance(similarity)))
+    return results
+
+
+# ================= 召回率报告 =================
+DEFAULT_REPORT_QUERIES = [
+    "番茄炒蛋", "红烧肉", "清蒸鱼", "麻婆豆腐", "可乐鸡翅", "酸辣土豆丝", "排骨汤",
+    "凉拌黄瓜", "宫保鸡丁", "蛋炒饭", "清淡的汤", "适合减脂的晚餐", "鸡蛋 番茄 葱",
+    "不辣的下饭菜", "烤箱甜点", "海鲜粥",
+]
+
+
+def recall_report(queries=None, k: int = 10, index_dir: str = QUANT_INDEX_DIR):
+    """
+    对比量化检索与当前 retrieve_docs 的 Chroma 精确检索结果。
+    输出每种模式 (int8 / float16，粗排 / 粗排+精排) 的 recall@k 与单次检索耗时。
+    """
+    from core.retriever import VectorDBManager
+
+    queries = queries or DEFAULT_REPORT_QUERIES
+    db = VectorDBManager.get_chroma_store()
+    if db is None:
+        print("❌ [QuantIndex] 向量库加载失败，无法生成报告")
+        return {}
+
+    query_vecs = np.asarray(db.embeddings.embed_documents(queries), dtype=np.float32)
+
+    baseline = []
+    for query in queries:
+        results = db.similarity_search_with_score(query, k=k)
+        baseline.append([doc.id for doc, _ in results])
+
+    report = {}
+    for mode in ("int8", "float16"):
+        index = QuantizedIndex(index_dir, mode=mode)
+        for rescore in (False, True):
+            recalls, elapsed = [], 0.0
+            for truth, vec in zip(baseline, query_vecs):
+                start = time.perf_counter()
+                hits = index.search(vec, k, rescore=rescore)
+                elapsed += time.perf_counter() - start
+                found = {index.ids[row] for row, _ in hits}
+                recalls.append(len(found & set(truth)) / max(len(truth), 1))
+            name = f"{mode}{'+rescore' if rescore else ''}"
+            report[name] = {
+                "recall": float(np.mean(recalls)),
+                "min_recall": float(np.min(recalls)),
+                "ms_per_query": elapsed / len(queries) * 1000,
+                "resident_mb": index.vectors.nbytes / 1024 / 1024,
+            }
+
+    print(f"📊 [QuantIndex] recall@{k} vs retrieve_docs (Chroma float32), {len(queries)} 条查询")
+    for name, row in report.items():
+        print(
+            f"   - {name:<16} recall={row['recall']:.3f} (min {row['min_recall']:.2f})  "
+            f"{row['ms_per_query']:.2f} ms/query  常驻 {row['resident_mb']:.1f} MB"
+        )
+    return report
+
+
+if __name__ == "__main__":
+    # 用法:
+    #   python -m core.quantized_index build            从现有 Chroma 库导出量化索引
+    #   python -m core.quantized_index report [查询...]  生成召回率报告
+    from core.retriever import VectorDBManager
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "report"
+    if command == "build":
+        build_quantized_index(VectorDBManager.get_chroma_store())
+    else:
+        recall_report(sys.argv[2:] or None)
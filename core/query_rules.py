@@ -0,0 +1,46 @@
+import re
+import unicodedata
+
+# ================= 搜索词本地改写规则 =================
+# 用户补充的改进意见大多是固定的几句 ("不要辣" "清淡一点" "简单点")，
+# 这些直接按规则表在本地改写，不必为每一句都调用一次 LLM。
+# 只有整句意见都能被规则覆盖时才走本地改写，剩下任何规则表不认识的内容都交给 LLM。
+
+# (意见短语的正则, 追加到搜索词后面的关键词)
+RULES = (
+    # 微辣 / 少辣 是要一点辣，不能落到下面的 "不辣" 规则里，所以放在最前面先匹配
+    (r"微辣|少辣|少放辣|一点点辣", "微辣"),
+    (r"不要辣|不吃辣|不能吃辣|别太辣|不辣|不要太辣", "不辣 清淡"),
+    (r"清淡一点|清淡一些|清淡点|清淡|少油|少盐|少油少盐|不要太油|别太油", "清淡"),
+    (r"辣一点|辣一些|辣点|多放辣|要辣|更辣|重口味|重口", "香辣"),
+    (r"简单一点|简单一些|简单点|简单|快手|快一点|省事|省时", "快手 简单"),
+    (r"素一点|素食|吃素|不要肉|不吃肉|素菜", "素菜"),
+    (r"下饭一点|下饭", "下饭"),
+    (r"甜一点|甜一些|甜点|偏甜", "甜"),
+    (r"想喝汤|要汤|汤", "汤"),
+)
+
+_COMPILED = tuple((re.compile(pattern), keywords) for pattern, keywords in RULES)
+# 意见里可以忽略的虚词和标点
+_FILLER = re.compile(r"[\s,，.。!！?？;；、~～]+|请|麻烦|帮我|我想|我要|我|想要|要|的|吧|呢|啊|哦|一下|一点|一些|再|还是|和|并且|而且|然后|但是|最好")
+
+
+def _normalize(text: str) -> str:
+    return "".join(unicodedata.normalize("NFKC", text or "").split()).lower()
+
+
+def rewrite_locally(query: str, refinement: str):
+    """
+    :return: 改写后的搜索词；意见里有规则表覆盖不了的内容时返回 None (交给 LLM)
+    """
+    remaining = _normalize(refinement)
+    if not remaining:
+        return None
+    keywords = []
+    for pattern, words in _COMPILED:
+        if pattern.search(remaining):
+            remaining = pattern.sub(" ", remaining)
+            keywords.extend(w for w in words.split() if w not in keywords)
+    if not keywords or _FILLER.sub("", remaining):
+        return None
+    return f"{query.strip()} {' '.join(keywords)}"
@@ -0,0 +1,124 @@
+import json
+import re
+
+# ================= 本地优选 (Rerank) =================
+# 以前 get_recipe_response 要等一次完整的 LLM 往返才知道该推荐哪一道菜。
+# 这里在本地给候选打分，整批候选拼成一个特征矩阵，一次矩阵乘法得到总分：
+#   - ingredient : 查询里提到的食材，候选菜谱用到了几种 (取自 ingredients 字段，旧数据取自正文的 "主要食材" 一行)
+#   - tag        : 查询里提到的标签 (川菜 / 下饭菜 / 快手菜 ...)，候选命中了几个
+#   - vector     : 向量检索的相似度 (1 - l2 距离 / 2)
+#   - penalty    : 命中用户忌口，或查询里明确说不要的东西 ("不要香菜" / "不辣")
+# 几个候选的打分在亚毫秒级完成。LLM 只负责写推荐语，快速模式下连推荐语也不调用 LLM。
+# numpy 在函数内导入，不增加 API 进程的启动时间。
+
+# 特征顺序: ingredient, tag, vector, penalty
+FEATURE_WEIGHTS = (0.6, 0.3, 1.0, -1.0)
+
+_INGREDIENT_LINE = re.compile(r"主要食材[:：]\s*(.*)")
+# 食材写法为 "虾(200g)"，去掉括号里的用量
+_AMOUNT = re.compile(r"[(（].*?[)）]")
+# 查询里的否定说法："不要香菜" "别放葱" "不吃辣" "不辣"
+_NEGATION = re.compile(r"(?:不要|不想吃|不吃|不能吃|别放|不放|不加|不含|忌)([一-龥A-Za-z]{1,6}?)(?=[，,。；;、\s和与跟或]|的|$)|不(辣|甜|油|咸|酸)")
+
+
+def parse_ingredients(content: str) -> list:
+    """从文档正文的 "主要食材: 虾(200g), 土豆" 一行取出食材名"""
+    match = _INGREDIENT_LINE.search(content or "")
+    if not match:
+        return []
+    names = []
+    for part in re.split(r"[,，、]", match.group(1)):
+        name = _AMOUNT.sub("", part).strip()
+        if name:
+            names.append(name)
+    return names
+
+
+def doc_ingredients(doc: dict) -> list:
+    """文档的食材名：优先用 ingredients 字段 (Chroma 里是 JSON 字符串)，旧数据从正文解析"""
+    return _parse_tags(doc.get('ingredients')) or parse_ingredients(doc.get('content', ''))
+
+
+def _parse_tags(tags) -> list:
+    if isinstance(tags, str):
+        try:
+            tags = json.loads(tags)
+        except ValueError:
+            tags = [t.strip() for t in tags.split(",")]
+    return [t for t in (tags or []) if t]
+
+
+def split_query(query: str):
+    """
+    :return: (去掉否定说法后的查询, 查询里明确不要的词)
+    例如 "土豆炖牛肉不要香菜" -> ("土豆炖牛肉", ["香菜"])
+    """
+    avoid = []
+    for match in _NEGATION.finditer(query or ""):
+        word = match.group(1) or match.group(2)
+        if word:
+            avoid.append(word)
+    return _NEGATION.sub(" ", query or ""), avoid
+
+
+def _mentioned_matrix(wanted: str, per_candidate: list):
+    """
+    :param per_candidate: 每个候选的词列表 (食材或标签)
+    :return: (候选 x 查询中出现的词 的 0/1 矩阵, 查询中出现的词)
+    """
+    import numpy as np
+    vocab = sorted({w for words in per_candidate for w in words if w in wanted})
+    column = {w: j for j, w in enumerate(vocab)}
+    matrix = np.zeros((len(per_candidate), len(vocab)), dtype=np.float32)
+    for i, words in enumerate(per_candidate):
+        for w in words:
+            j = column.get(w)
+            if j is not None:
+                matrix[i, j] = 1.0
+    return matrix, vocab
+
+
+def score_candidates(query: str, candidates: list, exclusion=None):
+    """
+    :param candidates: retrieve_docs 返回的文档字典列表，score 为 l2 距离
+    :param exclusion: 用户的忌口排除集 (core.exclusion.ExclusionSet)，可为 None
+    :return: (每个候选的总分 np.ndarray, 每个候选命中的查询食材列表)
+    """
+    import numpy as np
+
+    wanted, avoid = split_query(query)
+    ingredients = [doc_ingredients(doc) for doc in candidates]
+    tags = [_parse_tags(doc.get('tags')) for doc in candidates]
+
+    features = np.zeros((len(candidates), len(FEATURE_WEIGHTS)), dtype=np.float32)
+
+    ing_matrix, ing_vocab = _mentioned_matrix(wanted, ingredients)
+    if ing_vocab:
+        features[:, 0] = ing_matrix.sum(axis=1) / len(ing_vocab)
+    tag_matrix, tag_vocab = _mentioned_matrix(wanted, tags)
+    if tag_vocab:
+        features[:, 1] = tag_matrix.sum(axis=1) / len(tag_vocab)
+    features[:, 2] = 1.0 - np.asarray([doc.get('score', 0.0) for doc in candidates], dtype=np.float32) / 2.0
+
+    avoid_pattern = re.compile("|".join(map(re.escape, avoid))) if avoid else None
+    for i, doc in enumerate(candidates):
+        text = doc.get('name', '') + str(doc.get('tags', '')) + doc.get('content', '')
+        if (exclusion is not None and exclusion.excluded_by(doc)) or (avoid_pattern and avoid_pattern.search(text)):
+            features[i, 3] = 1.0
+
+    scores = features @ np.asarray(FEATURE_WEIGHTS, dtype=np.float32)
+    matched = [[ing_vocab[j] for j in np.flatnonzero(row)] for row in ing_matrix] if ing_vocab else [[] for _ in candidates]
+    return scores, matched
+
+
+def select_best(query: str, candidates: list, exclusion=None):
+    """
+    :return: (最佳候选的下标, 它命中的查询食材列表)；没有候选时返回 (0, [])
+    """
+    if not candidates:
+        return 0, []
+    import numpy as np
+    scores, matched = score_candidates(query, candidates, exclusion)
+    # 得分相同时取检索排名靠前的
+    best = int(np.argmax(scores))
+    return best, matched[best]
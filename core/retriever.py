@@ -1,7 +1,15 @@
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from core.config import DB_PATH_V3, EMBEDDING_MODEL_NAME, COLLECTION_NAME
-import torch
+import threading
+import time
+from core.config import (
+    DB_PATH_V3, COLLECTION_NAME, VECTOR_STORE_MODE, QUANT_INDEX_DIR, SHARED_INDEX,
+    WARMUP_QUERY, WARMUP_RETRY_DELAY, WARMUP_RETRY_MAX_DELAY,
+)
+from core.exclusion import ExclusionSet, get_exclusion
+from core.cache import TTLCache
+from core.metrics import span, timed, record_cache
+
+# 注意：torch / langchain_chroma / langchain_huggingface 都在真正加载向量库时才导入，
+# 这样只用到用户接口或管理脚本的进程不必为它们付出数秒的导入时间
 
 class VectorDBManager:
     """
@@ -9,49 +17,368 @@ class VectorDBManager:
     """
     _instance = None
     _vector_store = None
+    _embeddings = None
+    _quantized_index = None
+    _quantized_failed = False
+    # 预热线程和第一批请求可能同时触发加载，用锁保证只加载一份
+    _lock = threading.RLock()
+    # 预热状态: pending -> warming -> ready / failed
+    # failed 之后预热会退避重试；懒加载路径先加载成功时也直接转为 ready
+    _warmup_status = "pending"
+
+    @classmethod
+    def _loaded(cls):
+        if cls._warmup_status == "failed":
+            print("✅ [Retriever] 向量库已在请求中加载成功，恢复就绪")
+            cls._warmup_status = "ready"
 
     @classmethod
     def get_vector_store(cls):
+        return cls.get_chroma_store()
+
+    @classmethod
+    def get_embeddings(cls):
+        """Embedding 模型 (Chroma 和共享索引模式共用同一个实例)"""
+        if cls._embeddings is None:
+            with cls._lock:
+                if cls._embeddings is None:
+                    from core.embeddings import get_embeddings
+                    # 按 AICHEF_EMBEDDING_BACKEND 选择 torch / onnx
+                    cls._embeddings = get_embeddings()
+        return cls._embeddings
+
+    @classmethod
+    def get_quantized_index(cls):
+        """量化索引 (仅在 VECTOR_STORE_MODE 为 int8 / float16 时加载)"""
+        if VECTOR_STORE_MODE == "chroma" or cls._quantized_failed:
+            return None
+        if cls._quantized_index is None:
+            with cls._lock:
+                if cls._quantized_index is None:
+                    try:
+                        from core.quantized_index import QuantizedIndex
+                        cls._quantized_index = QuantizedIndex(QUANT_INDEX_DIR, mode=VECTOR_STORE_MODE, shared=SHARED_INDEX)
+                        shared = "共享 mmap" if cls._quantized_index.docs is not None else "进程内"
+                        print(f"✅ [Retriever] 量化索引加载完成 ({VECTOR_STORE_MODE}, {shared}, {len(cls._quantized_index)} 条)")
+                        if cls._quantized_index.docs is not None:
+                            # 共享索引模式不需要 Chroma，索引加载成功即可提供检索
+                            cls._loaded()
+                    except Exception as e:
+                        print(f"⚠️ [Retriever] 量化索引加载失败，回退到 Chroma 检索: {e}")
+                        cls._quantized_failed = True
+                        return None
+        return cls._quantized_index
+
+    @classmethod
+    def get_chroma_store(cls):
         if cls._vector_store is None:
-            print(f"🔄 [Retriever] 正在初始化向量库: {DB_PATH_V3}")
-            try:
-                if torch.backends.mps.is_available():
-                    device = "mps"
-                elif torch.cuda.is_available():
-                    device = "cuda"
-                else:
-                    device = "cpu"
-                embeddings = HuggingFaceEmbeddings(
-                    model_name=EMBEDDING_MODEL_NAME,
-                    model_kwargs={'device': device},
-                    encode_kwargs={'normalize_embeddings': True}
-                )
-                # ⚠️ collection_name 必须和你 ingest 入库时的一致！
-                # 之前我们用的是 "recipe_collection_v3"
-                cls._vector_store = Chroma(
-                    collection_name=COLLECTION_NAME, 
-                    embedding_function=embeddings,
-                    persist_directory=DB_PATH_V3
-                )
-                print("✅ [Retriever] 向量库加载完成")
-            except Exception as e:
-                print(f"❌ [Retriever] 数据库加载失败: {e}")
-                return None
+            with cls._lock:
+                if cls._vector_store is None:
+                    print(f"🔄 [Retriever] 正在初始化向量库: {DB_PATH_V3}")
+                    try:
+                        from langchain_chroma import Chroma
+                        embeddings = cls.get_embeddings()
+                        # ⚠️ collection_name 必须和你 ingest 入库时的一致！
+                        # 之前我们用的是 "recipe_collection_v3"
+                        cls._vector_store = Chroma(
+                            collection_name=COLLECTION_NAME, 
+                            embedding_function=embeddings,
+                            persist_directory=DB_PATH_V3
+                        )
+                        print("✅ [Retriever] 向量库加载完成")
+                        cls._loaded()
+                    except Exception as e:
+                        print(f"❌ [Retriever] 数据库加载失败: {e}")
+                        return None
         return cls._vector_store
 
 
-def retrieve_docs(query: str, top_k: int = 4, score_threshold: float = 1.0, preferences: dict = None):
+# 查询向量缓存 (同一查询在自适应召回的多轮检索、重复搜索之间复用)
+_query_vectors = TTLCache(maxsize=1024, ttl=600)
+
+
+def warm_up(query: str = WARMUP_QUERY) -> bool:
     """
-    检索核心函数
-    :param preferences: 用户偏好字典，例如 {"dislikes": ["香菜", "辣"]}
+    预热：加载 Embedding 模型、向量库 (以及量化索引)，再跑一次真实检索，
+    让第一位用户不用承担冷启动的几秒钟。
     """
+    VectorDBManager._warmup_status = "warming"
+    start = time.perf_counter()
+    try:
+        index = VectorDBManager.get_quantized_index()
+        if index is not None and index.docs is not None:
+            # 共享索引模式不需要 Chroma，只加载 Embedding 模型
+            VectorDBManager.get_embeddings()
+        elif VectorDBManager.get_vector_store() is None:
+            VectorDBManager._warmup_status = "failed"
+            return False
+        retrieve_docs(query, top_k=1)
+    except Exception as e:
+        print(f"❌ [Retriever] 预热失败: {e}")
+        VectorDBManager._warmup_status = "failed"
+        return False
+
+    VectorDBManager._warmup_status = "ready"
+    print(f"🔥 [Retriever] 预热完成，用时 {time.perf_counter() - start:.2f}s")
+    return True
+
+
+def warm_up_until_ready(query: str = WARMUP_QUERY):
+    """启动预热的后台线程入口：失败后按指数退避重试，直到就绪 (懒加载先成功时也停止)"""
+    delay = WARMUP_RETRY_DELAY
+    while not warm_up(query):
+        if VectorDBManager._warmup_status == "ready":
+            return
+        print(f"⏳ [Retriever] {delay:.0f} 秒后重试预热")
+        time.sleep(delay)
+        if VectorDBManager._warmup_status == "ready":
+            return
+        delay = min(delay * 2, WARMUP_RETRY_MAX_DELAY)
+
+
+def warmup_status() -> str:
+    return VectorDBManager._warmup_status
+
+
+def _format_doc(metadata: dict, content: str, score: float = 0.0) -> dict:
+    """把向量库里的一条文档整理成统一的字典结构"""
+    return {
+        "id": metadata.get('id', ''),          # 建议加上 ID
+        "name": metadata.get('name', '未知'),
+        "tags": metadata.get('tags', ''),
+        "ingredients": metadata.get('ingredients', []),
+        "image": metadata.get('image', ''),
+        
+        # ✅【新增关键修改】提取步骤数据
+        "instructions": metadata.get('instructions', []), 
+        
+        "content": content,
+        "score": score
+    }
+
+
+@timed("doc_lookup")
+def get_docs_by_ids(recipe_ids: list) -> dict:
+    """
+    按菜谱 id 批量取文档 (一次查询，而不是每个 id 查一次)
+    :return: {菜谱 id (str): 文档字典}，找不到的 id 不出现在结果里
+    """
+    wanted = [str(rid) for rid in dict.fromkeys(recipe_ids) if rid is not None]
+    if not wanted:
+        return {}
+
+    # 共享索引模式：直接按行号从 mmap 文档库读取
+    index = VectorDBManager.get_quantized_index()
+    if index is not None and index.docs is not None:
+        found = {}
+        for rid in wanted:
+            row = index.docs.row_of(rid)
+            if row is not None:
+                doc = index.docs.get(row)
+                found[rid] = _format_doc(doc["metadata"], doc["page_content"])
+        return found
+
+    db = VectorDBManager.get_vector_store()
+    if not db:
+        return {}
+
+    # metadata.id 入库时可能是数字也可能是字符串，两种类型分别批量查询
+    numeric = [int(rid) for rid in wanted if rid.isdigit()]
+    found = {}
+    for values in (wanted, numeric):
+        if not values:
+            continue
+        page = db.get(where={"id": {"$in": values}}, include=["metadatas", "documents"])
+        for meta, content in zip(page["metadatas"], page["documents"]):
+            rid = str((meta or {}).get("id", ""))
+            found.setdefault(rid, _format_doc(meta or {}, content))
+    return found
+
+
+@timed("embedding_lookup")
+def get_embeddings_by_ids(recipe_ids: list) -> dict:
+    """
+    按菜谱 id 批量取归一化后的 float32 向量 (个性化排序用)
+    :return: {菜谱 id (str): np.ndarray}，找不到的 id 不出现在结果里
+    """
+    import numpy as np
+
+    wanted = [str(rid) for rid in dict.fromkeys(recipe_ids) if rid is not None]
+    if not wanted:
+        return {}
+
+    # 共享索引模式：按行号直接读 mmap 里的 float32 原始向量
+    index = VectorDBManager.get_quantized_index()
+    if index is not None and index.docs is not None:
+        found = {}
+        for rid in wanted:
+            row = index.docs.row_of(rid)
+            if row is not None:
+                found[rid] = np.asarray(index.exact[row], dtype=np.float32)
+        return found
+
     db = VectorDBManager.get_vector_store()
     if not db:
+        return {}
+
+    numeric = [int(rid) for rid in wanted if rid.isdigit()]
+    found = {}
+    for values in (wanted, numeric):
+        if not values:
+            continue
+        page = db.get(where={"id": {"$in": values}}, include=["embeddings", "metadatas"])
+        for meta, vec in zip(page["metadatas"], page["embeddings"]):
+            rid = str((meta or {}).get("id", ""))
+            if rid not in found:
+                vec = np.asarray(vec, dtype=np.float32)
+                norm = np.linalg.norm(vec)
+                found[rid] = vec / norm if norm else vec
+    return found
+
+
+def prepare_exclusion(preferences: dict):
+    """
+    编译偏好对应的忌口排除集 (保存偏好时调用，搜索时直接命中缓存)。
+    共享索引模式下同时生成整个菜谱库的行级掩码，检索时在打分阶段就屏蔽忌口菜。
+    """
+    exclusion = get_exclusion(preferences)
+    if exclusion is None:
+        return None
+    index = VectorDBManager.get_quantized_index()
+    if index is not None and index.docs is not None:
+        exclusion.build_mask(index.docs)
+    return exclusion
+
+
+def embed_query(query: str):
+    """
+    查询向量化 (带缓存)：自适应扩大召回时同一个查询会检索多轮，只向量化一次
+    """
+    vector = _query_vectors.get(query)
+    record_cache("query_vector", vector is not None)
+    if vector is None:
+        with span("embedding"):
+            vector = VectorDBManager.get_embeddings().embed_query(query)
+        _query_vectors.set(query, vector)
+    return vector
+
+
+def embed_queries(queries: list) -> list:
+    """
+    批量向量化 (带缓存)：未命中缓存的查询合成一批，只调用一次模型
+    :return: 与 queries 同序的向量列表
+    """
+    vectors = [_query_vectors.get(q) for q in queries]
+    missing = list(dict.fromkeys(q for q, v in zip(queries, vectors) if v is None))
+    for v in vectors:
+        record_cache("query_vector", v is not None)
+    if missing:
+        with span("embedding"):
+            embedded = VectorDBManager.get_embeddings().embed_documents(missing)
+        fresh = dict(zip(missing, embedded))
+        for q, vec in fresh.items():
+            _query_vectors.set(q, vec)
+        vectors = [v if v is not None else fresh[q] for q, v in zip(queries, vectors)]
+    return vectors
+
+
+def _usable_mask(exclusion, index):
+    """掩码已就绪时忌口菜在打分阶段就被屏蔽 (索引重建后长度不一致则退回后置过滤)"""
+    if exclusion is not None and exclusion.mask is not None and len(exclusion.mask) == len(index):
+        return exclusion.mask
+    return None
+
+
+def retrieve_docs(query: str, top_k: int = 4, score_threshold: float = 1.0, preferences: dict = None, exclusion: ExclusionSet = None, stats: dict = None):
+    """
+    检索核心函数
+    :param preferences: 用户偏好字典，例如 {"dislikes": ["香菜", "辣"]}
+    :param exclusion: 已编译的忌口排除集；不传时按 preferences 从缓存获取
+    :param stats: 可选的字典，写入 fetched (向量检索返回条数) 和 exhausted
+                  (再扩大 top_k 也不会有更多结果：库里不够 top_k 条，或尾部已超出阈值)
+    """
+    stats = stats if stats is not None else {}
+    stats["fetched"], stats["exhausted"] = 0, True
+    if exclusion is None and preferences:
+        exclusion = get_exclusion(preferences)
+
+    # 执行检索 (量化模式下先在量化索引上粗排 + 精排，再取文档)
+    index = VectorDBManager.get_quantized_index()
+    shared = index is not None and index.docs is not None
+    db = None
+    if not shared:
+        db = VectorDBManager.get_vector_store()
+        if not db:
+            return []
+    try:
+        query_vec = embed_query(query)
+    except Exception as e:
+        print(f"❌ [Retriever] Embedding 模型加载失败: {e}")
         return []
 
-    # 执行检索
-    results = db.similarity_search_with_score(query, k=top_k)
+    mask = None
+    with span("vector_search"):
+        if shared:
+            # 共享索引模式：向量和文档都来自 mmap 文件，不打开 Chroma
+            from core.quantized_index import search_with_score
+            mask = _usable_mask(exclusion, index)
+            results = search_with_score(None, index, query_vec, top_k, exclude=mask)
+        elif index is not None:
+            from core.quantized_index import search_with_score
+            results = search_with_score(db, index, query_vec, top_k)
+        else:
+            results = db.similarity_search_by_vector_with_relevance_scores(query_vec, k=top_k)
     
+    with span("filtering"):
+        return _filter_results(results, top_k, score_threshold, exclusion, mask, stats)
+
+
+def retrieve_docs_batch(queries: list, top_k: int = 4, score_threshold: float = 1.0, preferences: dict = None, exclusion: ExclusionSet = None, stats_list: list = None) -> list:
+    """
+    多个查询一起检索 (同一用户、同一偏好)：
+    一次批量向量化；量化索引模式下所有查询共用一次粗排扫描，其余模式逐个查询检索
+    :param stats_list: 可选，与 queries 同序的字典列表，含义同 retrieve_docs 的 stats
+    :return: 与 queries 同序的结果列表，每项与 retrieve_docs 的返回值相同
+    """
+    stats_list = stats_list if stats_list is not None else [{} for _ in queries]
+    for stats in stats_list:
+        stats["fetched"], stats["exhausted"] = 0, True
+    if not queries:
+        return []
+    if exclusion is None and preferences:
+        exclusion = get_exclusion(preferences)
+
+    index = VectorDBManager.get_quantized_index()
+    shared = index is not None and index.docs is not None
+    db = None
+    if not shared:
+        db = VectorDBManager.get_vector_store()
+        if not db:
+            return [[] for _ in queries]
+    try:
+        query_vecs = embed_queries(queries)
+    except Exception as e:
+        print(f"❌ [Retriever] Embedding 模型加载失败: {e}")
+        return [[] for _ in queries]
+
+    mask = None
+    with span("vector_search"):
+        if index is not None:
+            from core.quantized_index import search_with_score_batch
+            mask = _usable_mask(exclusion, index) if shared else None
+            batch = search_with_score_batch(db, index, query_vecs, top_k, exclude=mask)
+        else:
+            batch = [db.similarity_search_by_vector_with_relevance_scores(vec, k=top_k) for vec in query_vecs]
+
+    with span("filtering"):
+        return [
+            _filter_results(results, top_k, score_threshold, exclusion, mask, stats)
+            for results, stats in zip(batch, stats_list)
+        ]
+
+
+def _filter_results(results, top_k: int, score_threshold: float, exclusion, mask, stats: dict) -> list:
+    """阈值过滤 + 忌口后置过滤 (忌口掩码已在检索阶段生效时跳过)"""
     # 格式化结果
     filtered_results = []
     print(f"🔎 [Retriever] 检索到 {len(results)} 条，阈值: {score_threshold}")
@@ -60,43 +387,23 @@ def retrieve_docs(query: str, top_k: int = 4, score_threshold: float = 1.0, pref
         print(f"   - {doc.metadata.get('name')} (Score: {score:.4f})")
         # 恢复正常的阈值过滤
         if score <= score_threshold:
-            filtered_results.append({
-                "id": doc.metadata.get('id', ''),          # 建议加上 ID
-                "name": doc.metadata.get('name', '未知'),
-                "tags": doc.metadata.get('tags', ''),
-                "image": doc.metadata.get('image', ''),
-                
-                # ✅【新增关键修改】提取步骤数据
-                "instructions": doc.metadata.get('instructions', []), 
-                
-                "content": doc.page_content,
-                "score": score
-            })
+            filtered_results.append(_format_doc(doc.metadata, doc.page_content, score))
+
+    # 结果按距离升序，尾部已超出阈值时再往后取也只会更远
+    stats["fetched"] = len(results)
+    stats["exhausted"] = len(results) < top_k or len(filtered_results) < len(results)
             
     # --- 后置过滤 (Post-Retrieval Filtering) based on User Preferences ---
-    if preferences:
+    if exclusion is not None and mask is None:
         final_results = []
-        dislikes = preferences.get("dislikes", [])
-        allergies = preferences.get("allergies", [])
-        
-        # 将不喜欢和过敏源合并检查
-        avoid_list = [x.lower() for x in (dislikes + allergies) if x]
-        
-        if avoid_list:
-            print(f"🛑 [Retriever] 正在过滤用户忌口: {avoid_list}")
-            for res in filtered_results:
-                # 检查菜品名称、标签和内容是否包含忌口词
-                text_to_check = (res['name'] + str(res['tags']) + res['content']).lower()
-                
-                is_safe = True
-                for word in avoid_list:
-                    if word in text_to_check:
-                        print(f"   -> 剔除 '{res['name']}' (包含忌口: {word})")
-                        is_safe = False
-                        break
-                
-                if is_safe:
-                    final_results.append(res)
-            return final_results
-
-    return filtered_results
\ No newline at end of file
+        print(f"🛑 [Retriever] 正在过滤用户忌口: {list(exclusion.words)}")
+        for res in filtered_results:
+            # 检查菜品名称、标签和内容是否包含忌口词 (按菜谱 id 记忆判定结果)
+            word = exclusion.excluded_by(res)
+            if word:
+                print(f"   -> 剔除 '{res['name']}' (包含忌口: {word})")
+            else:
+                final_results.append(res)
+        return final_results
+
+    return filtered_results
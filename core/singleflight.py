@@ -0,0 +1,63 @@
+import threading
+
+# ================= 请求合并 (Single-flight) =================
+# 同一时刻多个请求要做完全相同的工作 (同一个搜索、同一道菜的 Prompt 优化或封面生图) 时，
+# 只让第一个请求 (leader) 真正执行，其余请求等待并共享它的结果 (包括异常)。
+# 执行结束后立即移除 key，之后的请求会重新执行 (结果缓存是另一层的事)。
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        执行 fn(*args, **kwargs)；同一 key 正在执行时等待并返回那次的结果
+        :return: (结果, 是否共享了其他请求的结果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        if call.waiters:
+            print(f"🤝 [SingleFlight] {key} 合并了 {call.waiters} 个并发请求")
+        return call.result, False
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+# 进程内共享实例，key 用前缀区分: search: / refine: / cover:
+flights = SingleFlight()
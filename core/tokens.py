@@ -0,0 +1,31 @@
+import re
+
+# ================= Token 估算 =================
+# 只用来给 prompt 各部分分配预算，不需要和模型的 tokenizer 完全一致，
+# 也就不必为此引入 tiktoken 之类的依赖：
+#   - 中日韩字符大约 1 个字 1 个 token
+#   - 其他文本大约 4 个字符 1 个 token
+
+_CJK = re.compile(r"[　-〿぀-ヿ㐀-䶿一-鿿豈-﫿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, budget: int, marker: str = "…") -> str:
+    """截断到不超过 budget 个 token (保留开头)"""
+    if estimate_tokens(text) <= budget:
+        return text
+    # 二分查找最长的合格前缀
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo] + marker
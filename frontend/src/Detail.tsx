@@ -5,13 +5,29 @@ import type { Recipe } from './types';
 import { cn } from './lib/utils';
 import { useUser } from './context/UserContext';
 import { getNamespacedKey } from './lib/storage';
+import api from './lib/api';
 
 const RecipeDetail = () => {
     const navigate = useNavigate();
     const location = useLocation();
+    const { id } = useParams();
 
-    // In a real app, we might fetch by ID if state is missing
-    const recipe = location.state?.recipe as Recipe;
+    // Search results only carry summary fields; full steps come from GET /api/recipe/{id}
+    // (ETag + Cache-Control, so repeat views are served by the browser cache or a 304)
+    const [recipe, setRecipe] = useState<Recipe | undefined>(location.state?.recipe as Recipe);
+
+    useEffect(() => {
+        const recipeId = id || recipe?.recipe_id;
+        if (!recipeId || (recipe && recipe.steps?.length)) return;
+        api.get(`/api/recipe/${encodeURIComponent(recipeId)}`)
+            .then(res => setRecipe(prev => ({
+                ...res.data,
+                // Keep the cover and AI comment shown on the results page
+                cover_image: prev?.cover_image || res.data.cover_image,
+                message: prev?.message || res.data.message,
+            })))
+            .catch(err => console.error(err));
+    }, [id]);
 
     const [isFavorite, setIsFavorite] = useState(false);
     const { username } = useUser();
@@ -27,6 +43,7 @@ const RecipeDetail = () => {
     }, [recipe?.recipe_id, username]);
 
     const toggleFavorite = () => {
+        if (!recipe) return;
         // 1. Manage List of IDs
         const favKey = getNamespacedKey('aichef_favorites', username);
         const mapKey = getNamespacedKey('aichef_saved_recipes', username);
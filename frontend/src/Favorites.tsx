@@ -105,7 +105,7 @@ const FavoritesPage = () => {
                                 <div className="aspect-[4/3] relative bg-slate-100 overflow-hidden">
                                     {recipe.cover_image ? (
                                         <img
-                                            src={recipe.cover_image}
+                                            src={recipe.cover_thumbnail || recipe.cover_image}
                                             alt={recipe.recipe_name}
                                             className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-500"
                                         />
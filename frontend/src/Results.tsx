@@ -38,7 +38,8 @@ const ResultsPage = () => {
             const res = await api.post('/api/search', {
                 query: query,
                 limit: 5,
-                refinement: text
+                refinement: text,
+                summary_only: true
             });
 
             // 3. Update Recipes
@@ -70,7 +71,8 @@ const ResultsPage = () => {
             setError('');
 
             try {
-                const res = await api.post('/api/search', { query, limit: 5 });
+                // Cards only need name / tags / cover; steps are loaded by the detail page
+                const res = await api.post('/api/search', { query, limit: 5, summary_only: true });
 
                 // No Cache Saving
                 // sessionStorage.setItem(cacheKey, JSON.stringify(res.data));
@@ -229,7 +231,7 @@ const ResultsPage = () => {
                                     <div className="aspect-[4/3] bg-slate-100 relative overflow-hidden flex items-center justify-center">
                                         {recipe.cover_image ? (
                                             <img
-                                                src={recipe.cover_image}
+                                                src={recipe.cover_thumbnail || recipe.cover_image}
                                                 alt={recipe.recipe_name}
                                                 className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-500"
                                                 onError={(e) => {
@@ -10,6 +10,7 @@ export interface Recipe {
     recipe_name: string;
     tags: string[];
     cover_image: string | null;
+    cover_thumbnail?: string | null; // Local thumbnail for cards (falls back to cover_image)
     steps: RecipeStep[];
     message: string;
     match_score?: number; // Optional, for frontend display
@@ -1,55 +1,58 @@
-import json
 import os
+import sys
+
+# 将项目根目录加入系统路径，以便引用 core 模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.dataset import resolve_path, iter_records, write_records, output_path, RecordStore
 
 # --- 配置文件路径 ---
+# (以下路径均自动识别 .json / .jsonl / .jsonl.zst)
 # RAG 准备好的数据路径
 rag_file_path = 'data/recipe_rag_ready.json'
 # 原始包含详细步骤的数据路径
 raw_file_path = 'data/raw/recipeData_with_tags.json'
-# 输出文件路径
-output_file_path = 'data/rag_ready_final.json'
+# 输出文件路径 (后缀由 AICHEF_DATASET_FORMAT 决定，默认 .jsonl)
+output_file_path = output_path('data/rag_ready_final.json')
 
-print(f"正在读取文件...\n1. {rag_file_path}\n2. {raw_file_path}")
+rag_file = resolve_path(rag_file_path)
+raw_file = resolve_path(raw_file_path)
 
-# 1. 读取两个文件
-try:
-    with open(rag_file_path, 'r', encoding='utf-8') as f:
-        rag_data = json.load(f)
+print(f"正在读取文件...\n1. {rag_file or rag_file_path}\n2. {raw_file or raw_file_path}")
 
-    with open(raw_file_path, 'r', encoding='utf-8') as f:
-        raw_data = json.load(f)
-except FileNotFoundError as e:
-    print(f"\n❌ 错误：找不到文件 - {e.filename}")
+# 1. 检查两个文件
+missing = rag_file_path if not rag_file else (raw_file_path if not raw_file else None)
+if missing:
+    print(f"\n❌ 错误：找不到文件 - {missing}")
     print("请检查文件路径是否正确，或者脚本是否在根目录下运行。")
     exit()
 
-print(f"读取成功，开始合并 {len(rag_data)} 条数据...")
+# 原始数据按 recipeID 随机访问 (JSONL 走偏移索引，只在命中时读一行)
+raw_store = RecordStore(raw_file, key=lambda r: r.get('recipeID'))
+print(f"读取成功，开始流式合并 (原始数据 {len(raw_store)} 条)...")
 
 # 2. 循环合并
-count = 0
-for item in rag_data:
-    # 获取 RAG 数据里的 id (确保转换为字符串以防万一)
-    rec_id = str(item['metadata']['id'])
-    
-    # 构造原始数据里的 key (例如 "recipe_10001")
-    raw_key = f"recipe_{rec_id}"
-    
-    # 如果在原始数据里找到了这个菜谱
-    if raw_key in raw_data:
-        # 提取 instructions
-        steps = raw_data[raw_key].get('instructions', [])
-        
-        # 【关键】新增一个字段存步骤，不要覆盖 image
-        item['metadata']['instructions'] = steps
-        count += 1
-
-# 3. 保存为新文件
-# 确保存放输出文件的目录存在
-os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-
-with open(output_file_path, 'w', encoding='utf-8') as f:
-    json.dump(rag_data, f, ensure_ascii=False, indent=4)
+stats = {"count": 0}
+
+def merged_docs():
+    for item in iter_records(rag_file):
+        # 获取 RAG 数据里的 id (确保转换为字符串以防万一)
+        rec_id = str(item['metadata']['id'])
+
+        # 如果在原始数据里找到了这个菜谱 (旧 JSON 的 key 形如 "recipe_10001")
+        raw_recipe = raw_store.get(rec_id) or raw_store.get(f"recipe_{rec_id}")
+        if raw_recipe is not None:
+            # 提取 instructions
+            steps = raw_recipe.get('instructions', [])
+
+            # 【关键】新增一个字段存步骤，不要覆盖 image
+            item['metadata']['instructions'] = steps
+            stats["count"] += 1
+        yield item
+
+# 3. 保存为新文件 (write_records 会确保输出目录存在)
+with raw_store:
+    write_records(output_file_path, merged_docs(), key=lambda e: e['metadata']['id'])
 
 print("-" * 30)
-print(f"✅ 合并完成！成功更新了 {count} 条数据。")
-print(f"📁 新文件已保存为: {output_file_path}")
\ No newline at end of file
+print(f"✅ 合并完成！成功更新了 {stats['count']} 条数据。")
+print(f"📁 新文件已保存为: {output_file_path}")
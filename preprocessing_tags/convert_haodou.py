@@ -1,11 +1,15 @@
-import json
 import os
+import sys
+
+# 将项目根目录加入系统路径，以便引用 core 模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.dataset import resolve_path, iter_records, write_records, output_path
 
 # ================= 配置区域 =================
-# 输入文件名 (请确保该文件在同一目录下)
+# 输入文件名 (支持 .json / .jsonl / .jsonl.zst，自动识别)
 INPUT_FILE = 'data/recipeData-new1.json'
-# 输出文件名
-OUTPUT_FILE = 'data/recipeData_with_tags.json'
+# 输出文件名 (后缀由 AICHEF_DATASET_FORMAT 决定，默认 .jsonl)
+OUTPUT_FILE = output_path('data/recipeData_with_tags.json')
 
 # 标签规则字典：关键词 -> 对应的 Tag
 # 你可以在这里随意添加自己的规则
@@ -67,42 +71,33 @@ def generate_tags(recipe_name, ingredients_list):
 
 def main():
     # 检查文件是否存在
-    if not os.path.exists(INPUT_FILE):
+    input_file = resolve_path(INPUT_FILE)
+    if not input_file:
         print(f"错误：找不到文件 '{INPUT_FILE}'。请确保json文件在当前脚本运行目录下。")
         return
 
-    print(f"正在读取 {INPUT_FILE} ...")
-    try:
-        with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except Exception as e:
-        print(f"读取 JSON 失败: {e}")
-        return
+    print(f"正在流式读取 {input_file} ...")
 
-    print(f"开始处理 {len(data)} 条数据...")
-    
-    count = 0
-    # 遍历字典结构
-    for key, recipe in data.items():
-        r_name = recipe.get('recipeName', '')
-        r_ingredients = recipe.get('ingredients', [])
-        
-        # 生成并写入 tags
-        recipe['tags'] = generate_tags(r_name, r_ingredients)
-        
-        count += 1
-        if count % 1000 == 0:
-            print(f"已处理 {count} 条...")
+    def tagged_recipes():
+        count = 0
+        for recipe in iter_records(input_file):
+            r_name = recipe.get('recipeName', '')
+            r_ingredients = recipe.get('ingredients', [])
+
+            # 生成并写入 tags
+            recipe['tags'] = generate_tags(r_name, r_ingredients)
+
+            count += 1
+            if count % 1000 == 0:
+                print(f"已处理 {count} 条...")
+            yield recipe
 
-    print("处理完成，正在保存...")
-    
     try:
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            # ensure_ascii=False 保证中文不乱码
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        print(f"成功！文件已保存为: {OUTPUT_FILE}")
+        # 边读边写，紧凑格式 + recipeID 偏移索引，下游可按 id 随机访问
+        count = write_records(OUTPUT_FILE, tagged_recipes(), key=lambda r: r.get('recipeID'))
+        print(f"成功！共 {count} 条，文件已保存为: {OUTPUT_FILE}")
     except Exception as e:
-        print(f"保存文件失败: {e}")
+        print(f"处理或保存文件失败: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
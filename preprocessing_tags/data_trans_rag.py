@@ -1,9 +1,14 @@
-import json
 import os
+import sys
+
+# 将项目根目录加入系统路径，以便引用 core 模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.dataset import resolve_path, iter_records, write_records, output_path
+from core.ingredient_index import normalize_ingredients
 
 # ================= 配置 =================
-INPUT_FILE = 'data/recipeData_with_tags.json'  # 上一步生成的文件
-OUTPUT_FILE = 'data/recipe_rag_ready.json'     # 处理好准备入库的文件
+INPUT_FILE = 'data/recipeData_with_tags.json'                # 上一步生成的文件 (自动识别 .jsonl / .jsonl.zst)
+OUTPUT_FILE = output_path('data/recipe_rag_ready.json')      # 处理好准备入库的文件
 
 def serialize_recipe(recipe):
     """
@@ -68,58 +73,68 @@ def serialize_recipe(recipe):
     
     return serialized_text
 
+def build_rag_entry(recipe):
+    """将原始菜谱转换为 RAG 标准对象 (page_content + metadata)"""
+    # A. 生成用于向量化的文本 (Content)
+    text_content = serialize_recipe(recipe)
+
+    # B. 提取用于过滤的元数据 (Metadata)
+    # 比如：用户搜“不辣的菜”，就可以用 metadata 中的 tags 过滤
+    metadata = {
+        "id": recipe.get('recipeID'),
+        "name": recipe.get('recipeName'),
+        "tags": recipe.get('tags', []),
+        # 归一化的食材名 (不含用量)，入库时据此生成食材位图索引
+        "ingredients": normalize_ingredients(
+            item.get('name', '') for item in recipe.get('ingredients', []) or [] if isinstance(item, dict)
+        ),
+        # 这里提取第一张图作为封面图，前端展示用
+        "image": ""
+    }
+
+    # 尝试提取图片链接
+    insts = recipe.get('instructions', [])
+    if insts and isinstance(insts[0], dict):
+        metadata['image'] = insts[0].get('imgLink', '')
+
+    # C. 组合成 RAG 标准对象
+    return {
+        "page_content": text_content, # 这是喂给 AI 看的
+        "metadata": metadata          # 这是给数据库过滤用的
+    }
+
 def main():
-    if not os.path.exists(INPUT_FILE):
+    input_file = resolve_path(INPUT_FILE)
+    if not input_file:
         print(f"找不到 {INPUT_FILE}，请确认文件名。")
         return
 
-    print("正在读取数据...")
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    rag_docs = []
-    
+    print(f"正在流式读取数据: {input_file}")
     print("正在序列化文本...")
-    count = 0
-    for key, recipe in data.items():
-        # A. 生成用于向量化的文本 (Content)
-        text_content = serialize_recipe(recipe)
-        
-        # B. 提取用于过滤的元数据 (Metadata)
-        # 比如：用户搜“不辣的菜”，就可以用 metadata 中的 tags 过滤
-        metadata = {
-            "id": recipe.get('recipeID'),
-            "name": recipe.get('recipeName'),
-            "tags": recipe.get('tags', []),
-            # 这里提取第一张图作为封面图，前端展示用
-            "image": "" 
-        }
-        
-        # 尝试提取图片链接
-        insts = recipe.get('instructions', [])
-        if insts and isinstance(insts[0], dict):
-            metadata['image'] = insts[0].get('imgLink', '')
-
-        # C. 组合成 RAG 标准对象
-        entry = {
-            "page_content": text_content, # 这是喂给 AI 看的
-            "metadata": metadata          # 这是给数据库过滤用的
-        }
-        rag_docs.append(entry)
-        count += 1
-
-    # 保存
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(rag_docs, f, ensure_ascii=False, indent=4)
+
+    first = {}
+
+    def rag_docs():
+        for recipe in iter_records(input_file):
+            entry = build_rag_entry(recipe)
+            if not first:
+                first.update(entry)
+            yield entry
+
+    # 边读边写，不再把全部文档攒在内存里
+    count = write_records(OUTPUT_FILE, rag_docs(), key=lambda e: e['metadata']['id'])
 
     print(f"成功转换 {count} 条数据！")
     print(f"文件已保存为: {OUTPUT_FILE}")
-    
+
+    if not first:
+        return
+
     # 打印一个示例给用户看
     print("\n====== [示例] 序列化后的文本内容 ======")
-    print(rag_docs[0]['page_content'])
+    print(first['page_content'])
     print("\n====== [示例] 提取的 Metadata ======")
-    print(rag_docs[0]['metadata'])
+    print(first['metadata'])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
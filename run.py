@@ -1,3 +1,4 @@
+import argparse
 import uvicorn
 import os
 import sys
@@ -8,8 +9,30 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动 AIChef RAG 服务")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("AICHEF_WORKERS", "1")),
+                        help="worker 进程数；大于 1 时默认启用共享 mmap 索引")
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    # 写入环境变量，让每个 worker 子进程里的 core.config 读到相同的配置
+    os.environ["AICHEF_WORKERS"] = str(workers)
+
     print("🚀 正在启动 AIChef RAG 服务...")
     print("📡 接口文档地址: http://127.0.0.1:8000/docs")
+
+    if workers > 1:
+        # 多 worker 模式：向量矩阵和已解码的文档以只读 mmap 方式打开，
+        # 所有 worker 通过页缓存共享同一份物理内存 (需要先入库或执行 python -m core.quantized_index build)
+        from core.config import QUANT_INDEX_DIR, SHARED_INDEX
+        from core.quantized_index import DOC_OFFSETS_FILE
+        if SHARED_INDEX and not os.path.exists(os.path.join(QUANT_INDEX_DIR, DOC_OFFSETS_FILE)):
+            print(f"⚠️ 未找到共享索引 {QUANT_INDEX_DIR}，各 worker 将回退到各自加载 Chroma。")
+            print("👉 请先执行: python -m core.quantized_index build")
+        print(f"🧩 多 worker 模式: {workers} 个进程 (共享索引: {SHARED_INDEX})")
+        # reload 与多 worker 互斥
+        uvicorn.run("app.main:app", host="0.0.0.0", port=8000, workers=workers)
+        sys.exit(0)
     
     # 启动 Uvicorn 服务器
     # 参数解析:
@@ -0,0 +1,34 @@
+import pytest
+
+from core.query_rules import rewrite_locally
+
+QUERY = "红烧鸡翅"
+
+
+@pytest.mark.parametrize("refinement, expected", [
+    ("不要辣", "红烧鸡翅 不辣 清淡"),
+    ("不要太辣", "红烧鸡翅 不辣 清淡"),
+    ("微辣", "红烧鸡翅 微辣"),
+    ("少辣", "红烧鸡翅 微辣"),
+    ("微辣吧", "红烧鸡翅 微辣"),
+    ("清淡一点", "红烧鸡翅 清淡"),
+    ("我想要辣一点的", "红烧鸡翅 香辣"),
+    ("重口味", "红烧鸡翅 香辣"),
+    ("简单点", "红烧鸡翅 快手 简单"),
+    ("不吃辣，简单一点", "红烧鸡翅 不辣 清淡 快手 简单"),
+    ("素一点", "红烧鸡翅 素菜"),
+    ("下饭", "红烧鸡翅 下饭"),
+    ("想喝汤", "红烧鸡翅 汤"),
+])
+def test_rewrite_locally(refinement, expected):
+    assert rewrite_locally(QUERY, refinement) == expected
+
+
+@pytest.mark.parametrize("refinement", [
+    "",
+    "   ",
+    "用空气炸锅做",
+    "不要辣，用空气炸锅做",
+])
+def test_unknown_refinement_falls_back_to_llm(refinement):
+    assert rewrite_locally(QUERY, refinement) is None
@@ -0,0 +1,114 @@
+"""
+用户数据库并发读写基准测试 (本地工具)
+
+用法 (在项目根目录运行):
+    python tools/bench_sqlite.py
+    python tools/bench_sqlite.py --readers 16 --writers 4 --seconds 5
+
+在临时目录里建两份同样的 users 库，分别用
+  - baseline   : 旧配置 (默认 journal_mode=DELETE，只有 check_same_thread=False)
+  - production : core.database.create_sqlite_engine (WAL + busy_timeout + 连接池)
+并发执行 "按用户名查询" 与 "更新偏好 / 自动建用户"，对比吞吐和 "database is locked" 次数。
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError, IntegrityError
+from sqlalchemy.orm import sessionmaker
+from core.database import Base, create_sqlite_engine
+from app import sql_models
+
+SEED_USERS = 1000
+
+
+def _baseline_engine(db_path: str):
+    return create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+
+
+def _seed(engine):
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.add_all(sql_models.User(username=f"user_{i}", preferences={}) for i in range(SEED_USERS))
+        db.commit()
+
+
+def _run(engine, readers: int, writers: int, seconds: float):
+    Session = sessionmaker(bind=engine, autoflush=False)
+    stop = time.monotonic() + seconds
+    counts = {"read": 0, "write": 0, "locked": 0, "error": 0}
+    lock = threading.Lock()
+
+    def bump(key):
+        with lock:
+            counts[key] += 1
+
+    def reader():
+        rng = random.Random()
+        while time.monotonic() < stop:
+            try:
+                with Session() as db:
+                    name = f"user_{rng.randrange(SEED_USERS)}"
+                    db.query(sql_models.User).filter(sql_models.User.username == name).first()
+                bump("read")
+            except OperationalError as e:
+                bump("locked" if "locked" in str(e) else "error")
+
+    def writer():
+        rng = random.Random()
+        while time.monotonic() < stop:
+            try:
+                with Session() as db:
+                    if rng.random() < 0.2:
+                        # 模拟自动注册新用户
+                        db.add(sql_models.User(username=f"new_{rng.getrandbits(48)}", preferences={}))
+                    else:
+                        user = db.get(sql_models.User, rng.randrange(1, SEED_USERS + 1))
+                        user.preferences = {"dislikes": [str(rng.random())]}
+                    db.commit()
+                bump("write")
+            except IntegrityError:
+                bump("error")
+            except OperationalError as e:
+                bump("locked" if "locked" in str(e) else "error")
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 并发读写基准测试")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"🏁 readers={args.readers}, writers={args.writers}, 每组 {args.seconds:.0f}s")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, factory in (("baseline", _baseline_engine), ("production", create_sqlite_engine)):
+            engine = factory(os.path.join(tmp, f"{name}.db"))
+            _seed(engine)
+            counts = _run(engine, args.readers, args.writers, args.seconds)
+            engine.dispose()
+            print(
+                f"   - {name:<10} 读 {counts['read'] / args.seconds:8.0f}/s  "
+                f"写 {counts['write'] / args.seconds:7.0f}/s  "
+                f"locked {counts['locked']:5d}  其他错误 {counts['error']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
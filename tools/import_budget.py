@@ -0,0 +1,120 @@
+"""
+导入耗时预算检查 (本地工具，不依赖 CI)
+
+用法 (在项目根目录运行):
+    python tools/import_budget.py                 # 检查 app.main
+    python tools/import_budget.py --module core.retriever --budget-ms 300
+    python tools/import_budget.py --top 30        # 多打印一些最慢的模块
+
+做两件事：
+1. 用 `python -X importtime` 在干净的子进程里测量导入耗时，超出预算返回非 0 退出码
+2. 检查导入后 sys.modules 里没有出现重型依赖 (torch / langchain_* / onnxruntime ...)，
+   它们只应该在真正需要向量化、检索或调用 LLM 的代码路径里被导入
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 各入口模块的导入耗时预算 (毫秒)。调整依赖后请重新测量，再更新这里
+BUDGETS_MS = {
+    "app.main": 1000,
+    "core.retriever": 300,
+    "core.generator": 300,
+}
+
+# 导入入口模块后不允许出现在 sys.modules 里的重型依赖
+HEAVY_MODULES = [
+    "torch",
+    "transformers",
+    "sentence_transformers",
+    "onnxruntime",
+    "chromadb",
+    "langchain_huggingface",
+    "langchain_chroma",
+    "langchain_openai",
+]
+
+
+def _run(code: str, extra_args=()):
+    env = dict(os.environ)
+    # 只测导入，不触发后台预热
+    env["AICHEF_WARMUP"] = "0"
+    return subprocess.run(
+        [sys.executable, *extra_args, "-c", code],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True,
+    )
+
+
+def measure(module: str):
+    """返回 (总耗时 ms, [(累计 ms, 模块名)])，只统计顶层导入"""
+    result = _run(f"import {module}", ("-X", "importtime"))
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr}")
+
+    total_us = 0
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        cumulative_us, name = _parse(line)
+        entries.append((cumulative_us / 1000, name.strip()))
+        # 顶层导入 (模块名前没有缩进) 的累计耗时之和 == 总导入耗时
+        if not name.startswith(" "):
+            total_us += cumulative_us
+    entries.sort(reverse=True)
+    return total_us / 1000, entries
+
+
+def _parse(line: str):
+    # 格式: "import time:       123 |        456 |   package.module"
+    # 模块名前的缩进表示嵌套层级 (分隔符后固定有一个空格)
+    _, cumulative, name = line.split("|", 2)
+    return int(cumulative), name[1:]
+
+
+def loaded_heavy_modules(module: str):
+    code = (
+        "import json, sys\n"
+        f"import {module}\n"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    result = _run(code)
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查模块导入耗时预算")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--budget-ms", type=float, default=None)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    budget = args.budget_ms or BUDGETS_MS.get(args.module, 1000)
+    total_ms, entries = measure(args.module)
+    heavy = loaded_heavy_modules(args.module)
+
+    print(f"📦 import {args.module}: {total_ms:.0f} ms (预算 {budget:.0f} ms)")
+    print(f"   最慢的 {args.top} 个模块 (累计耗时):")
+    for cumulative_ms, name in entries[:args.top]:
+        print(f"   {cumulative_ms:8.1f} ms  {name}")
+
+    ok = True
+    if total_ms > budget:
+        print(f"❌ 超出预算 {total_ms - budget:.0f} ms")
+        ok = False
+    if heavy:
+        print(f"❌ 导入时加载了重型依赖: {', '.join(heavy)}")
+        ok = False
+    if ok:
+        print("✅ 导入耗时在预算内，且没有提前加载重型依赖")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()